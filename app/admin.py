@@ -1,5 +1,15 @@
-from django.contrib import admin
-from .models import Balance, Transaction, TransactionType
+import datetime
+
+from django.contrib import admin, messages
+from django.contrib.admin import actions as admin_actions, helpers
+from django.contrib.admin.views.main import ORDER_VAR, PAGE_VAR
+from django.core.exceptions import ValidationError
+from django.db import router, transaction
+from django.http import HttpResponseRedirect
+from django.template.response import TemplateResponse
+from .models import Balance, ExchangeRate, RecurringTransaction, ShardAssignment, Transaction, TransactionType
+from . import archive, bulk, pagination, rollups, shards
+from .pagination import EstimatedCountPaginator
 from django.forms import HiddenInput
 from django.contrib.auth import get_user_model
 from django import forms
@@ -7,8 +17,38 @@ from django import forms
 User = get_user_model()
 
 
+class CategoryListFilter(admin.SimpleListFilter):
+    """The signed-in user's own categories, rather than every user's."""
+    title = 'category'
+    parameter_name = 'category'
+
+    def lookups(self, request, model_admin):
+        return TransactionType.objects.filter(added_by=request.user).order_by('name').values_list('pk', 'name')
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(category_id=self.value())
+        return queryset
+
+
+class RecategorizeForm(forms.Form):
+    category = forms.ModelChoiceField(queryset=TransactionType.objects.none())
+
+    def __init__(self, *args, user, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['category'].queryset = TransactionType.objects.filter(added_by=user).order_by('name')
+
+
 class TransactionAdmin(admin.ModelAdmin):
-    list_display = ('name', 'amount', 'date', 'transaction_type',  'transaction_of','category')
+    list_display = ('name', 'amount', 'currency', 'date', 'transaction_type',  'transaction_of','category')
+    list_select_related = ('transaction_of', 'category')
+    # Both are served by the (transaction_of, ...) indexes, as is date_hierarchy.
+    list_filter = ('transaction_type', CategoryListFilter)
+    date_hierarchy = 'date'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['delete_selected', 'recategorize']
+
     class Meta:
         model = Transaction
         fields = '__all__'
@@ -26,11 +66,80 @@ class TransactionAdmin(admin.ModelAdmin):
 
     def get_queryset(self, request): 
         qs = super().get_queryset(request) 
-        return qs.filter(category__added_by=request.user)
- 
+        # The owner column is indexed; no join through the category.
+        return qs.filter(transaction_of=request.user)
+
+    # Changelist parameters the rollups can count for.
+    ROLLUP_PARAMS = {ORDER_VAR, PAGE_VAR, 'date__year', 'date__month', 'date__day', 'transaction_type__exact',
+                     'category'}
+
+    def rollup_count(self, request):
+        """The changelist's row count read from the rollups, or None if it is filtered in a way they can't count."""
+        params = request.GET
+        if not set(params) <= self.ROLLUP_PARAMS:
+            return None
+        # The rollups still count archived rows, which the changelist doesn't list.
+        if archive.newest(request.user) is not None:
+            return None
+        try:
+            year, month, day = (int(params[name]) if params.get(name) else None
+                                for name in ('date__year', 'date__month', 'date__day'))
+            period = datetime.date(year, month or 1, day or 1) if year else None
+            category_id = int(params['category']) if params.get('category') else None
+        except ValueError:
+            return None
+        granularity = 'day' if day else 'month' if month else 'year'
+        return rollups.transaction_count(request.user, granularity, period, params.get('transaction_type__exact'),
+                                         category_id)
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, count=self.rollup_count(request))
+
+    def delete_queryset(self, request, queryset):
+        bulk.delete(queryset)
+
+    # Deletes that would overdraw a balance raise ValidationError and are
+    # refused as a whole.
+
+    @admin.action(permissions=['delete'], description=admin_actions.delete_selected.short_description)
+    def delete_selected(self, request, queryset):
+        try:
+            with transaction.atomic(using=router.db_for_write(Transaction)):
+                return admin_actions.delete_selected(self, request, queryset)
+        except ValidationError as e:
+            self.message_user(request, e.messages[0], messages.ERROR)
+            return None
+
+    def delete_view(self, request, object_id, extra_context=None):
+        try:
+            return super().delete_view(request, object_id, extra_context)
+        except ValidationError as e:
+            self.message_user(request, e.messages[0], messages.ERROR)
+            return HttpResponseRedirect(request.path)
+
+    @admin.action(description='Move selected transactions to another category')
+    def recategorize(self, request, queryset):
+        form = RecategorizeForm(request.POST if 'apply' in request.POST else None, user=request.user)
+        if form.is_valid():
+            category = form.cleaned_data['category']
+            moved = bulk.recategorize(queryset, category)
+            self.message_user(request, f"Moved {moved} transactions to '{category}'.", messages.SUCCESS)
+            return None
+        return TemplateResponse(request, 'admin/recategorize_transactions.html', {
+            **self.admin_site.each_context(request),
+            'title': 'Move transactions to another category',
+            'opts': self.model._meta,
+            'form': form,
+            'selected': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+            'select_across': request.POST.get('select_across', '0'),
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        })
+
 
 class TransactionTypeAdmin(admin.ModelAdmin):
     list_display = ('name',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     def get_queryset(self, request):
         qs = super().get_queryset(request)
@@ -38,14 +147,70 @@ class TransactionTypeAdmin(admin.ModelAdmin):
 
 
 class BalanceAdmin(admin.ModelAdmin):
-    list_display = ('balance',)
+    list_display = ('balance_of', 'balance')
+    list_select_related = ('balance_of',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     def get_queryset(self, request):
         qs = super().get_queryset(request)
         return qs.filter(balance_of=request.user)
 
+class RecurringTransactionAdmin(admin.ModelAdmin):
+    list_display = ('name', 'amount', 'currency', 'transaction_type', 'frequency', 'interval', 'next_date', 'end_date')
+
+    def get_form(self, request, obj=None, **kwargs):
+        form = super().get_form(request, obj, **kwargs)
+        form.base_fields["category"].queryset = TransactionType.objects.filter(added_by=request.user)
+        form.base_fields['recurring_of'].queryset = User.objects.filter(pk=request.user.pk)
+        form.base_fields['recurring_of'].initial = request.user.pk
+        return form
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request)
+        return qs.filter(recurring_of=request.user)
+
+class ExchangeRateAdmin(admin.ModelAdmin):
+    list_display = ('currency', 'date', 'rate')
+    list_filter = ('currency',)
+    date_hierarchy = 'date'
+
+class ShardListFilter(admin.SimpleListFilter):
+    title = 'shard'
+    parameter_name = 'database'
+
+    def lookups(self, request, model_admin):
+        # One bounded count per shard, queried on all of them at once.
+        counts = shards.fan_out(lambda database: pagination.bounded_count(Transaction.objects.using(database)))
+        return [(database, f'{database} ({self.describe(count)} transactions)') for database, count in counts.items()]
+
+    @staticmethod
+    def describe(count):
+        return f'over {pagination.EXACT_COUNT_LIMIT}' if count > pagination.EXACT_COUNT_LIMIT else str(count)
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(database=self.value())
+        return queryset
+
+
+class ShardAssignmentAdmin(admin.ModelAdmin):
+    list_display = ('shard_of', 'database', 'moving', 'updated_at')
+    list_filter = (ShardListFilter, 'moving')
+    readonly_fields = ('shard_of', 'database', 'moving', 'updated_at')
+
+    # Users are placed when first seen and moved with rebalance_shards.
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
 admin.site.register(Transaction, TransactionAdmin)
 admin.site.register(TransactionType, TransactionTypeAdmin)
 admin.site.register(Balance, BalanceAdmin)
+admin.site.register(RecurringTransaction, RecurringTransactionAdmin)
+admin.site.register(ExchangeRate, ExchangeRateAdmin)
+admin.site.register(ShardAssignment, ShardAssignmentAdmin)
 
 
 # panel customization
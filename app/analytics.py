@@ -0,0 +1,206 @@
+"""
+Per-user statistics computed on columnar NumPy arrays.
+
+A user's transactions are read once into parallel arrays (days since the
+epoch, base-currency amounts in integer cents, an income flag and category
+codes) and every statistic is a handful of vectorised operations over them:
+``bincount`` for grouping, ``cumsum`` for rolling windows, ``percentile``
+and ``std`` for distributions.
+
+Loaded columns are kept in a small per-process cache keyed on the user's
+data version (see :mod:`app.caching`), so any write to the user's data
+makes the next request reload them.
+"""
+import heapq
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+
+from . import archive, caching
+from .models import ArchivedTransaction, Transaction
+
+COLUMN_CACHE_SIZE = getattr(settings, 'ANALYTICS_COLUMN_CACHE_SIZE', 64)
+DEFAULT_WINDOW = 30
+MAX_WINDOW = 365
+PERCENTILES = (50, 75, 90, 95, 99)
+
+EPOCH = np.datetime64('1970-01-01', 'D')
+
+
+class Columns:
+    """One user's transactions, archived ones included, as parallel arrays, oldest first."""
+
+    def __init__(self, days, cents, income, category, categories):
+        self.days = days
+        self.cents = cents
+        self.income = income
+        self.category = category
+        self.categories = categories
+
+    def __len__(self):
+        return len(self.days)
+
+    @classmethod
+    def load(cls, user_id):
+        models = [Transaction] if archive.newest(user_id) is None else [Transaction, ArchivedTransaction]
+        rows = list(heapq.merge(*(
+            model.objects
+            .filter(transaction_of_id=user_id)
+            .order_by('date', 'pk')
+            .values_list('date', 'base_amount', 'transaction_type', 'category_id', 'category__name')
+            for model in models
+        ), key=lambda row: row[0]))
+        count = len(rows)
+        epoch = EPOCH.item()
+        days = np.fromiter(((date - epoch).days for date, *_ in rows), dtype=np.int32, count=count)
+        cents = np.fromiter((int(amount * 100) for _, amount, *_ in rows), dtype=np.int64, count=count)
+        income = np.fromiter((kind == 'income' for _, _, kind, *_ in rows), dtype=bool, count=count)
+        codes = {}
+        categories = []
+        for *_, category_id, name in rows:
+            if category_id not in codes:
+                codes[category_id] = len(categories)
+                categories.append((category_id, name))
+        category = np.fromiter((codes[row[3]] for row in rows), dtype=np.int32, count=count)
+        return cls(days, cents, income, category, categories)
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def columns(user_id):
+    """Return the user's Columns, reloading them after any write."""
+    version = caching.data_version(user_id)
+    with _cache_lock:
+        cached = _cache.get(user_id)
+        if cached is not None and cached[0] == version:
+            _cache.move_to_end(user_id)
+            return cached[1]
+    loaded = Columns.load(user_id)
+    with _cache_lock:
+        _cache[user_id] = (version, loaded)
+        _cache.move_to_end(user_id)
+        while len(_cache) > COLUMN_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return loaded
+
+
+def _money(cents):
+    """Cents (array or scalar) to a list or float of currency units."""
+    return np.round(np.asarray(cents, dtype=np.float64) / 100, 2).tolist()
+
+
+def _months(days):
+    """Month index (months since January 1970) of each day number."""
+    return (EPOCH + days).astype('datetime64[M]').astype(np.int64)
+
+
+def _month_labels(first, count):
+    return [str(month) for month in np.datetime64('1970-01', 'M') + np.arange(first, first + count)]
+
+
+def monthly(cols):
+    """
+    Income, expenses, net, month-over-month expense change and savings rate
+    for every month from the first transaction to the last.
+
+    The savings rate is ``net / income`` and ``None`` for months without
+    income; the change for the first month is ``None``.
+    """
+    if not len(cols):
+        return {'months': [], 'income': [], 'expense': [], 'net': [], 'expense_change': [],
+                'expense_change_pct': [], 'savings_rate': []}
+    months = _months(cols.days)
+    first = int(months.min())
+    offset = months - first
+    size = int(offset.max()) + 1
+    income = np.bincount(offset, weights=np.where(cols.income, cols.cents, 0), minlength=size)
+    expense = np.bincount(offset, weights=np.where(cols.income, 0, cols.cents), minlength=size)
+    net = income - expense
+    change = np.diff(expense)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        change_pct = np.where(expense[:-1] > 0, change / expense[:-1] * 100, np.nan)
+        savings = np.where(income > 0, net / income * 100, np.nan)
+    return {
+        'months': _month_labels(first, size),
+        'income': _money(income),
+        'expense': _money(expense),
+        'net': _money(net),
+        'expense_change': [None] + _money(change),
+        'expense_change_pct': [None] + _percentages(change_pct),
+        'savings_rate': _percentages(savings),
+    }
+
+
+def _percentages(values):
+    return [None if np.isnan(value) else round(float(value), 2) for value in values]
+
+
+def rolling(cols, window=DEFAULT_WINDOW):
+    """
+    Daily expenses and their trailing ``window``-day average, one point per
+    calendar day from the first expense to the last.
+    """
+    expense = ~cols.income
+    if not expense.any():
+        return {'window': window, 'dates': [], 'daily': [], 'average': []}
+    days = cols.days[expense]
+    first = int(days.min())
+    daily = np.bincount(days - first, weights=cols.cents[expense])
+    total = np.concatenate(([0], np.cumsum(daily)))
+    index = np.arange(1, len(daily) + 1)
+    start = np.maximum(index - window, 0)
+    # Windows that would start before the first expense average over the days so far.
+    average = (total[index] - total[start]) / (index - start)
+    dates = (EPOCH + first + np.arange(len(daily))).astype(str).tolist()
+    return {'window': window, 'dates': dates, 'daily': _money(daily), 'average': _money(average)}
+
+
+def spending(cols):
+    """
+    Percentiles of individual expense amounts, and per category the mean and
+    standard deviation of monthly spending with their ratio (volatility).
+
+    Each category's months run from its own first month with spending to the
+    last month with any expense, so quiet months count as zero spending.
+    """
+    expense = ~cols.income
+    if not expense.any():
+        return {'percentiles': {}, 'categories': []}
+    cents = cols.cents[expense]
+    percentiles = dict(zip((f'p{p}' for p in PERCENTILES), _money(np.percentile(cents, PERCENTILES))))
+
+    months = _months(cols.days[expense])
+    first = int(months.min())
+    size = int(months.max()) - first + 1
+    category = cols.category[expense]
+    grid = np.bincount(category * size + (months - first), weights=cents,
+                       minlength=len(cols.categories) * size).reshape(len(cols.categories), size)
+    active = grid > 0
+    # Each category's span starts at its first month with spending.
+    starts = np.where(active.any(axis=1), active.argmax(axis=1), size)
+    in_span = np.arange(size) >= starts[:, None]
+    span = in_span.sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(span > 0, grid.sum(axis=1) / span, 0)
+        variance = np.where(span > 0, ((grid - mean[:, None]) ** 2 * in_span).sum(axis=1) / span, 0)
+        std = np.sqrt(variance)
+        volatility = np.where(mean > 0, std / mean, np.nan)
+
+    rows = [
+        {
+            'category_id': category_id,
+            'category': name,
+            'months': int(span[code]),
+            'mean_monthly': _money(mean[code]),
+            'std_monthly': _money(std[code]),
+            'volatility': None if np.isnan(volatility[code]) else round(float(volatility[code]), 4),
+        }
+        for code, (category_id, name) in enumerate(cols.categories)
+        if span[code]
+    ]
+    rows.sort(key=lambda row: row['mean_monthly'], reverse=True)
+    return {'percentiles': percentiles, 'categories': rows}
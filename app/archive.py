@@ -0,0 +1,173 @@
+"""
+Archiving old transactions.
+
+``manage.py archive_transactions`` moves transactions dated more than
+``settings.ARCHIVE_AFTER_DAYS`` ago from Transaction to
+ArchivedTransaction, oldest first and a batch at a time, so the hot table,
+its indexes and the search index only hold the recent history. Each batch
+is its own database transaction; an interrupted run carries on where it
+stopped when started again.
+
+Archiving changes where a row is kept, not what it counts for. The rollup
+buckets stay as they are and serve as the precomputed yearly and monthly
+aggregates of the archive, and the balance and ledger are untouched, so the
+summary endpoints and the forecast never notice. Listings and exports only
+read the archive when the requested range reaches it: :func:`keyset_page`
+stays on the hot table while the page ends after the newest archived date,
+and :func:`needed` is a single indexed EXISTS query.
+
+Archived rows keep the ids they had as transactions. Those come from the
+Transaction table's sequence, so ``(date, id)`` orders hot and archived
+rows together and the cursors of ``app.pagination`` work across both.
+Archived rows are read-only and can't be searched.
+"""
+import datetime
+import heapq
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Max
+
+from . import caching, pagination, shards
+from .models import ArchivedTransaction, Transaction
+from .serializers import transaction_values
+
+ARCHIVE_AFTER_DAYS = getattr(settings, 'ARCHIVE_AFTER_DAYS', 2 * 365)
+DEFAULT_BATCH_SIZE = 1000
+
+# Copied from each transaction besides its id.
+FIELDS = ('name', 'amount', 'currency', 'base_amount', 'date', 'transaction_type', 'transaction_of_id',
+          'category_id', 'remarks', 'change_version')
+
+
+def horizon(today=None):
+    """The earliest date that is kept in the Transaction table."""
+    return (today or datetime.date.today()) - datetime.timedelta(days=ARCHIVE_AFTER_DAYS)
+
+
+def _key(row):
+    return row['date'], row['pk']
+
+
+def newest(user, using=None):
+    """The date of the user's newest archived transaction, or None when nothing is archived."""
+    archived = ArchivedTransaction.objects.using(using).filter(transaction_of=user)
+    return archived.aggregate(newest=Max('date'))['newest']
+
+
+def _in_range(user, start, end):
+    archived = ArchivedTransaction.objects.filter(transaction_of=user)
+    if start is not None:
+        archived = archived.filter(date__gte=start)
+    if end is not None:
+        archived = archived.filter(date__lte=end)
+    return archived
+
+
+def needed(user, start=None, end=None):
+    """Whether any of the user's archived transactions fall between ``start`` and ``end``."""
+    return _in_range(user, start, end).exists()
+
+
+async def aneeded(user, start=None, end=None):
+    """Async counterpart of :func:`needed`."""
+    return await _in_range(user, start, end).aexists()
+
+
+def keyset_page(user, cursor=None, limit=pagination.DEFAULT_PAGE_SIZE):
+    """
+    :func:`app.pagination.keyset_page` over the user's hot and archived
+    transactions together, newest first.
+    """
+    rows, next_cursor = pagination.keyset_page(
+        transaction_values(Transaction.objects.filter(transaction_of=user)), cursor, limit)
+    archived_through = newest(user)
+    if archived_through is None or (next_cursor is not None and rows[-1]['date'] > archived_through):
+        return rows, next_cursor
+    archived, archived_cursor = pagination.keyset_page(
+        transaction_values(ArchivedTransaction.objects.filter(transaction_of=user)), cursor, limit)
+    merged = sorted(rows + archived, key=_key, reverse=True)
+    rows = merged[:limit]
+    more = len(merged) > limit or next_cursor is not None or archived_cursor is not None
+    return rows, pagination.encode_cursor(*_key(rows[-1])) if more else None
+
+
+def stream(user, cursor=None, using=None, chunk_size=pagination.STREAM_CHUNK_SIZE):
+    """Lazily iterate the user's hot and archived transaction rows newest first, read from ``using``."""
+    def rows(model):
+        queryset = transaction_values(model.objects.using(using).filter(transaction_of=user))
+        return pagination.after_cursor(pagination.order_newest_first(queryset), cursor).iterator(chunk_size=chunk_size)
+
+    if newest(user, using=using) is None:
+        return rows(Transaction)
+    return heapq.merge(rows(Transaction), rows(ArchivedTransaction), key=_key, reverse=True)
+
+
+def archive_batch(user_id, before, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Move up to ``batch_size`` of the user's oldest transactions dated
+    before ``before`` to the archive; returns how many were moved.
+    """
+    with shards.for_user(user_id):
+        using = router.db_for_write(Transaction)
+        with transaction.atomic(using=using):
+            rows = list(
+                Transaction.objects.using(using)
+                .select_for_update()
+                .filter(transaction_of_id=user_id, date__lt=before)
+                .order_by('date', 'pk')
+                .values('pk', *FIELDS)[:batch_size]
+            )
+            if not rows:
+                return 0
+            ids = [row.pop('pk') for row in rows]
+            ArchivedTransaction.objects.using(using).bulk_create(
+                [ArchivedTransaction(id=pk, **row) for pk, row in zip(ids, rows)])
+            # No signals: the rows are moving, not being deleted, so the
+            # rollups, balance and ledger stay as they are.
+            moved = Transaction.objects.using(using).filter(pk__in=ids)
+            moved._raw_delete(using)
+            caching.bump_version(user_id)
+    return len(rows)
+
+
+def _pending_users(before, users):
+    pending = Transaction.objects.filter(date__lt=before)
+    if users is not None:
+        pending = pending.filter(transaction_of__in=users)
+    return list(pending.order_by('transaction_of').values_list('transaction_of', flat=True).distinct())
+
+
+def archive(before=None, users=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Archive the transactions of all users (or the given user ids) dated
+    before ``before``, by default :func:`horizon`; yields
+    ``(user_id, moved)`` after each batch. Users being moved to another
+    shard are skipped.
+    """
+    before = before or horizon()
+    found = shards.fan_out(lambda database: _pending_users(before, users))
+    for user_id in sorted(user_id for ids in found.values() for user_id in ids):
+        while True:
+            try:
+                moved = archive_batch(user_id, before, batch_size)
+            except shards.ShardMoving:
+                # Left for the next run.
+                break
+            if not moved:
+                break
+            yield user_id, moved
+
+
+def allocate_ids(objs, database):
+    """
+    Give archived rows being copied to ``database`` new ids from its
+    Transaction sequence, so they can't clash with its transactions.
+    """
+    placeholders = [Transaction(**{field: getattr(obj, field) for field in FIELDS}) for obj in objs]
+    Transaction.objects.using(database).bulk_create(placeholders, batch_size=500)
+    for start in range(0, len(placeholders), 500):
+        taken = Transaction.objects.using(database).filter(pk__in=[obj.pk for obj in placeholders[start:start + 500]])
+        taken._raw_delete(database)
+    for obj, placeholder in zip(objs, placeholders):
+        obj.pk = placeholder.pk
@@ -0,0 +1,320 @@
+"""
+Synthetic data and endpoint timings for measuring how the app scales.
+
+:func:`seed` bulk-inserts benchmark users with categories and transactions
+drawn from skewed, roughly realistic distributions (a few categories take
+most of the spending, expense amounts are log-normal, a minority of rows are
+larger incomes). :func:`run` times every URL in ``app/urls.py`` through the
+test client and reports latency percentiles, query counts and response sizes.
+
+Benchmark users share a username prefix so they can be removed again with
+:func:`clear`; nothing else in the database is touched.
+
+:func:`contention` measures SQLite under concurrent load instead: several
+processes read and write a scratch database at once, first with SQLite's
+default settings and then with the configured pragmas and transaction mode.
+"""
+import datetime
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import caching, exporters, ledger, rollups, urls
+from .models import Transaction, TransactionType
+from .serializers import transaction_values
+
+USERNAME_PREFIX = 'benchmark-'
+DEFAULT_CATEGORIES = 12
+DEFAULT_DAYS = 3 * 365
+INSERT_BATCH_SIZE = 2000
+INCOME_SHARE = 0.1
+
+CATEGORY_NAMES = (
+    'Groceries', 'Rent', 'Transport', 'Dining', 'Utilities', 'Shopping', 'Health', 'Travel',
+    'Entertainment', 'Education', 'Insurance', 'Gifts', 'Subscriptions', 'Pets', 'Fees', 'Misc',
+)
+MERCHANTS = ('Market', 'Store', 'Cafe', 'Online', 'Station', 'Pharmacy', 'Office', 'Services')
+
+# Endpoints that change data are not timed, nor ones keyed by something other than a transaction.
+UNSAFE = {'transaction_delete', 'job_status'}
+# Extra variants of listed endpoints worth timing on their own.
+VARIANTS = (
+    ('home[get_data]', 'home', {'action': 'get_data'}, {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}),
+    ('transaction_list[stream]', 'transaction_list', {'stream': '1'}, {}),
+    ('transaction_search[q]', 'transaction_search', {'q': 'cafe'}, {}),
+)
+
+
+def clear(prefix=USERNAME_PREFIX):
+    """Delete every benchmark user and, by cascade, their data."""
+    return User.objects.filter(username__startswith=prefix).delete()[1].get('auth.User', 0)
+
+
+def _amount(rng, transaction_type):
+    if transaction_type == 'income':
+        value = rng.lognormvariate(7.0, 0.5)
+    else:
+        value = min(rng.lognormvariate(3.0, 1.0), 5000)
+    return Decimal(max(value, 0.5)).quantize(Decimal('0.01'))
+
+
+def seed(users=1, transactions=1000, categories=DEFAULT_CATEGORIES, days=DEFAULT_DAYS,
+         prefix=USERNAME_PREFIX, random_seed=0):
+    """
+    Create ``users`` users with ``transactions`` transactions each.
+
+    Rows are spread uniformly over the last ``days`` days. Balances, ledger
+    entries and rollups are brought in line with the inserted rows, so the
+    data looks exactly as if it had been entered through the app. Returns
+    the created users.
+    """
+    rng = random.Random(random_seed)
+    today = datetime.date.today()
+    names = [CATEGORY_NAMES[i % len(CATEGORY_NAMES)] + ('' if i < len(CATEGORY_NAMES) else f' {i}')
+             for i in range(categories)]
+    # Zipf-like weights: the first categories get most of the transactions.
+    weights = [1 / (rank + 1) for rank in range(categories)]
+
+    start = User.objects.filter(username__startswith=prefix).count()
+    created = []
+    with transaction.atomic():
+        for index in range(start, start + users):
+            user = User(username=f'{prefix}{index}')
+            user.set_unusable_password()
+            user.save()
+            created.append(user)
+            category_ids = [
+                category.pk for category in TransactionType.objects.bulk_create(
+                    [TransactionType(name=name, added_by=user) for name in names])
+            ]
+            net = Decimal('0')
+            batch = []
+            for number in range(transactions):
+                transaction_type = 'income' if rng.random() < INCOME_SHARE else 'expense'
+                amount = _amount(rng, transaction_type)
+                net += ledger.effect(transaction_type, amount)
+                batch.append(Transaction(
+                    name=f'{rng.choice(MERCHANTS)} {number}',
+                    amount=amount,
+                    base_amount=amount,
+                    date=today - datetime.timedelta(days=rng.randrange(days)),
+                    transaction_type=transaction_type,
+                    transaction_of=user,
+                    category_id=rng.choices(category_ids, weights)[0],
+                ))
+                if len(batch) >= INSERT_BATCH_SIZE:
+                    Transaction.objects.bulk_create(batch)
+                    batch = []
+            Transaction.objects.bulk_create(batch)
+            ledger.post(user.pk, net)
+            caching.bump_version(user.pk)
+        rollups.rebuild(users=[user.pk for user in created])
+    return created
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def endpoints(transaction_pk):
+    """Yield ``(label, path, params, headers)`` for every safe URL in ``app/urls.py``."""
+    for pattern in urls.urlpatterns:
+        if pattern.name in UNSAFE:
+            continue
+        converters = pattern.pattern.converters
+        if 'file_format' in converters:
+            for file_format in exporters.FORMATS:
+                yield (f'{pattern.name}[{file_format}]',
+                       reverse(pattern.name, kwargs={'file_format': file_format}), {}, {})
+        elif 'pk' in converters:
+            yield pattern.name, reverse(pattern.name, kwargs={'pk': transaction_pk}), {}, {}
+        else:
+            yield pattern.name, reverse(pattern.name), {}, {}
+    for label, name, params, headers in VARIANTS:
+        yield label, reverse(name), params, headers
+
+
+def _measure(client, path, params, headers, cold):
+    if cold:
+        caches[caching.RESPONSE_CACHE_ALIAS].clear()
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        response = client.get(path, params, **headers)
+        if response.streaming:
+            size = sum(len(chunk) for chunk in response.streaming_content)
+        else:
+            size = len(response.content)
+        elapsed = time.perf_counter() - started
+    return response.status_code, elapsed, len(queries), size
+
+
+def time_endpoints(user, requests=20, cold=False):
+    """
+    Time each endpoint ``requests`` times as ``user``.
+
+    With ``cold`` the response cache is cleared before every request, so
+    the numbers show the cost of computing a response rather than serving
+    it from the cache.
+    """
+    client = Client()
+    client.force_login(user)
+    transaction_pk = Transaction.objects.filter(transaction_of=user).values_list('pk', flat=True).first()
+    results = {}
+    for label, path, params, headers in endpoints(transaction_pk or 0):
+        _measure(client, path, params, headers, cold)  # warm up
+        samples = [_measure(client, path, params, headers, cold) for _ in range(requests)]
+        timings = [elapsed * 1000 for _, elapsed, _, _ in samples]
+        status, _, queries, size = samples[-1]
+        results[label] = {
+            'path': path,
+            'params': params,
+            'status': status,
+            'p50_ms': round(percentile(timings, 0.50), 3),
+            'p95_ms': round(percentile(timings, 0.95), 3),
+            'p99_ms': round(percentile(timings, 0.99), 3),
+            'mean_ms': round(sum(timings) / len(timings), 3),
+            'queries': queries,
+            'bytes': size,
+        }
+    return results
+
+
+def run(sizes, users=1, requests=20, categories=DEFAULT_CATEGORIES, cold=False, prefix=USERNAME_PREFIX,
+        random_seed=0):
+    """
+    Seed and time each data size in ``sizes`` (transactions per user) in turn.
+
+    Existing benchmark users are cleared before every size. Returns a report
+    dict suitable for ``json.dump``.
+    """
+    report = {
+        'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'database': connection.vendor,
+        'users': users,
+        'categories': categories,
+        'requests': requests,
+        'cold': cold,
+        'runs': [],
+    }
+    for size in sizes:
+        clear(prefix)
+        started = time.perf_counter()
+        created = seed(users, size, categories, prefix=prefix, random_seed=random_seed)
+        seed_seconds = time.perf_counter() - started
+        report['runs'].append({
+            'transactions_per_user': size,
+            'seed_seconds': round(seed_seconds, 3),
+            'endpoints': time_endpoints(created[0], requests, cold),
+        })
+    clear(prefix)
+    return report
+
+
+# SQLite as it behaves without tuning: rollback journal, deferred transactions.
+SQLITE_DEFAULTS = {'pragmas': {'journal_mode': 'DELETE'}, 'transaction_mode': 'DEFERRED'}
+
+
+def _contend(name, options, user_id, category_id, seconds, write_ratio, random_seed):
+    """One process's share of :func:`contention`: list or add transactions until time is up."""
+    connections.close_all()
+    connection.settings_dict.update(NAME=name, OPTIONS=options)
+    rng = random.Random(random_seed)
+    timings = {'read': [], 'write': []}
+    locked = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        kind = 'write' if rng.random() < write_ratio else 'read'
+        started = time.perf_counter()
+        try:
+            if kind == 'write':
+                Transaction(name=f'Contention {rng.randrange(10 ** 6)}', amount=_amount(rng, 'income'),
+                            transaction_type='income', transaction_of_id=user_id, category_id=category_id).save()
+            else:
+                list(transaction_values(Transaction.objects.filter(transaction_of_id=user_id))
+                     .order_by('-date', '-pk')[:100])
+        except OperationalError:
+            locked += 1
+            continue
+        timings[kind].append((time.perf_counter() - started) * 1000)
+    connections.close_all()
+    return timings, locked
+
+
+def _contention_run(name, options, users, seconds, write_ratio, random_seed):
+    # Apply the journal mode once, before the processes race to switch it.
+    connections.close_all()
+    connection.settings_dict.update(NAME=name, OPTIONS=options)
+    connection.ensure_connection()
+    connections.close_all()
+    args = [(name, options, user_id, category_id, seconds, write_ratio, random_seed + index)
+            for index, (user_id, category_id) in enumerate(users)]
+    with multiprocessing.get_context('fork').Pool(len(args)) as pool:
+        results = pool.starmap(_contend, args)
+    reads = [ms for timings, _ in results for ms in timings['read']]
+    writes = [ms for timings, _ in results for ms in timings['write']]
+    summary = {
+        'options': options,
+        'reads_per_second': round(len(reads) / seconds, 1),
+        'writes_per_second': round(len(writes) / seconds, 1),
+        'locked_errors': sum(locked for _, locked in results),
+    }
+    for kind, samples in (('read', reads), ('write', writes)):
+        if samples:
+            summary[f'{kind}_p50_ms'] = round(percentile(samples, 0.50), 3)
+            summary[f'{kind}_p95_ms'] = round(percentile(samples, 0.95), 3)
+            summary[f'{kind}_p99_ms'] = round(percentile(samples, 0.99), 3)
+    return summary
+
+
+def contention(processes=4, seconds=5.0, write_ratio=0.2, transactions=1000, path=None, random_seed=0):
+    """
+    Run ``processes`` processes against one SQLite file for ``seconds``, each
+    listing or (with probability ``write_ratio``) adding transactions for its
+    own user, once with :data:`SQLITE_DEFAULTS` and once with the configured
+    OPTIONS. Returns a report dict suitable for ``json.dump``.
+
+    The scratch database is created and migrated at ``path``, or in a
+    temporary directory that is removed afterwards; the configured database
+    is never written to. Processes are forked, so this needs a POSIX system.
+    """
+    if connection.vendor != 'sqlite':
+        raise ValueError('The contention benchmark only applies to SQLite.')
+    original = dict(connection.settings_dict)
+    tuned = original['OPTIONS']
+    with tempfile.TemporaryDirectory() as scratch:
+        name = path or os.path.join(scratch, 'contention.sqlite3')
+        try:
+            connections.close_all()
+            connection.settings_dict['NAME'] = name
+            call_command('migrate', verbosity=0)
+            created = seed(users=processes, transactions=transactions, random_seed=random_seed)
+            users = [(user.pk, TransactionType.objects.filter(added_by=user).values_list('pk', flat=True)[0])
+                     for user in created]
+            runs = {
+                label: _contention_run(name, options, users, seconds, write_ratio, random_seed)
+                for label, options in (('defaults', SQLITE_DEFAULTS), ('tuned', tuned))
+            }
+        finally:
+            connections.close_all()
+            connection.settings_dict.update(NAME=original['NAME'], OPTIONS=tuned)
+    return {
+        'created_at': datetime.datetime.now().isoformat(timespec='seconds'),
+        'processes': processes,
+        'seconds': seconds,
+        'write_ratio': write_ratio,
+        'transactions_per_user': transactions,
+        'runs': runs,
+    }
@@ -0,0 +1,82 @@
+"""
+Set-based changes to many transactions at once, for the admin's bulk actions.
+
+Saving or deleting transactions one by one keeps the balance, rollups and
+forecasts current through Transaction.save and the delete signals, at
+several queries per row. These functions read the affected rows once,
+change them with one UPDATE or a few DELETEs, and apply the balance, rollup
+and forecast changes in batches, the way the importer does.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import router, transaction
+
+from . import changes, forecast, ledger, rollups
+from .models import Transaction
+
+# Rows deleted per statement, to stay under SQLite's bound-parameter limit.
+DELETE_CHUNK_SIZE = 500
+
+
+def _snapshots(queryset):
+    """Rows shaped like :func:`app.rollups.snapshot`, plus their pk, locked for the update."""
+    rows = (
+        queryset
+        .select_for_update()
+        .order_by()
+        .values('pk', 'transaction_of_id', 'transaction_type', 'category_id', 'date', 'base_amount')
+    )
+    return [dict(row, amount=row['base_amount']) for row in rows]
+
+
+def recategorize(queryset, category):
+    """
+    Move the transactions to ``category``; returns how many were moved.
+    Categories are per user, so only the category owner's transactions move.
+    """
+    queryset = queryset.filter(transaction_of_id=category.added_by_id).exclude(category=category)
+    with transaction.atomic(using=router.db_for_write(Transaction)):
+        rows = _snapshots(queryset)
+        if not rows:
+            return 0
+        # update() sends no signals; stamping moves the owner to a new version.
+        queryset.update(category=category, change_version=changes.stamp(category.added_by_id))
+        rollups.apply(rows, sign=-1)
+        rollups.apply([{**row, 'category_id': category.pk} for row in rows])
+    return len(rows)
+
+
+def delete(queryset):
+    """
+    Delete the transactions and take them out of their owners' balances,
+    with one ledger entry per owner; returns how many were deleted. Raises
+    ValidationError, deleting nothing, when that would overdraw a balance.
+    """
+    with transaction.atomic(using=router.db_for_write(Transaction)):
+        rows = _snapshots(queryset)
+        if not rows:
+            return 0
+        deltas = defaultdict(Decimal)
+        owned = defaultdict(list)
+        for row in rows:
+            deltas[row['transaction_of_id']] -= ledger.effect(row['transaction_type'], row['amount'])
+            owned[row['transaction_of_id']].append(row['pk'])
+        for user_id, delta in deltas.items():
+            if delta:
+                ledger.adjust(user_id, delta, require_funds=True)
+        pks = [row['pk'] for row in rows]
+        for start in range(0, len(pks), DELETE_CHUNK_SIZE):
+            # The balance, rollups and forecasts are updated below, in bulk,
+            # rather than by the per-row delete signals.
+            chunk = Transaction.objects.filter(pk__in=pks[start:start + DELETE_CHUNK_SIZE])
+            chunk._raw_delete(chunk.db)
+        for user_id, delta in deltas.items():
+            if delta:
+                ledger.record(user_id, delta)
+        rollups.apply(rows, sign=-1)
+        forecast.apply(rows, sign=-1)
+        for user_id, pks in owned.items():
+            # Also moves the owner to a new version.
+            changes.record_deletions(user_id, 'transaction', pks)
+    return len(rows)
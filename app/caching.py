@@ -0,0 +1,195 @@
+"""
+Per-user response caching and conditional GETs for the read-only APIs.
+
+Every user has a DataVersion counter that is bumped whenever their
+transactions, categories or balance change. Responses of endpoints wrapped
+in :func:`versioned_response` are cached under (user, endpoint, query
+string, version) and carry an ETag and Last-Modified derived from it, so a
+repeat request either gets a 304 or a body straight from the cache; a write
+simply moves the user on to a new version and the old entries age out.
+
+Saving or deleting a transaction or category bumps the version once, by
+stamping it with :func:`app.changes.stamp`; balance rows bump it through
+signals. Code that writes with ``update()`` or ``bulk_create()`` must call
+:func:`bump_version` itself, or :func:`app.changes.stamp` when it writes
+transactions or categories.
+
+The version itself is only cached when the response cache is shared
+between server processes. A per-process cache such as LocMemCache can't
+hear about writes handled by another process, so with one every request
+reads the version from its DataVersion row instead; the responses stay
+cached under it either way.
+
+Views served from a read replica (see :mod:`app.routers`) read the version
+from the replica too, bypassing the cached one, so a response is only ever
+stored under the version of the data it was computed from.
+"""
+import asyncio
+import calendar
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import IntegrityError, router, transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from . import routers, shards
+from .models import DataVersion
+
+RESPONSE_CACHE_ALIAS = getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')
+RESPONSE_CACHE_TIMEOUT = getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 60 * 60)
+
+
+def _cache():
+    return caches[RESPONSE_CACHE_ALIAS]
+
+
+def _shared():
+    """Whether the response cache is seen by every server process."""
+    return not isinstance(_cache(), (LocMemCache, DummyCache))
+
+
+def version_key(user_id):
+    return f'data-version:{user_id}'
+
+
+def data_version(user_id):
+    """Return ``(version, updated_at)`` for the user, from the cache when it is shared."""
+    if routers.read_alias() or not _shared():
+        return _read_version(user_id) or (0, None)
+    key = version_key(user_id)
+    current = _cache().get(key)
+    if current is None:
+        current = _read_version(user_id) or (0, None)
+        _cache().set(key, current, RESPONSE_CACHE_TIMEOUT)
+    return current
+
+
+def _read_version(user_id):
+    return DataVersion.objects.filter(version_of_id=user_id).values_list('version', 'updated_at').first()
+
+
+def bump_version(user_id):
+    """
+    Move the user on to a new data version.
+
+    The cached version is dropped now and again once the surrounding
+    transaction commits, so a read racing the write can't pin the old one.
+    """
+    with shards.for_user(user_id):
+        using = router.db_for_write(DataVersion)
+        updated = DataVersion.objects.filter(version_of_id=user_id).update(
+            version=F('version') + 1, updated_at=timezone.now())
+        if not updated and User.objects.filter(pk=user_id).exists():
+            try:
+                with transaction.atomic(using=using):
+                    DataVersion.objects.create(version_of_id=user_id, version=1)
+            except IntegrityError:
+                DataVersion.objects.filter(version_of_id=user_id).update(
+                    version=F('version') + 1, updated_at=timezone.now())
+    key = version_key(user_id)
+    _cache().delete(key)
+    transaction.on_commit(lambda: _cache().delete(key), using=using)
+
+
+async def adata_version(user_id):
+    """Async counterpart of :func:`data_version`."""
+    versions = DataVersion.objects.filter(version_of_id=user_id).values_list('version', 'updated_at')
+    if routers.read_alias() or not _shared():
+        return await versions.afirst() or (0, None)
+    key = version_key(user_id)
+    current = await _cache().aget(key)
+    if current is None:
+        current = await versions.afirst() or (0, None)
+        await _cache().aset(key, current, RESPONSE_CACHE_TIMEOUT)
+    return current
+
+
+def _cacheable(request):
+    return request.method in ('GET', 'HEAD') and request.user.is_authenticated
+
+
+def _validators(request, name, version):
+    """Return the ``(cache key, ETag, Last-Modified)`` for a request at ``version``."""
+    version, updated_at = version
+    # The timestamp guards against a version number being reused, e.g.
+    # after the database is restored from a backup.
+    raw = f'{name}:{request.user.pk}:{version}:{updated_at}:{request.GET.urlencode()}'
+    fingerprint = hashlib.md5(raw.encode()).hexdigest()
+    last_modified = calendar.timegm(updated_at.utctimetuple()) if updated_at else None
+    return f'response:{request.user.pk}:{fingerprint}', quote_etag(fingerprint), last_modified
+
+
+def _from_cache(cached):
+    content, content_type = cached
+    return HttpResponse(content, content_type=content_type)
+
+
+def _storable(response):
+    return response.status_code == 200 and not response.streaming
+
+
+def _with_validators(response, etag, last_modified):
+    if etag and not response.has_header('ETag'):
+        response['ETag'] = etag
+    if last_modified and not response.has_header('Last-Modified'):
+        response['Last-Modified'] = http_date(last_modified)
+    # Browsers may keep the body but must revalidate it every time.
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def versioned_response(view):
+    """
+    Cache a read-only, per-user view's response and answer conditional GETs.
+
+    Works on both plain and ``async def`` views. Streaming responses get the
+    headers but are not stored.
+    """
+    name = view.__name__
+
+    if asyncio.iscoroutinefunction(view):
+        @wraps(view)
+        async def cached_view(request, *args, **kwargs):
+            if not _cacheable(request):
+                return await view(request, *args, **kwargs)
+            key, etag, last_modified = _validators(request, name, await adata_version(request.user.pk))
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                cached = await _cache().aget(key)
+                if cached is not None:
+                    response = _from_cache(cached)
+                else:
+                    response = await view(request, *args, **kwargs)
+                    if _storable(response):
+                        await _cache().aset(key, (response.content, response['Content-Type']),
+                                            RESPONSE_CACHE_TIMEOUT)
+            return _with_validators(response, etag, last_modified)
+
+        return cached_view
+
+    @wraps(view)
+    def cached_view(request, *args, **kwargs):
+        if not _cacheable(request):
+            return view(request, *args, **kwargs)
+        key, etag, last_modified = _validators(request, name, data_version(request.user.pk))
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            cached = _cache().get(key)
+            if cached is not None:
+                response = _from_cache(cached)
+            else:
+                response = view(request, *args, **kwargs)
+                if _storable(response):
+                    _cache().set(key, (response.content, response['Content-Type']), RESPONSE_CACHE_TIMEOUT)
+        return _with_validators(response, etag, last_modified)
+
+    return cached_view
@@ -0,0 +1,115 @@
+"""
+Delta sync: what changed in a user's data since a version they have seen.
+
+Every write to a user's transactions, categories or balance moves their
+DataVersion on (see :mod:`app.caching`). Transactions and categories are
+also stamped with the version of their last write in ``change_version``,
+and deleting one leaves a Tombstone stamped the same way, so
+``changes?since=<version>`` costs a few indexed range scans over what
+changed rather than a read of the whole history.
+
+The version is bumped inside the database transaction that writes the row,
+and the DataVersion row stays locked until it commits, so a user's versions
+become visible in order: whoever reads version ``v`` can see every row
+stamped ``v`` or lower. Clients keep the ``version`` of the last response
+and pass it back as ``since``. A row may come back more than once; clients
+upsert by ``pk``.
+
+Rows last written before changes were tracked have no stamp and are only
+sent by a full sync (``since=0``), which sends no deletions. When a user's
+rows get new ids, as on a shard move, older versions can't be replayed:
+:func:`reset` records that, and clients syncing from before it are told to
+start over with a full sync.
+"""
+from collections import defaultdict
+
+from django.db import router
+
+from . import caching, shards
+from .models import ArchivedTransaction, DataVersion, Tombstone, Transaction, TransactionType
+from .serializers import TRANSACTION_FIELDS
+
+CHANGED_TRANSACTION_FIELDS = TRANSACTION_FIELDS + ('category', 'change_version')
+CHANGED_CATEGORY_FIELDS = ('pk', 'name', 'change_version')
+
+
+def _current(user_id):
+    return DataVersion.objects.filter(version_of_id=user_id).values_list('version', 'resync_version').first()
+
+
+def stamp(user_id):
+    """
+    Move the user on to a new data version and return it, to stamp the rows
+    being written; None when the user no longer exists.
+    """
+    caching.bump_version(user_id)
+    with shards.for_user(user_id):
+        versions = DataVersion.objects.using(router.db_for_write(DataVersion)).filter(version_of_id=user_id)
+        return versions.values_list('version', flat=True).first()
+
+
+def record_deletions(user_id, kind, pks):
+    """Leave tombstones for the user's deleted rows of ``kind`` (see Tombstone.KINDS)."""
+    version = stamp(user_id) if pks else None
+    if version is None:
+        return
+    with shards.for_user(user_id):
+        Tombstone.objects.bulk_create([
+            Tombstone(tombstone_of_id=user_id, kind=kind, object_pk=pk, change_version=version) for pk in pks
+        ])
+
+
+def reset(user_id):
+    """Make clients that last synced before now start over with a full sync."""
+    version = stamp(user_id)
+    with shards.for_user(user_id):
+        DataVersion.objects.filter(version_of_id=user_id).update(resync_version=version)
+
+
+def _changed(queryset, since):
+    if since:
+        queryset = queryset.filter(change_version__gt=since)
+    return queryset.order_by('change_version', 'pk')
+
+
+def changes(user_id, since=0):
+    """
+    The user's transactions and categories written after version ``since``
+    and the ids of those deleted since, as
+    ``{'version', 'reset', 'transactions', 'categories', 'deleted'}``.
+
+    ``version`` is the one to pass as ``since`` next time. ``reset`` is set
+    when ``since`` can't be synced from (it is from before a :func:`reset`
+    or newer than any version handed out); everything is sent instead and
+    the client should replace what it has.
+    """
+    # Read before the rows: anything written in between is sent again next time.
+    version, resync_version = _current(user_id) or (0, None)
+    reset = since > version or 0 < since < (resync_version or 0)
+    if reset:
+        since = 0
+
+    transactions = [
+        row
+        for model in (Transaction, ArchivedTransaction)
+        for row in _changed(model.objects.filter(transaction_of_id=user_id), since).values(*CHANGED_TRANSACTION_FIELDS)
+    ]
+    transactions.sort(key=lambda row: (row['change_version'] or 0, row['pk']))
+    categories = list(
+        _changed(TransactionType.objects.filter(added_by_id=user_id), since).values(*CHANGED_CATEGORY_FIELDS))
+
+    deleted = defaultdict(list)
+    if since:
+        tombstones = Tombstone.objects.filter(tombstone_of_id=user_id, change_version__gt=since)
+        for kind, pk in tombstones.order_by('change_version', 'pk').values_list('kind', 'object_pk'):
+            deleted[kind].append(pk)
+    return {
+        'version': version,
+        'reset': reset,
+        'transactions': transactions,
+        'categories': categories,
+        'deleted': {
+            'transactions': deleted['transaction'],
+            'categories': deleted['category'],
+        },
+    }
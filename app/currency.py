@@ -0,0 +1,148 @@
+"""
+Offline currency conversion from a local table of dated exchange rates.
+
+Each Transaction keeps its original ``amount`` and ``currency`` plus a
+``base_amount`` in ``settings.BASE_CURRENCY``, fixed when the row is
+written. Balances, rollups and reports all work on ``base_amount``, so
+totals stay a single SQL ``SUM`` however many currencies are involved.
+
+A rate is the number of base-currency units one unit of the currency was
+worth on its date; a transaction uses the latest rate on or before its own
+date. Rates are loaded from a CSV file with :func:`load_rates` (see the
+``load_exchange_rates`` command); nothing is fetched over the network.
+"""
+import csv
+import datetime
+from bisect import bisect_right
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db.models import OuterRef, Subquery
+
+from .models import ExchangeRate, Transaction
+
+BASE_CURRENCY = getattr(settings, 'BASE_CURRENCY', 'USD')
+LOAD_BATCH_SIZE = 1000
+
+CENT = Decimal('0.01')
+
+
+def _date(value):
+    return Transaction._meta.get_field('date').to_python(value)
+
+
+def _missing(currency, date):
+    return ValidationError(f"No exchange rate for {currency} on or before {date}.")
+
+
+def _quantize(amount):
+    return Decimal(amount).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def available():
+    """The base currency followed by every currency that has a rate."""
+    currencies = ExchangeRate.objects.exclude(currency=BASE_CURRENCY).order_by('currency')
+    return [BASE_CURRENCY] + list(currencies.values_list('currency', flat=True).distinct())
+
+
+def latest_rates():
+    """The most recent rate of every currency, with the base currency at 1."""
+    newest = ExchangeRate.objects.filter(currency=OuterRef('currency')).order_by('-date').values('date')[:1]
+    rates = ExchangeRate.objects.filter(date=Subquery(newest)).values_list('currency', 'rate')
+    return {BASE_CURRENCY: Decimal('1'), **dict(rates)}
+
+
+def to_base(amount, currency, date):
+    """Convert one amount; raises ValidationError when there is no usable rate."""
+    if currency == BASE_CURRENCY:
+        return _quantize(amount)
+    date = _date(date)
+    rate = (
+        ExchangeRate.objects
+        .filter(currency=currency, date__lte=date)
+        .order_by('-date')
+        .values_list('rate', flat=True)
+        .first()
+    )
+    if rate is None:
+        raise _missing(currency, date)
+    return _quantize(Decimal(amount) * rate)
+
+
+class RateTable:
+    """
+    Every rate for a set of currencies, fetched in one query.
+
+    Lookups are memoised per (currency, date), so converting a batch costs
+    one rate search per distinct currency and day rather than per row.
+    """
+
+    def __init__(self, currencies):
+        self.history = {}
+        self.cache = {}
+        currencies = set(currencies) - {BASE_CURRENCY}
+        if not currencies:
+            return
+        rows = ExchangeRate.objects.filter(currency__in=currencies).order_by('currency', 'date')
+        for currency, date, rate in rows.values_list('currency', 'date', 'rate'):
+            dates, rates = self.history.setdefault(currency, ([], []))
+            dates.append(date)
+            rates.append(rate)
+
+    def rate(self, currency, date):
+        if currency == BASE_CURRENCY:
+            return Decimal('1')
+        key = (currency, date)
+        if key not in self.cache:
+            dates, rates = self.history.get(currency, ((), ()))
+            index = bisect_right(dates, date) - 1
+            if index < 0:
+                raise _missing(currency, date)
+            self.cache[key] = rates[index]
+        return self.cache[key]
+
+    def to_base(self, amount, currency, date):
+        return _quantize(Decimal(amount) * self.rate(currency, _date(date)))
+
+
+def parse_rates(fileobj):
+    """
+    Yield ``(line, ExchangeRate)`` from a CSV file with ``date``, ``currency``
+    and ``rate`` columns; raises ValueError on the first malformed line.
+    """
+    reader = csv.DictReader(fileobj)
+    for row in reader:
+        try:
+            rate = Decimal(row['rate'].strip())
+            date = datetime.date.fromisoformat(row['date'].strip())
+            currency = row['currency'].strip().upper()
+        except (AttributeError, KeyError, InvalidOperation, ValueError):
+            raise ValueError(f"Line {reader.line_num}: expected date (YYYY-MM-DD), currency and rate columns.")
+        if len(currency) != 3 or rate <= 0:
+            raise ValueError(f"Line {reader.line_num}: invalid currency or rate.")
+        yield reader.line_num, ExchangeRate(currency=currency, date=date, rate=rate)
+
+
+def load_rates(fileobj, batch_size=LOAD_BATCH_SIZE):
+    """
+    Insert or replace the rates in a CSV file; returns the number of rows.
+
+    Replacing a rate does not touch transactions already converted with it.
+    """
+    loaded = 0
+    batch = {}
+    for _, rate in parse_rates(fileobj):
+        # A repeated (currency, date) within a batch keeps the last value.
+        batch[rate.currency, rate.date] = rate
+        if len(batch) >= batch_size:
+            loaded += _save_rates(batch.values())
+            batch = {}
+    return loaded + _save_rates(batch.values())
+
+
+def _save_rates(rates):
+    rates = list(rates)
+    ExchangeRate.objects.bulk_create(rates, update_conflicts=True, unique_fields=['currency', 'date'],
+                                     update_fields=['rate'])
+    return len(rates)
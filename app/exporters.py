@@ -0,0 +1,128 @@
+"""
+Streaming exports of transactions as CSV or newline-delimited JSON.
+
+Rows are read with ``QuerySet.iterator()`` (a server-side cursor where the
+backend supports one) and written out a chunk at a time, so memory use stays
+flat however long the history is.
+"""
+import csv
+import datetime
+import heapq
+import itertools
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .serializers import TRANSACTION_FIELDS, transaction_values
+
+EXPORT_CHUNK_SIZE = 2000
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+COLUMNS = {
+    'pk': 'id',
+    'name': 'name',
+    'amount': 'amount',
+    'currency': 'currency',
+    'date': 'date',
+    'transaction_type': 'type',
+    'category__name': 'category',
+    'remarks': 'remarks',
+    'transaction_of__username': 'user',
+}
+
+
+def parse_date(value):
+    """Parse an optional ``YYYY-MM-DD`` filter value; raises ValueError when malformed."""
+    if not value:
+        return None
+    return datetime.date.fromisoformat(value)
+
+
+def filter_transactions(queryset, start=None, end=None, categories=None):
+    if start is not None:
+        queryset = queryset.filter(date__gte=start)
+    if end is not None:
+        queryset = queryset.filter(date__lte=end)
+    if categories:
+        queryset = queryset.filter(category__in=categories)
+    return queryset
+
+
+def export_fields(include_owner=False):
+    return TRANSACTION_FIELDS + (('transaction_of__username',) if include_owner else ())
+
+
+def export_rows(queryset, include_owner=False, chunk_size=EXPORT_CHUNK_SIZE, archived=None):
+    """
+    Iterate export rows (dicts keyed by column name) oldest first.
+    ``archived`` is an ArchivedTransaction queryset merged in by date.
+    """
+    fields = export_fields(include_owner)
+
+    def values(queryset):
+        rows = transaction_values(queryset).values(*fields).order_by('date', 'pk')
+        return rows.iterator(chunk_size=chunk_size)
+
+    rows = values(queryset)
+    if archived is not None:
+        rows = heapq.merge(rows, values(archived), key=lambda row: (row['date'], row['pk']))
+    for row in rows:
+        yield {COLUMNS[field]: row[field] for field in fields}
+
+
+class _Echo:
+    """File-like object whose write() hands back what it was given."""
+
+    def write(self, value):
+        return value
+
+
+def csv_chunks(rows, columns, chunk_size=EXPORT_CHUNK_SIZE):
+    writer = csv.DictWriter(_Echo(), fieldnames=columns)
+    buffer = [writer.writeheader()]
+    for row in rows:
+        buffer.append(writer.writerow(row))
+        if len(buffer) >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+
+def ndjson_chunks(rows, columns, chunk_size=EXPORT_CHUNK_SIZE):
+    encoder = DjangoJSONEncoder()
+    buffer = []
+    for row in rows:
+        buffer.append(encoder.encode(row) + '\n')
+        if len(buffer) >= chunk_size:
+            yield ''.join(buffer)
+            buffer = []
+    if buffer:
+        yield ''.join(buffer)
+
+
+WRITERS = {
+    'csv': csv_chunks,
+    'ndjson': ndjson_chunks,
+}
+
+
+def export_chunks(queryset, file_format, include_owner=False, databases=None, archived=None):
+    """
+    Yield the text of an export of ``queryset``, and of the ``archived``
+    queryset if given, in ``file_format``, chunk by chunk. With
+    ``databases`` both are exported from each of them in turn, e.g. every
+    shard.
+    """
+    columns = [COLUMNS[field] for field in export_fields(include_owner)]
+    if databases is None:
+        sources = [(queryset, archived)]
+    else:
+        sources = [(queryset.using(database), archived.using(database) if archived is not None else None)
+                   for database in databases]
+    rows = itertools.chain.from_iterable(
+        export_rows(hot, include_owner=include_owner, archived=cold) for hot, cold in sources)
+    return WRITERS[file_format](rows, columns)
@@ -0,0 +1,171 @@
+"""
+Balance forecasts from exponentially smoothed monthly income and expenses.
+
+Each user has a ForecastState holding the smoothed monthly income and
+expense levels over their completed months (``first_month`` to
+``last_month``, as month numbers ``year * 12 + month - 1``). The state is
+kept current incrementally rather than refitted:
+
+* A month that completes is folded in from its rollup buckets on the next
+  read (``level = alpha * total + (1 - alpha) * level``).
+* A change to an already folded month ``m`` moves the level by
+  ``alpha * (1 - alpha) ** (last_month - m)`` times the change (``1 - alpha``
+  instead of ``alpha`` for the first month), which is exact because
+  smoothing is linear in its inputs.
+* Changes to the open month wait until it completes. A change before
+  ``first_month`` drops the state, and the next read refits it from the
+  rollups.
+
+A projection is then the current balance plus what is still expected this
+month, plus the smoothed net flow for each month after it.
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import router, transaction
+from django.db.models import Sum
+
+from .models import Balance, ForecastState, TransactionRollup
+
+SMOOTHING = Decimal(str(getattr(settings, 'FORECAST_SMOOTHING', '0.3')))
+DEFAULT_MONTHS = 12
+MAX_MONTHS = 60
+
+CENT = Decimal('0.01')
+
+
+def month_number(date):
+    return date.year * 12 + date.month - 1
+
+
+def month_label(number):
+    return f'{number // 12:04d}-{number % 12 + 1:02d}'
+
+
+def month_start(number):
+    return datetime.date(number // 12, number % 12 + 1, 1)
+
+
+def _weight(state, month):
+    alpha = state.alpha
+    decay = (1 - alpha) ** (state.last_month - month)
+    return decay if month == state.first_month else alpha * decay
+
+
+def apply(rows, sign=1):
+    """
+    Adjust the forecast state for added (``sign=1``) or removed
+    (``sign=-1``) rows, shaped like :func:`app.rollups.snapshot`.
+    """
+    deltas = defaultdict(lambda: [Decimal('0'), Decimal('0')])
+    for row in rows:
+        key = (row['transaction_of_id'], month_number(row['date']))
+        deltas[key][row['transaction_type'] == 'expense'] += sign * Decimal(row['amount'])
+
+    by_user = defaultdict(list)
+    for (user_id, month), (income, expense) in deltas.items():
+        by_user[user_id].append((month, income, expense))
+
+    with transaction.atomic(using=router.db_for_write(ForecastState)):
+        for user_id, changes in by_user.items():
+            state = ForecastState.objects.select_for_update().filter(forecast_of_id=user_id).first()
+            if state is None:
+                continue
+            if any(month < state.first_month for month, _, _ in changes):
+                state.delete()
+                continue
+            folded = [(month, income, expense) for month, income, expense in changes if month <= state.last_month]
+            if not folded:
+                continue
+            for month, income, expense in folded:
+                weight = _weight(state, month)
+                state.level_income += weight * income
+                state.level_expense += weight * expense
+            state.save(update_fields=['level_income', 'level_expense'])
+
+
+def _month_totals(user_id, start=None, end=None):
+    """``{month: [income, expense]}`` from the monthly rollup buckets."""
+    buckets = TransactionRollup.objects.filter(rollup_of_id=user_id, granularity='month')
+    if start is not None:
+        buckets = buckets.filter(period__gte=month_start(start))
+    if end is not None:
+        buckets = buckets.filter(period__lte=month_start(end))
+    totals = defaultdict(lambda: [Decimal('0'), Decimal('0')])
+    rows = buckets.order_by().values('period', 'transaction_type').annotate(total=Sum('total'))
+    for row in rows:
+        totals[month_number(row['period'])][row['transaction_type'] == 'expense'] += row['total']
+    return totals
+
+
+def _fold(state, totals, start, end):
+    for month in range(start, end + 1):
+        income, expense = totals.get(month, (Decimal('0'), Decimal('0')))
+        state.level_income = state.alpha * income + (1 - state.alpha) * state.level_income
+        state.level_expense = state.alpha * expense + (1 - state.alpha) * state.level_expense
+    state.last_month = end
+
+
+def current_state(user_id, today=None):
+    """
+    Return the user's ForecastState with every completed month folded in,
+    fitting it from the rollups if there is none yet. Returns None for a
+    user without a completed month of history.
+    """
+    completed = month_number(today or datetime.date.today()) - 1
+    with transaction.atomic(using=router.db_for_write(ForecastState)):
+        state = ForecastState.objects.select_for_update().filter(forecast_of_id=user_id).first()
+        if state is not None and state.alpha != SMOOTHING:
+            state.delete()
+            state = None
+        if state is None:
+            totals = _month_totals(user_id, end=completed)
+            if not totals:
+                return None
+            first = min(totals)
+            income, expense = totals[first]
+            state = ForecastState(forecast_of_id=user_id, alpha=SMOOTHING, first_month=first, last_month=first,
+                                  level_income=income, level_expense=expense)
+            _fold(state, totals, first + 1, completed)
+            state.save()
+        elif state.last_month < completed:
+            _fold(state, _month_totals(user_id, state.last_month + 1, completed), state.last_month + 1, completed)
+            state.save()
+    return state
+
+
+def project(user_id, months=DEFAULT_MONTHS, today=None):
+    """
+    Project the balance at the end of this month and each of the next
+    ``months - 1`` months; ``runs_out`` is the first month projected below
+    zero, or None.
+    """
+    today = today or datetime.date.today()
+    current = month_number(today)
+    balance = Balance.objects.filter(balance_of_id=user_id).values_list('balance', flat=True).first() or Decimal('0')
+    state = current_state(user_id, today)
+    income = state.level_income if state else Decimal('0')
+    expense = state.level_expense if state else Decimal('0')
+
+    so_far = _month_totals(user_id, current, current).get(current, (Decimal('0'), Decimal('0')))
+    # Whatever this month has not brought in (or spent) yet is still expected.
+    projected = balance + max(income - so_far[0], 0) - max(expense - so_far[1], 0)
+    net = income - expense
+    points = []
+    runs_out = None
+    for offset in range(months):
+        if offset:
+            projected += net
+        if projected < 0 and runs_out is None:
+            runs_out = month_label(current + offset)
+        points.append({'month': month_label(current + offset), 'balance': projected.quantize(CENT)})
+    return {
+        'balance': Decimal(balance).quantize(CENT),
+        'monthly_income': income.quantize(CENT),
+        'monthly_expense': expense.quantize(CENT),
+        'monthly_net': net.quantize(CENT),
+        'months': points,
+        'runs_out': runs_out,
+    }
@@ -5,6 +5,7 @@ from django.contrib.auth.models import User
 from captcha.fields import CaptchaField
 from django.contrib.auth.forms import AuthenticationForm
 from django.conf import settings
+from . import currency
 
 class TransactionTypeForm(forms.ModelForm):
     class Meta:
@@ -39,7 +40,16 @@ class RegisterForm(UserCreationForm):
             user.save()
         return user
 
-class TransactionForm(forms.ModelForm):
+class CurrencyFieldMixin:
+    """Offer only currencies that have a loaded rate; left blank, the base currency is used."""
+    def add_currency_field(self):
+        choices = [(code, code) for code in currency.available()]
+        self.fields['currency'] = forms.ChoiceField(choices=choices, initial=currency.BASE_CURRENCY, required=False)
+
+    def clean_currency(self):
+        return self.cleaned_data['currency'] or currency.BASE_CURRENCY
+
+class TransactionForm(CurrencyFieldMixin, forms.ModelForm):
     def __init__(self, *args, **kwargs):
         user = kwargs.pop('user', None)
         super().__init__(*args, **kwargs)
@@ -49,19 +59,20 @@ class TransactionForm(forms.ModelForm):
         for field_name, field in self.fields.items():
             if field_name != 'remarks':
                 field.required = True
+        self.add_currency_field()
 
     class Meta:
         model = Transaction
-        fields = ['name', 'amount', 'date', 'transaction_type', 'category', 'remarks']
+        fields = ['name', 'amount', 'currency', 'date', 'transaction_type', 'category', 'remarks']
         widgets = {
             'date': forms.TextInput(attrs={'type': 'date'}),
             'remarks': forms.Textarea(attrs={'rows': 2}),
         }
 
-class TransactionUpdateForm(forms.ModelForm):
+class TransactionUpdateForm(CurrencyFieldMixin, forms.ModelForm):
     class Meta:
         model = Transaction
-        fields = ['name', 'amount', 'date', 'transaction_type', 'category', 'remarks']
+        fields = ['name', 'amount', 'currency', 'date', 'transaction_type', 'category', 'remarks']
         widgets = {
             'date': forms.TextInput(attrs={'type': 'date'}),
             'remarks': forms.Textarea(attrs={'rows': 2}),
@@ -73,3 +84,13 @@ class TransactionUpdateForm(forms.ModelForm):
         for field_name, field in self.fields.items():
             if field_name != 'remarks':
                 field.required = True
+        self.add_currency_field()
+
+class TransactionImportForm(forms.Form):
+    FORMAT_CHOICES = (
+        ('', 'Detect from file name'),
+        ('csv', 'CSV'),
+        ('ofx', 'OFX'),
+    )
+    file = forms.FileField()
+    format = forms.ChoiceField(choices=FORMAT_CHOICES, required=False)
@@ -0,0 +1,275 @@
+"""
+Bulk import of bank statements (CSV and OFX).
+
+Files are parsed as a stream of rows, validated with the same field rules as
+TransactionForm, and written with ``bulk_create`` a batch at a time. Each
+batch moves the balance once by its net amount (one ledger entry) and
+updates the rollups once per bucket, instead of doing that work per row the
+way ``Transaction.save`` does.
+"""
+import codecs
+import csv
+import os
+import re
+import uuid
+
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.db import router, transaction
+from django.utils.html import escape
+
+from . import changes, currency, forecast, ledger, rollups, shards
+from .forms import TransactionForm
+from .models import Transaction, TransactionType
+
+DEFAULT_BATCH_SIZE = 1000
+# Where uploads imported in the background wait for a worker, in default_storage.
+UPLOAD_DIR = 'imports'
+DEFAULT_CATEGORY = 'Uncategorized'
+MAX_REPORTED_ERRORS = 100
+
+
+class UnreadableLine(Exception):
+    """A parser can't read the file past ``line``."""
+
+    def __init__(self, line, message):
+        super().__init__(message)
+        self.line = line
+
+FORMATS = ('csv', 'ofx')
+
+CSV_COLUMNS = {
+    'name': 'name',
+    'description': 'name',
+    'amount': 'amount',
+    'date': 'date',
+    'type': 'transaction_type',
+    'transaction_type': 'transaction_type',
+    'category': 'category',
+    'remarks': 'remarks',
+    'memo': 'remarks',
+    'currency': 'currency',
+}
+
+
+def guess_format(filename):
+    return 'ofx' if filename.lower().endswith(('.ofx', '.qfx')) else 'csv'
+
+
+def parse_csv(fileobj):
+    """
+    Yield ``(line, row)`` pairs from a CSV file with a header line.
+
+    Recognised columns (case-insensitive) are name/description, amount,
+    date, type/transaction_type, category, remarks/memo and currency; others
+    are ignored. Without a type column, negative amounts are expenses.
+    Raises UnreadableLine where the csv module gives up on the file.
+    """
+    reader = csv.reader(fileobj)
+    try:
+        header = next(reader, None)
+        if header is None:
+            return
+        columns = [CSV_COLUMNS.get(column.strip().lower()) for column in header]
+        for values in reader:
+            if not any(value.strip() for value in values):
+                continue
+            row = {}
+            for column, value in zip(columns, values):
+                if column is not None:
+                    row[column] = value.strip()
+            yield reader.line_num, row
+    except csv.Error as e:
+        raise UnreadableLine(reader.line_num, str(e)) from e
+
+
+_OFX_TOKEN = re.compile(r'<(/?)([A-Za-z0-9.]+)>([^<]*)')
+
+
+def _ofx_tokens(fileobj, chunk_size=64 * 1024):
+    buffer = ''
+    while True:
+        chunk = fileobj.read(chunk_size)
+        buffer += chunk
+        # A tag may be split across chunks; keep the tail for the next read.
+        end = len(buffer) if not chunk else max(buffer.rfind('<'), 0)
+        for match in _OFX_TOKEN.finditer(buffer, 0, end):
+            yield match.group(1) == '/', match.group(2).upper(), match.group(3).strip()
+        buffer = buffer[end:]
+        if not chunk:
+            return
+
+
+def parse_ofx(fileobj):
+    """
+    Yield ``(number, row)`` pairs for each ``<STMTTRN>`` in an OFX file.
+
+    Handles both SGML (OFX 1.x, unclosed leaf tags) and XML (OFX 2.x)
+    files. The sign of TRNAMT decides between income and expense, and the
+    statement's CURDEF is the currency of its transactions.
+    """
+    current = None
+    number = 0
+    statement_currency = ''
+    for closing, tag, value in _ofx_tokens(fileobj):
+        if tag == 'CURDEF' and not closing:
+            statement_currency = value
+        elif tag == 'STMTTRN':
+            if not closing:
+                current = {}
+                continue
+            if current is not None:
+                number += 1
+                yield number, {
+                    'name': current.get('NAME') or current.get('MEMO') or current.get('TRNTYPE', ''),
+                    'amount': current.get('TRNAMT', ''),
+                    'date': current.get('DTPOSTED', '')[:8],
+                    'remarks': current.get('MEMO', ''),
+                    'currency': current.get('CURSYM', statement_currency),
+                }
+            current = None
+        elif current is not None and not closing and value:
+            current[tag] = value
+
+
+PARSERS = {
+    'csv': parse_csv,
+    'ofx': parse_ofx,
+}
+
+
+class TransactionImporter:
+    """Validate and insert parsed rows for one user, ``batch_size`` rows at a time."""
+
+    def __init__(self, user, batch_size=DEFAULT_BATCH_SIZE, default_category=DEFAULT_CATEGORY):
+        self.user = user
+        self.batch_size = batch_size
+        self.default_category = default_category
+        form = TransactionForm(user=user)
+        self.fields = {name: form.fields[name] for name in ('name', 'amount', 'date', 'transaction_type', 'remarks')}
+        # OFX dates are plain YYYYMMDD.
+        self.fields['date'].input_formats = list(self.fields['date'].input_formats) + ['%Y%m%d']
+        self.categories = {
+            name.lower(): pk
+            for pk, name in TransactionType.objects.filter(added_by=user).values_list('pk', 'name')
+        }
+        self.rates = currency.RateTable(currency.available())
+        self.created = 0
+        self.errors = []
+
+    def category_id(self, name):
+        name = escape(name or self.default_category)
+        key = name.lower()
+        if key not in self.categories:
+            self.categories[key] = TransactionType.objects.create(name=name, added_by=self.user).pk
+        return self.categories[key]
+
+    def clean(self, row):
+        """Return a dict of cleaned Transaction field values, or raise ValidationError."""
+        errors = {}
+        cleaned = {}
+        amount = row.get('amount', '').replace(',', '')
+        transaction_type = row.get('transaction_type', '').lower()
+        if not transaction_type and amount:
+            transaction_type = 'expense' if amount.startswith('-') else 'income'
+        values = {
+            'name': row.get('name', ''),
+            'amount': amount.lstrip('+-'),
+            'date': row.get('date', ''),
+            'transaction_type': transaction_type,
+            'remarks': row.get('remarks', ''),
+        }
+        for name, field in self.fields.items():
+            try:
+                cleaned[name] = field.clean(values[name])
+            except ValidationError as e:
+                errors[name] = e.messages
+        if errors:
+            raise ValidationError(errors)
+        cleaned['remarks'] = cleaned['remarks'] or None
+        cleaned['currency'] = row.get('currency', '').strip().upper() or currency.BASE_CURRENCY
+        try:
+            cleaned['base_amount'] = self.rates.to_base(cleaned['amount'], cleaned['currency'], cleaned['date'])
+        except ValidationError as e:
+            raise ValidationError({'currency': e.messages})
+        return cleaned
+
+    def run(self, rows):
+        """
+        Import ``(line, row)`` pairs; returns ``self`` for chaining. A file
+        that can't be read to the end is imported up to the unreadable line,
+        which is reported last in the errors.
+        """
+        batch = []
+        try:
+            for line, row in rows:
+                try:
+                    cleaned = self.clean(row)
+                except ValidationError as e:
+                    self.error(line, e.message_dict)
+                    continue
+                cleaned['category_id'] = self.category_id(row.get('category'))
+                batch.append((line, Transaction(transaction_of=self.user, **cleaned)))
+                if len(batch) >= self.batch_size:
+                    self.flush(batch)
+                    batch = []
+        except UnreadableLine as e:
+            # Reported even past MAX_REPORTED_ERRORS: it is why the import stopped.
+            self.errors.append({'line': e.line, 'errors': {'__all__': [
+                f'The file could not be read from this line on ({e}); nothing after it was imported.']}})
+        if batch:
+            self.flush(batch)
+        return self
+
+    def flush(self, batch):
+        objs = [obj for _, obj in batch]
+        net = sum((ledger.effect(obj.transaction_type, obj.base_amount) for obj in objs), 0)
+        try:
+            with transaction.atomic(using=router.db_for_write(Transaction)):
+                if net:
+                    ledger.adjust(self.user.pk, net, require_funds=net < 0)
+                # bulk_create sends no signals; stamping moves the user to a new version.
+                version = changes.stamp(self.user.pk)
+                for obj in objs:
+                    obj.change_version = version
+                Transaction.objects.bulk_create(objs)
+                if net:
+                    ledger.record(self.user.pk, net)
+                snapshots = [rollups.snapshot(obj) for obj in objs]
+                rollups.apply(snapshots)
+                forecast.apply(snapshots)
+        except ValidationError as e:
+            self.error(batch[0][0], {'__all__': e.messages + [f'{len(batch)} rows starting here were not imported.']})
+            return
+        self.created += len(objs)
+
+    def error(self, line, errors):
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'errors': errors})
+
+    def result(self):
+        return {'created': self.created, 'errors': self.errors}
+
+
+def is_utf8(upload):
+    """Whether an uploaded file decodes as UTF-8, checked a chunk at a time."""
+    decoder = codecs.getincrementaldecoder('utf-8-sig')()
+    try:
+        for chunk in upload.chunks():
+            decoder.decode(chunk)
+        decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        return False
+    return True
+
+
+def store_upload(upload):
+    """Save an upload to default_storage for a background import; returns its path there."""
+    extension = os.path.splitext(upload.name)[1].lower()
+    return default_storage.save(f'{UPLOAD_DIR}/{uuid.uuid4().hex}{extension}', upload)
+
+
+def import_file(user, fileobj, file_format='csv', **kwargs):
+    """Import an open text file in ``file_format`` for ``user``."""
+    with shards.for_user(user.pk):
+        return TransactionImporter(user, **kwargs).run(PARSERS[file_format](fileobj)).result()
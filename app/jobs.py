@@ -0,0 +1,217 @@
+"""
+A small background job queue kept in the application database.
+
+Views call :func:`enqueue` and return straight away; ``manage.py run_worker``
+runs the jobs on a pool of threads. A job is claimed with one conditional
+``UPDATE ... WHERE id = %s AND status = <as read>``, so when two workers
+race for the same row only one update matches. This works on SQLite, which
+has no row locks; backends that support ``SELECT ... FOR UPDATE SKIP
+LOCKED`` use that instead, so workers skip over each other's rows rather
+than contending for them.
+
+A job whose task raises is requeued with an exponential backoff until it
+has used ``max_attempts``, then marked failed. While a task runs, its
+worker refreshes the job's lock every third of ``JOB_LOCK_TIMEOUT``; a
+running job whose lock has gone that long without a refresh belongs to a
+worker that stopped and is claimed again, so tasks should be safe to run
+twice.
+
+Tasks are plain functions registered with :func:`task`; they receive the
+Job and return a JSON-serializable result.
+"""
+import contextlib
+import datetime
+import io
+import logging
+import threading
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.storage import default_storage
+from django.db import DatabaseError, close_old_connections, connection, connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import importers, ledger, recurring, rollups, shards
+from .models import Job
+
+MAX_ATTEMPTS = getattr(settings, 'JOB_MAX_ATTEMPTS', 3)
+RETRY_DELAY = getattr(settings, 'JOB_RETRY_DELAY', 30)
+LOCK_TIMEOUT = getattr(settings, 'JOB_LOCK_TIMEOUT', 10 * 60)
+DEFAULT_POLL_INTERVAL = 1.0
+CLAIM_CANDIDATES = 10
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+# Tasks a user may start from the jobs endpoint, for their own data.
+USER_TASKS = ('rebuild_rollups', 'checkpoint_balance', 'materialize_recurring')
+
+
+def task(name):
+    """Register the decorated function as the task run for jobs of kind ``name``."""
+    def register(func):
+        TASKS[name] = func
+        return func
+    return register
+
+
+def enqueue(kind, user=None, payload=None, max_attempts=MAX_ATTEMPTS, run_after=None):
+    if kind not in TASKS:
+        raise ValueError(f"Unknown job kind '{kind}'.")
+    return Job.objects.create(kind=kind, job_of=user, payload=payload or {}, max_attempts=max_attempts,
+                              run_after=run_after or timezone.now())
+
+
+def describe(job):
+    """The status of a job as the polling endpoint reports it."""
+    return {
+        'id': job.pk,
+        'kind': job.kind,
+        'status': job.status,
+        'attempts': job.attempts,
+        'result': job.result,
+        'error': job.error,
+        'created_at': job.created_at,
+        'finished_at': job.finished_at,
+    }
+
+
+def _ready(now):
+    stale = now - datetime.timedelta(seconds=LOCK_TIMEOUT)
+    return (
+        Job.objects
+        .filter(Q(status='queued', run_after__lte=now) | Q(status='running', locked_at__lt=stale))
+        .order_by('run_after', 'pk')
+    )
+
+
+def claim(worker):
+    """Take the next runnable job for ``worker``; returns None when there is none."""
+    now = timezone.now()
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            job = _ready(now).select_for_update(skip_locked=True).first()
+            if job is None:
+                return None
+            job.status, job.locked_by, job.locked_at = 'running', worker, now
+            job.attempts += 1
+            job.save(update_fields=['status', 'locked_by', 'locked_at', 'attempts'])
+            return job
+    for job in _ready(now)[:CLAIM_CANDIDATES]:
+        # Only matches if no other worker has claimed the row since it was read.
+        claimed = Job.objects.filter(pk=job.pk, status=job.status, locked_at=job.locked_at).update(
+            status='running', locked_by=worker, locked_at=now, attempts=F('attempts') + 1)
+        if claimed:
+            job.refresh_from_db()
+            return job
+    return None
+
+
+def _finish(job, worker, **fields):
+    # A job reclaimed after its lock timed out belongs to the other worker now.
+    return Job.objects.filter(pk=job.pk, locked_by=worker, status='running').update(**fields)
+
+
+def _beat(job, worker, stop, interval):
+    try:
+        while not stop.wait(interval):
+            try:
+                Job.objects.filter(pk=job.pk, locked_by=worker, status='running').update(locked_at=timezone.now())
+            except DatabaseError:
+                logger.warning('Could not refresh the lock of job %s', job.pk, exc_info=True)
+    finally:
+        # The thread has connections of its own.
+        connections.close_all()
+
+
+@contextlib.contextmanager
+def heartbeat(job, worker):
+    """Keep refreshing the lock of a claimed job while the block runs, so it isn't taken for abandoned."""
+    stop = threading.Event()
+    beat = threading.Thread(target=_beat, args=(job, worker, stop, LOCK_TIMEOUT / 3), daemon=True)
+    beat.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        beat.join()
+
+
+def execute(job, worker):
+    """Run a claimed job and record its outcome."""
+    if job.attempts > job.max_attempts:
+        return _finish(job, worker, status='failed', finished_at=timezone.now(),
+                       error=job.error or 'The worker running this job stopped.')
+    try:
+        func = TASKS.get(job.kind)
+        if func is None:
+            raise LookupError(f"Unknown job kind '{job.kind}'.")
+        with shards.for_user(job.job_of_id):
+            result = func(job)
+    except Exception as e:
+        error = f'{type(e).__name__}: {e}'
+        if job.attempts < job.max_attempts:
+            delay = RETRY_DELAY * 2 ** (job.attempts - 1)
+            logger.warning('Job %s (%s) failed, retrying in %ss: %s', job.pk, job.kind, delay, error)
+            return _finish(job, worker, status='queued', locked_by='', locked_at=None, error=error,
+                           run_after=timezone.now() + datetime.timedelta(seconds=delay))
+        logger.exception('Job %s (%s) failed after %s attempts', job.pk, job.kind, job.attempts)
+        return _finish(job, worker, status='failed', error=error, finished_at=timezone.now())
+    return _finish(job, worker, status='succeeded', result=result, error='', finished_at=timezone.now(),
+                   payload=job.payload)
+
+
+def work(worker, stop=None, poll_interval=DEFAULT_POLL_INTERVAL, once=False):
+    """
+    Claim and run jobs until ``stop`` is set, or with ``once`` until no job
+    is ready; returns the number of jobs run.
+    """
+    stop = stop or threading.Event()
+    done = 0
+    while not stop.is_set():
+        if not connection.in_atomic_block:
+            # What a request does at its start: drop broken or expired connections.
+            close_old_connections()
+        job = claim(worker)
+        if job is None:
+            if once:
+                break
+            stop.wait(poll_interval)
+            continue
+        with heartbeat(job, worker):
+            execute(job, worker)
+        done += 1
+    return done
+
+
+@task('rebuild_rollups')
+def rebuild_rollups(job):
+    return {'written': rollups.rebuild(users=[job.job_of_id])}
+
+
+@task('checkpoint_balance')
+def checkpoint_balance(job):
+    checkpoint = ledger.checkpoint(job.job_of_id)
+    return {'balance': str(checkpoint.balance) if checkpoint else None}
+
+
+@task('materialize_recurring')
+def materialize_recurring(job):
+    created, error = recurring.materialize(workers=1, users=[job.job_of_id]).get(job.job_of_id, (0, None))
+    return {'created': created, 'error': error}
+
+
+@task('import_transactions')
+def import_transactions(job):
+    user = User.objects.get(pk=job.job_of_id)
+    path = job.payload['path']
+    try:
+        with default_storage.open(path, 'rb') as stored:
+            fileobj = io.TextIOWrapper(stored, encoding='utf-8-sig', newline='')
+            result = importers.import_file(user, fileobj, job.payload['format'])
+    finally:
+        # Import jobs run once (see transaction_import_view), so the file isn't needed again.
+        default_storage.delete(path)
+    job.payload = {'format': job.payload['format'], 'name': job.payload.get('name', '')}
+    return result
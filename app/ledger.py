@@ -0,0 +1,115 @@
+"""
+Balance ledger.
+
+A user's balance is changed only through :func:`adjust`, which issues a
+single ``UPDATE ... SET balance = balance + delta`` (guarded by
+``balance >= -delta`` when it takes money out) so concurrent writers never
+lose each other's updates and no lock is held across a read-modify-write
+cycle. Each change is also appended to BalanceEntry. BalanceCheckpoint rows, written
+periodically by ``manage.py checkpoint_balances``, let the balance be
+re-derived as "last checkpoint + sum of the entries since" for auditing and
+repair without replaying the whole history.
+"""
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, router, transaction
+from django.db.models import F, Max, Sum
+
+from .models import Balance, BalanceCheckpoint, BalanceEntry
+
+INSUFFICIENT_BALANCE = "Insufficient balance to complete this transaction."
+
+
+def effect(transaction_type, amount):
+    """How much a transaction of this type and amount moves the balance."""
+    amount = Decimal(amount)
+    return amount if transaction_type == 'income' else -amount
+
+
+def postings(previous, current):
+    """
+    The ``(user_id, delta)`` pairs needed to go from ``previous`` to ``current``.
+
+    Either side may be ``None`` for a create or a delete. Zero deltas are
+    dropped.
+    """
+    deltas = {}
+    if previous is not None:
+        key = previous.transaction_of_id
+        deltas[key] = deltas.get(key, 0) - effect(previous.transaction_type, previous.base_amount)
+    if current is not None:
+        key = current.transaction_of_id
+        deltas[key] = deltas.get(key, 0) + effect(current.transaction_type, current.base_amount)
+    return [(user_id, delta) for user_id, delta in deltas.items() if delta]
+
+
+def adjust(user_id, delta, require_funds=False):
+    """
+    Atomically add ``delta`` to the user's balance.
+
+    With ``require_funds`` a negative ``delta`` is only applied if the
+    balance covers it; otherwise ValidationError is raised and nothing
+    changes. The Balance row is created on first use. Callers move the user
+    to a new data version themselves, usually by stamping the rows they
+    write (see app.changes.stamp).
+    """
+    balances = Balance.objects.filter(balance_of_id=user_id)
+    guarded = balances.filter(balance__gte=-delta) if require_funds and delta < 0 else balances
+    if guarded.update(balance=F('balance') + delta):
+        return
+    if balances.exists():
+        raise ValidationError(INSUFFICIENT_BALANCE)
+    try:
+        with transaction.atomic(using=router.db_for_write(Balance)):
+            Balance.objects.create(balance_of_id=user_id, balance=0)
+    except IntegrityError:
+        # Created concurrently; either way the row exists now.
+        pass
+    if not guarded.update(balance=F('balance') + delta):
+        raise ValidationError(INSUFFICIENT_BALANCE)
+
+
+def record(user_id, delta, transaction_pk=None):
+    return BalanceEntry.objects.create(balance_of_id=user_id, delta=delta, transaction_pk=transaction_pk)
+
+
+def post(user_id, delta, transaction_pk=None, require_funds=False):
+    """:func:`adjust` and :func:`record` in one database transaction."""
+    with transaction.atomic(using=router.db_for_write(Balance)):
+        adjust(user_id, delta, require_funds=require_funds)
+        return record(user_id, delta, transaction_pk=transaction_pk)
+
+
+def ledger_balance(user_id):
+    """Re-derive a balance from the latest checkpoint and the entries after it."""
+    checkpoint = BalanceCheckpoint.objects.filter(balance_of_id=user_id).order_by('-entry_id').first()
+    entries = BalanceEntry.objects.filter(balance_of_id=user_id)
+    base = Decimal('0')
+    if checkpoint is not None:
+        entries = entries.filter(pk__gt=checkpoint.entry_id)
+        base = checkpoint.balance
+    return base + (entries.aggregate(total=Sum('delta'))['total'] or 0)
+
+
+def checkpoint(user_id):
+    """
+    Fold the entries written since the last checkpoint into a new one.
+
+    Returns the new BalanceCheckpoint, or ``None`` if there was nothing to
+    fold.
+    """
+    with transaction.atomic(using=router.db_for_write(BalanceCheckpoint)):
+        previous = BalanceCheckpoint.objects.filter(balance_of_id=user_id).order_by('-entry_id').first()
+        entries = BalanceEntry.objects.filter(balance_of_id=user_id)
+        base = Decimal('0')
+        if previous is not None:
+            entries = entries.filter(pk__gt=previous.entry_id)
+            base = previous.balance
+        last = entries.aggregate(last=Max('pk'))['last']
+        if last is None:
+            return None
+        # Only fold up to the id read above so entries inserted meanwhile
+        # are left for the next checkpoint.
+        total = entries.filter(pk__lte=last).aggregate(total=Sum('delta'))['total']
+        return BalanceCheckpoint.objects.create(balance_of_id=user_id, balance=base + total, entry_id=last)
@@ -0,0 +1,33 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from app import archive, exporters
+
+
+class Command(BaseCommand):
+    help = ('Move transactions older than ARCHIVE_AFTER_DAYS to the archive table, a batch at a time; '
+            'an interrupted run picks up where it stopped.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help='Archive transactions dated before this day (YYYY-MM-DD) instead.')
+        parser.add_argument('--user', action='append', dest='users', metavar='USERNAME',
+                            help='Only archive this user\'s transactions (may be repeated).')
+        parser.add_argument('--batch-size', type=int, default=archive.DEFAULT_BATCH_SIZE,
+                            help='Number of transactions moved per database transaction.')
+
+    def handle(self, *args, **options):
+        try:
+            before = exporters.parse_date(options['before']) or archive.horizon()
+        except ValueError as e:
+            raise CommandError(str(e))
+        user_ids = None
+        if options['users']:
+            user_ids = list(User.objects.filter(username__in=options['users']).values_list('pk', flat=True))
+            if len(user_ids) != len(set(options['users'])):
+                raise CommandError('One or more users do not exist.')
+
+        total = 0
+        for user_id, moved in archive.archive(before, users=user_ids, batch_size=options['batch_size']):
+            total += moved
+            self.stdout.write(f'User {user_id}: archived {moved} transactions.')
+        self.stdout.write(self.style.SUCCESS(f'Archived {total} transactions dated before {before}.'))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from app import caching, ledger, shards
+from app.models import Balance, BalanceEntry
+
+
+class Command(BaseCommand):
+    help = 'Fold recent balance ledger entries into checkpoints and report drift from the stored balances.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repair', action='store_true',
+                            help='Overwrite stored balances that disagree with the ledger.')
+
+    def handle(self, *args, **options):
+        written = 0
+        for database in shards.databases():
+            user_ids = BalanceEntry.objects.using(database).order_by().values_list('balance_of', flat=True).distinct()
+            for user_id in user_ids.iterator():
+                with shards.for_user(user_id):
+                    written += self.checkpoint(user_id, options['repair'])
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} checkpoints.'))
+
+    def checkpoint(self, user_id, repair):
+        written = 0
+        if ledger.checkpoint(user_id) is not None:
+            written += 1
+        expected = ledger.ledger_balance(user_id)
+        stored = Balance.objects.filter(balance_of_id=user_id).values_list('balance', flat=True).first()
+        if stored is not None and stored != expected:
+            self.stderr.write(f'User {user_id}: stored balance {stored} != ledger balance {expected}')
+            if repair:
+                Balance.objects.filter(balance_of_id=user_id).update(balance=expected)
+                caching.bump_version(user_id)
+        return written
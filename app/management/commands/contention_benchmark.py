@@ -0,0 +1,39 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Measure reads and writes per second with several processes sharing a scratch SQLite database, '
+            "with SQLite's defaults and with the configured pragmas, and write a JSON report.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=4, help='Concurrent processes.')
+        parser.add_argument('--seconds', type=float, default=5.0, help='Duration of each run.')
+        parser.add_argument('--write-ratio', type=float, default=0.2,
+                            help='Share of operations that add a transaction (0 to 1).')
+        parser.add_argument('--transactions', type=int, default=1000,
+                            help='Transactions seeded per process user.')
+        parser.add_argument('--database', help='Scratch database file to use instead of a temporary one.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for repeatable runs.')
+        parser.add_argument('--output', '-o', help='Write the report here instead of stdout.')
+
+    def handle(self, *args, **options):
+        if options['processes'] < 1 or options['seconds'] <= 0 or options['transactions'] < 0:
+            raise CommandError('--processes and --seconds must be positive.')
+        if not 0 <= options['write_ratio'] <= 1:
+            raise CommandError('--write-ratio must be between 0 and 1.')
+        try:
+            report = benchmark.contention(
+                processes=options['processes'], seconds=options['seconds'], write_ratio=options['write_ratio'],
+                transactions=options['transactions'], path=options['database'], random_seed=options['seed'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stderr.write(f"Wrote {options['output']}.")
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app import exporters, shards
+from app.models import ArchivedTransaction, Transaction
+
+
+class Command(BaseCommand):
+    help = 'Dump transactions of all (or selected) users as CSV or NDJSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(exporters.FORMATS), default='csv')
+        parser.add_argument('--output', '-o', help='File to write to; defaults to standard output.')
+        parser.add_argument('--user', action='append', dest='users', metavar='USERNAME',
+                            help='Only export this user\'s transactions (may be repeated).')
+        parser.add_argument('--start', help='Earliest date to include (YYYY-MM-DD).')
+        parser.add_argument('--end', help='Latest date to include (YYYY-MM-DD).')
+
+    def handle(self, *args, **options):
+        try:
+            start = exporters.parse_date(options['start'])
+            end = exporters.parse_date(options['end'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        transactions = exporters.filter_transactions(Transaction.objects.all(), start, end)
+        archived = exporters.filter_transactions(ArchivedTransaction.objects.all(), start, end)
+        if options['users']:
+            transactions = transactions.filter(transaction_of__username__in=options['users'])
+            archived = archived.filter(transaction_of__username__in=options['users'])
+
+        chunks = exporters.export_chunks(transactions, options['format'], include_owner=True,
+                                        databases=shards.databases(), archived=archived)
+        if options['output']:
+            with open(options['output'], 'w', newline='', encoding='utf-8') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,32 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from app import importers
+
+
+class Command(BaseCommand):
+    help = 'Import a CSV or OFX bank statement into a user\'s transactions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=importers.FORMATS,
+                            help='File format; detected from the file extension by default.')
+        parser.add_argument('--batch-size', type=int, default=importers.DEFAULT_BATCH_SIZE)
+        parser.add_argument('--category', default=importers.DEFAULT_CATEGORY,
+                            help='Category for rows that do not name one.')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['username']}' does not exist.")
+
+        file_format = options['format'] or importers.guess_format(options['path'])
+        with open(options['path'], newline='', encoding='utf-8-sig') as fileobj:
+            result = importers.import_file(user, fileobj, file_format, batch_size=options['batch_size'],
+                                           default_category=options['category'])
+
+        for error in result['errors']:
+            self.stderr.write(f"Line {error['line']}: {error['errors']}")
+        self.stdout.write(self.style.SUCCESS(f"Imported {result['created']} transactions."))
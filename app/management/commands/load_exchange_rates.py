@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from app import currency
+
+
+class Command(BaseCommand):
+    help = ('Load dated exchange rates from a CSV file with date, currency and rate columns '
+            '(rate = base currency units per unit). Existing rates for the same day are replaced.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file to load.')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['path'], newline='', encoding='utf-8-sig') as fileobj, transaction.atomic():
+                loaded = currency.load_rates(fileobj)
+        except OSError as e:
+            raise CommandError(str(e))
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f'Loaded {loaded} exchange rates (base {currency.BASE_CURRENCY}).'))
@@ -0,0 +1,36 @@
+import datetime
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from app import recurring
+
+
+class Command(BaseCommand):
+    help = 'Create the transactions of every recurring transaction that has come due. Safe to rerun.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='users', metavar='USERNAME',
+                            help='Only materialize for this user (may be repeated).')
+        parser.add_argument('--workers', type=int, default=recurring.DEFAULT_WORKERS,
+                            help='Number of users processed in parallel.')
+        parser.add_argument('--date', type=datetime.date.fromisoformat, default=None,
+                            help='Materialize occurrences up to this date (YYYY-MM-DD) instead of today.')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be positive.')
+        user_ids = None
+        if options['users']:
+            user_ids = list(User.objects.filter(username__in=options['users']).values_list('pk', flat=True))
+            if len(user_ids) != len(set(options['users'])):
+                raise CommandError('One or more users do not exist.')
+
+        results = recurring.materialize(today=options['date'], workers=options['workers'], users=user_ids)
+        created = sum(count for count, _ in results.values())
+        for user_id, (_, error) in sorted(results.items()):
+            if error:
+                self.stderr.write(f'User {user_id}: {error}')
+        failed = sum(1 for _, error in results.values() if error)
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {created} transactions for {len(results) - failed} users ({failed} failed).'))
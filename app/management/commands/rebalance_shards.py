@@ -0,0 +1,37 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from app import shards
+
+
+class Command(BaseCommand):
+    help = ('Move users between shards while the site stays up: one user with --user and --to, or every '
+            'user whose shard is not the one their id hashes to under the current SHARDS.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', metavar='USERNAME', help='Move only this user.')
+        parser.add_argument('--to', metavar='DATABASE', help='Shard to move --user to; defaults to their hashed one.')
+        parser.add_argument('--grace', type=float, default=shards.MOVE_GRACE,
+                            help='Seconds to let in-flight writes finish before copying each user.')
+
+    def handle(self, *args, **options):
+        if not shards.enabled():
+            raise CommandError('Only one shard is configured; set SHARDS first.')
+        if options['to'] and not options['user']:
+            raise CommandError('--to needs --user.')
+
+        if options['user'] is None:
+            moved = shards.rebalance(grace=options['grace'])
+        else:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User '{options['user']}' does not exist.")
+            target = options['to'] or shards.hashed(user.pk)
+            if target not in shards.databases():
+                raise CommandError(f"'{target}' is not one of the configured shards.")
+            moved = {}
+            if shards.placement(user.pk).database != target:
+                moved[user.pk] = shards.move(user.pk, target, grace=options['grace'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Moved {len(moved)} users ({sum(moved.values())} rows copied).'))
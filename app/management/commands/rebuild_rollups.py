@@ -0,0 +1,24 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from app import rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the pre-aggregated transaction rollups from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='users', metavar='USERNAME',
+                            help='Only rebuild rollups for this user (may be repeated).')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of rollup rows inserted per query.')
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options['users']:
+            user_ids = list(User.objects.filter(username__in=options['users']).values_list('pk', flat=True))
+            if len(user_ids) != len(set(options['users'])):
+                raise CommandError('One or more users do not exist.')
+
+        written = rollups.rebuild(users=user_ids, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {written} rollup rows.'))
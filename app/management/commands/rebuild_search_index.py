@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from app import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index over transaction names and remarks.'
+
+    def handle(self, *args, **options):
+        if search.rebuild():
+            self.stdout.write(self.style.SUCCESS('Rebuilt the transaction search index.'))
+        else:
+            self.stdout.write('Full-text search is not available on this database; nothing to rebuild.')
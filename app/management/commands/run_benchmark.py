@@ -0,0 +1,40 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Seed benchmark data at several sizes, time every endpoint and write a JSON report. '
+            'Benchmark users are created and deleted in the configured database.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,10000,100000',
+                            help='Comma separated transactions-per-user counts to benchmark.')
+        parser.add_argument('--users', type=int, default=1, help='Users seeded per size.')
+        parser.add_argument('--categories', type=int, default=benchmark.DEFAULT_CATEGORIES,
+                            help='Categories per user.')
+        parser.add_argument('--requests', type=int, default=20, help='Timed requests per endpoint.')
+        parser.add_argument('--cold', action='store_true',
+                            help='Clear the response cache before every request.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for repeatable data.')
+        parser.add_argument('--output', '-o', help='Write the report here instead of stdout.')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',') if size.strip()]
+        except ValueError:
+            raise CommandError(f"Invalid --sizes '{options['sizes']}'.")
+        if not sizes or min(sizes) < 0 or options['requests'] < 1 or options['users'] < 1:
+            raise CommandError('--sizes, --requests and --users must be positive.')
+
+        report = benchmark.run(sizes, users=options['users'], requests=options['requests'],
+                               categories=options['categories'], cold=options['cold'],
+                               random_seed=options['seed'])
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stderr.write(f"Wrote {options['output']}.")
+        else:
+            self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,49 @@
+import os
+import signal
+import socket
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from app import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs until interrupted.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help='Number of jobs run at the same time.')
+        parser.add_argument('--poll-interval', type=float, default=jobs.DEFAULT_POLL_INTERVAL,
+                            help='Seconds to wait before looking again when the queue is empty.')
+        parser.add_argument('--once', action='store_true', help='Exit once no job is ready instead of waiting.')
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['poll_interval'] <= 0:
+            raise CommandError('--concurrency and --poll-interval must be positive.')
+        stop = threading.Event()
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *args: stop.set())
+        counts = [0] * options['concurrency']
+        name = f'{socket.gethostname()}:{os.getpid()}'
+
+        def serve(index):
+            try:
+                counts[index] = jobs.work(f'{name}:{index}', stop, options['poll_interval'], options['once'])
+            finally:
+                # Each thread has its own connections.
+                connections.close_all()
+
+        threads = [threading.Thread(target=serve, args=(index,), daemon=True)
+                   for index in range(options['concurrency'])]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(0.5)
+        except KeyboardInterrupt:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        self.stdout.write(self.style.SUCCESS(f'Ran {sum(counts)} jobs.'))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Bulk-insert synthetic users, categories and transactions for benchmarking.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1, help='Number of users to create.')
+        parser.add_argument('--transactions', type=int, default=10000, help='Transactions per user.')
+        parser.add_argument('--categories', type=int, default=benchmark.DEFAULT_CATEGORIES,
+                            help='Categories per user.')
+        parser.add_argument('--days', type=int, default=benchmark.DEFAULT_DAYS,
+                            help='Spread transactions over this many days before today.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for repeatable data.')
+        parser.add_argument('--prefix', default=benchmark.USERNAME_PREFIX, help='Username prefix.')
+        parser.add_argument('--clear', action='store_true',
+                            help='Delete existing users with the prefix first.')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1 or options['categories'] < 1 or options['days'] < 1:
+            raise CommandError('--users, --categories and --days must be positive.')
+        if options['clear']:
+            removed = benchmark.clear(options['prefix'])
+            self.stdout.write(f'Removed {removed} benchmark users.')
+        users = benchmark.seed(
+            users=options['users'],
+            transactions=options['transactions'],
+            categories=options['categories'],
+            days=options['days'],
+            prefix=options['prefix'],
+            random_seed=options['seed'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {len(users)} users with {options['transactions']} transactions each."))
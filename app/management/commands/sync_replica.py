@@ -0,0 +1,27 @@
+import sqlite3
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from app import routers
+
+
+class Command(BaseCommand):
+    help = ('Copy the default SQLite database into the replica database, the local stand-in for a '
+            'streaming replica.')
+
+    def handle(self, *args, **options):
+        if routers.REPLICA_DATABASE not in connections.settings:
+            raise CommandError(f"No '{routers.REPLICA_DATABASE}' database is configured.")
+        source = connections[DEFAULT_DB_ALIAS]
+        target = connections[routers.REPLICA_DATABASE]
+        if source.vendor != 'sqlite' or target.vendor != 'sqlite':
+            raise CommandError('sync_replica only copies SQLite databases; use the database\'s own replication.')
+        target.close()
+        source.ensure_connection()
+        # The backup API copies a consistent snapshot while the source stays writable.
+        with sqlite3.connect(target.settings_dict['NAME']) as replica:
+            source.connection.backup(replica)
+        replica.close()
+        self.stdout.write(self.style.SUCCESS(f"Copied {source.settings_dict['NAME']} to "
+                                             f"{target.settings_dict['NAME']}."))
@@ -0,0 +1,58 @@
+# Generated by Django 4.1.7 on 2026-10-18 04:26
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Sum
+from django.db.models.functions import Trunc
+
+
+def fill_rollups(apps, schema_editor):
+    # One GROUP BY per granularity over the existing transactions, as
+    # rollups.rebuild does; later writes keep the buckets current.
+    Transaction = apps.get_model('app', 'Transaction')
+    TransactionRollup = apps.get_model('app', 'TransactionRollup')
+    using = schema_editor.connection.alias
+    for granularity in ('day', 'week', 'month', 'year'):
+        grouped = (
+            Transaction.objects.using(using)
+            .annotate(period=Trunc('date', granularity))
+            .order_by()
+            .values('transaction_of', 'transaction_type', 'category', 'period')
+            .annotate(total=Sum('amount'), count=Count('id'))
+        )
+        TransactionRollup.objects.using(using).bulk_create((
+            TransactionRollup(rollup_of_id=row['transaction_of'], transaction_type=row['transaction_type'],
+                              category_id=row['category'], granularity=granularity, period=row['period'],
+                              total=row['total'], count=row['count'])
+            for row in grouped.iterator()
+        ), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransactionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_type', models.CharField(choices=[('expense', 'Expense'), ('income', 'Income')], max_length=7)),
+                ('granularity', models.CharField(choices=[('day', 'Day'), ('week', 'Week'), ('month', 'Month'), ('year', 'Year')], max_length=5)),
+                ('period', models.DateField()),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='app.transactiontype')),
+                ('rollup_of', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='transactionrollup',
+            constraint=models.UniqueConstraint(fields=('rollup_of', 'granularity', 'transaction_type', 'category', 'period'), name='unique_rollup_bucket'),
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
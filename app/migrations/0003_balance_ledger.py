@@ -0,0 +1,71 @@
+# Generated by Django 4.1.7 on 2026-10-18 04:30
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def drop_duplicate_balances(apps, schema_editor):
+    # Only the first Balance row of a user was ever read; the rest are stale.
+    Balance = apps.get_model('app', 'Balance')
+    seen = set()
+    for balance in Balance.objects.order_by('pk'):
+        if balance.balance_of_id in seen:
+            balance.delete()
+        else:
+            seen.add(balance.balance_of_id)
+
+
+def open_ledgers(apps, schema_editor):
+    # Start every existing ledger with its current balance.
+    Balance = apps.get_model('app', 'Balance')
+    BalanceEntry = apps.get_model('app', 'BalanceEntry')
+    BalanceEntry.objects.bulk_create(
+        BalanceEntry(balance_of_id=balance.balance_of_id, delta=balance.balance)
+        for balance in Balance.objects.exclude(balance=0)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('app', '0002_transactionrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('entry_id', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BalanceEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('transaction_pk', models.BigIntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(drop_duplicate_balances, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='balance',
+            constraint=models.UniqueConstraint(fields=('balance_of',), name='unique_balance_per_user'),
+        ),
+        migrations.AddField(
+            model_name='balanceentry',
+            name='balance_of',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='balancecheckpoint',
+            name='balance_of',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(open_ledgers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.1.7 on 2026-10-18 04:45
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+def merge_duplicate_transaction_types(apps, schema_editor):
+    # Fold categories whose names differ only by case into the oldest one,
+    # moving their transactions and rollup buckets along.
+    TransactionType = apps.get_model('app', 'TransactionType')
+    Transaction = apps.get_model('app', 'Transaction')
+    TransactionRollup = apps.get_model('app', 'TransactionRollup')
+    keepers = {}
+    for category in TransactionType.objects.order_by('pk'):
+        key = (category.added_by_id, category.name.lower())
+        keeper = keepers.setdefault(key, category.pk)
+        if keeper == category.pk:
+            continue
+        Transaction.objects.filter(category_id=category.pk).update(category_id=keeper)
+        for bucket in TransactionRollup.objects.filter(category_id=category.pk):
+            target = TransactionRollup.objects.filter(
+                rollup_of_id=bucket.rollup_of_id, granularity=bucket.granularity,
+                transaction_type=bucket.transaction_type, category_id=keeper, period=bucket.period,
+            ).first()
+            if target is None:
+                bucket.category_id = keeper
+                bucket.save()
+            else:
+                target.total += bucket.total
+                target.count += bucket.count
+                target.save()
+                bucket.delete()
+        category.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_balance_ledger'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['transaction_of', 'date'], name='transaction_owner_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['transaction_of', 'transaction_type', 'date'], name='transaction_owner_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['transaction_of', 'category'], name='transaction_owner_cat_idx'),
+        ),
+        migrations.RunPython(merge_duplicate_transaction_types, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='transactiontype',
+            constraint=models.UniqueConstraint(models.F('added_by'), django.db.models.functions.text.Lower('name'), name='unique_transaction_type_name'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.1.7 on 2026-10-18 05:12
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copy_base_amounts(apps, schema_editor):
+    # Every existing transaction is in the base currency.
+    Transaction = apps.get_model('app', 'Transaction')
+    Transaction.objects.update(base_amount=F('amount'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_dataversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3)),
+                ('date', models.DateField()),
+                ('rate', models.DecimalField(decimal_places=8, max_digits=18)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='exchangerate',
+            constraint=models.UniqueConstraint(fields=('currency', 'date'), name='unique_exchange_rate'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='currency',
+            field=models.CharField(default='USD', max_length=3),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='base_amount',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=12, null=True),
+        ),
+        migrations.RunPython(copy_base_amounts, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='transaction',
+            name='base_amount',
+            field=models.DecimalField(decimal_places=2, editable=False, max_digits=12),
+        ),
+    ]
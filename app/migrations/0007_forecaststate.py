@@ -0,0 +1,28 @@
+# Generated by Django 4.1.7 on 2026-10-18 09:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('app', '0006_currency'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ForecastState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('alpha', models.DecimalField(decimal_places=3, max_digits=4)),
+                ('first_month', models.IntegerField()),
+                ('last_month', models.IntegerField()),
+                ('level_income', models.DecimalField(decimal_places=8, max_digits=20)),
+                ('level_expense', models.DecimalField(decimal_places=8, max_digits=20)),
+                ('forecast_of', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 4.1.7 on 2026-10-18 10:05
+
+from django.db import migrations, transaction
+from django.db.utils import OperationalError
+
+# External-content FTS5 index over app_transaction(name, remarks). The
+# triggers keep it in step with every write, including bulk_create and
+# cascading deletes, which send no model signals.
+CREATE_INDEX = [
+    """
+    CREATE VIRTUAL TABLE app_transaction_fts USING fts5(
+        name, remarks,
+        content='app_transaction', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER app_transaction_fts_insert AFTER INSERT ON app_transaction BEGIN
+        INSERT INTO app_transaction_fts(rowid, name, remarks) VALUES (new.id, new.name, new.remarks);
+    END
+    """,
+    """
+    CREATE TRIGGER app_transaction_fts_delete AFTER DELETE ON app_transaction BEGIN
+        INSERT INTO app_transaction_fts(app_transaction_fts, rowid, name, remarks)
+        VALUES ('delete', old.id, old.name, old.remarks);
+    END
+    """,
+    """
+    CREATE TRIGGER app_transaction_fts_update AFTER UPDATE OF name, remarks ON app_transaction BEGIN
+        INSERT INTO app_transaction_fts(app_transaction_fts, rowid, name, remarks)
+        VALUES ('delete', old.id, old.name, old.remarks);
+        INSERT INTO app_transaction_fts(rowid, name, remarks) VALUES (new.id, new.name, new.remarks);
+    END
+    """,
+    "INSERT INTO app_transaction_fts(app_transaction_fts) VALUES ('rebuild')",
+]
+
+DROP_INDEX = [
+    "DROP TRIGGER IF EXISTS app_transaction_fts_insert",
+    "DROP TRIGGER IF EXISTS app_transaction_fts_delete",
+    "DROP TRIGGER IF EXISTS app_transaction_fts_update",
+    "DROP TABLE IF EXISTS app_transaction_fts",
+]
+
+
+def create_search_index(apps, schema_editor):
+    # Other backends, and SQLite builds without FTS5, search with LIKE instead.
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    try:
+        with transaction.atomic(using=schema_editor.connection.alias):
+            for statement in CREATE_INDEX:
+                schema_editor.execute(statement)
+    except OperationalError:
+        pass
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in DROP_INDEX:
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_forecaststate'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
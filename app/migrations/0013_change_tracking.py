@@ -0,0 +1,63 @@
+# Generated by Django 4.1.7 on 2026-10-18 05:40
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('app', '0012_archivedtransaction'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('transaction', 'Transaction'), ('category', 'Category')], max_length=11)),
+                ('object_pk', models.BigIntegerField()),
+                ('change_version', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+                ('tombstone_of', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='archivedtransaction',
+            name='change_version',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='dataversion',
+            name='resync_version',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='change_version',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='transactiontype',
+            name='change_version',
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='archivedtransaction',
+            index=models.Index(fields=['transaction_of', 'change_version'], name='archived_owner_change_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['transaction_of', 'change_version'], name='transaction_owner_change_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transactiontype',
+            index=models.Index(fields=['added_by', 'change_version'], name='category_owner_change_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['tombstone_of', 'change_version'], name='tombstone_owner_change_idx'),
+        ),
+    ]
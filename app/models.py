@@ -1,4 +1,6 @@
-from django.db import models, transaction
+from django.conf import settings
+from django.db import models, router, transaction
+from django.db.models.functions import Lower
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 from django.contrib.auth.models import User
@@ -7,6 +9,30 @@ import datetime
 class TransactionType(models.Model):
     name = models.CharField(max_length=50)
     added_by = models.ForeignKey(User, on_delete=models.CASCADE)
+    # The owner's data version as of the last write (see app.changes); null
+    # on rows last written before changes were tracked.
+    change_version = models.BigIntegerField(null=True, blank=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        from . import changes, shards
+
+        kwargs['using'] = router.db_for_write(TransactionType, instance=self)
+        # Stamped in the same database transaction as the write, so no
+        # client can see the version before the row.
+        with shards.for_user(self.added_by_id), transaction.atomic(using=kwargs['using']):
+            self.change_version = changes.stamp(self.added_by_id)
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'change_version'}
+            super().save(*args, **kwargs)
+
+    class Meta:
+        constraints = [
+            # Also serves the case-insensitive name lookups in create_transaction_type.
+            models.UniqueConstraint(models.F('added_by'), Lower('name'), name='unique_transaction_type_name'),
+        ]
+        indexes = [
+            models.Index(fields=['added_by', 'change_version'], name='category_owner_change_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -23,26 +49,92 @@ class Transaction(models.Model):
     transaction_of = models.ForeignKey(User, on_delete=models.CASCADE,default=None)
     category = models.ForeignKey(TransactionType, on_delete=models.CASCADE)
     remarks = models.TextField(blank=True,null=True)
+    currency = models.CharField(max_length=3, default=settings.BASE_CURRENCY)
+    # ``amount`` converted to settings.BASE_CURRENCY when the row is written.
+    base_amount = models.DecimalField(max_digits=12, decimal_places=2, editable=False)
+    # Set on rows created by ``manage.py materialize_recurring``.
+    recurring = models.ForeignKey('RecurringTransaction', null=True, blank=True, editable=False,
+                                  on_delete=models.SET_NULL, related_name='transactions')
+    # The owner's data version as of the last write (see app.changes); null
+    # on rows last written before changes were tracked.
+    change_version = models.BigIntegerField(null=True, blank=True, editable=False)
 
 
     def save(self, *args, **kwargs):
-        if not self.pk:
-            # New transaction, update balance of user
-            balance = Balance.objects.filter(balance_of=self.transaction_of).first()
-            if balance is None:
-                balance = Balance(balance=0, balance_of=self.transaction_of)
-            if self.transaction_type == 'expense':
-                if self.amount > balance.balance:
-                    return  # Ignore the request
-                balance.balance -= self.amount
-            elif self.transaction_type == 'income':
-                balance.balance += self.amount
-            balance.save()
+        from . import changes, currency, forecast, ledger, rollups, shards
+
+        # Raises ValidationError when there is no rate for the currency yet.
+        self.base_amount = currency.to_base(self.amount, self.currency, self.date)
+        # All of a user's rows live on their shard, whatever database the
+        # manager picked.
+        kwargs['using'] = router.db_for_write(Transaction, instance=self)
+        with shards.for_user(self.transaction_of_id), transaction.atomic(using=kwargs['using']):
+            previous = None
+            if self.pk:
+                previous = Transaction.objects.select_for_update().filter(pk=self.pk).first()
+            # Balance changes are applied as atomic conditional updates; one
+            # the balance can't cover, whether a new expense or an income
+            # edited down, raises ValidationError before anything is written.
+            postings = ledger.postings(previous, self)
+            for user_id, delta in postings:
+                ledger.adjust(user_id, delta, require_funds=True)
+            self.change_version = changes.stamp(self.transaction_of_id)
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'change_version'}
+            super().save(*args, **kwargs)
+            for user_id, delta in postings:
+                ledger.record(user_id, delta, transaction_pk=self.pk)
+            # Keep the pre-aggregated summaries in step with this row.
+            if previous is not None:
+                rollups.apply([rollups.snapshot(previous)], sign=-1)
+                forecast.apply([rollups.snapshot(previous)], sign=-1)
+            rollups.apply([rollups.snapshot(self)])
+            forecast.apply([rollups.snapshot(self)])
+
+    class Meta:
+        ordering = ('-date',)
+        indexes = [
+            models.Index(fields=['transaction_of', 'date'], name='transaction_owner_date_idx'),
+            models.Index(fields=['transaction_of', 'transaction_type', 'date'], name='transaction_owner_type_idx'),
+            models.Index(fields=['transaction_of', 'category'], name='transaction_owner_cat_idx'),
+            models.Index(fields=['transaction_of', 'change_version'], name='transaction_owner_change_idx'),
+        ]
+        constraints = [
+            # Each occurrence of a recurring transaction is created at most once.
+            models.UniqueConstraint(fields=['recurring', 'date'], condition=models.Q(recurring__isnull=False),
+                                    name='unique_recurring_occurrence'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+
+class ArchivedTransaction(models.Model):
+    """
+    A transaction older than settings.ARCHIVE_AFTER_DAYS, moved out of the
+    Transaction table by ``manage.py archive_transactions`` (see
+    app.archive). It keeps the id it had there and still counts towards the
+    rollups and the balance.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    name = models.CharField(max_length=255)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    currency = models.CharField(max_length=3, default=settings.BASE_CURRENCY)
+    base_amount = models.DecimalField(max_digits=12, decimal_places=2)
+    date = models.DateField()
+    transaction_type = models.CharField(max_length=7, choices=Transaction.TRANSACTION_TYPES)
+    transaction_of = models.ForeignKey(User, on_delete=models.CASCADE)
+    category = models.ForeignKey(TransactionType, on_delete=models.CASCADE)
+    remarks = models.TextField(blank=True, null=True)
+    change_version = models.BigIntegerField(null=True, blank=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
 
-        super().save(*args, **kwargs)
-        
     class Meta:
         ordering = ('-date',)
+        indexes = [
+            models.Index(fields=['transaction_of', 'date'], name='archived_owner_date_idx'),
+            models.Index(fields=['transaction_of', 'change_version'], name='archived_owner_change_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -51,6 +143,232 @@ class Transaction(models.Model):
 class Balance(models.Model):
     balance = models.DecimalField(max_digits=10, decimal_places=2)
     balance_of = models.ForeignKey(User, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['balance_of'], name='unique_balance_per_user'),
+        ]
     
     def __str__(self):
-        return f"{self.balance}"
\ No newline at end of file
+        return f"{self.balance}"
+
+
+class BalanceEntry(models.Model):
+    """Append-only record of every change made to a user's Balance."""
+    balance_of = models.ForeignKey(User, on_delete=models.CASCADE)
+    delta = models.DecimalField(max_digits=12, decimal_places=2)
+    # Plain id rather than a foreign key: entries outlive deleted transactions.
+    transaction_pk = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.delta:+}"
+
+
+class BalanceCheckpoint(models.Model):
+    """The ledger balance of a user as of (and including) ``entry_id``."""
+    balance_of = models.ForeignKey(User, on_delete=models.CASCADE)
+    balance = models.DecimalField(max_digits=12, decimal_places=2)
+    entry_id = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.balance} @ {self.entry_id}"
+
+class TransactionRollup(models.Model):
+    GRANULARITIES = (
+        ('day', 'Day'),
+        ('week', 'Week'),
+        ('month', 'Month'),
+        ('year', 'Year'),
+    )
+    rollup_of = models.ForeignKey(User, on_delete=models.CASCADE)
+    transaction_type = models.CharField(max_length=7, choices=Transaction.TRANSACTION_TYPES)
+    category = models.ForeignKey(TransactionType, on_delete=models.CASCADE)
+    granularity = models.CharField(max_length=5, choices=GRANULARITIES)
+    period = models.DateField()
+    total = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['rollup_of', 'granularity', 'transaction_type', 'category', 'period'],
+                name='unique_rollup_bucket',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.granularity} {self.period} {self.transaction_type}: {self.total}"
+
+
+class DataVersion(models.Model):
+    """
+    Counter bumped on every write to a user's transactions, categories or
+    balance; cached API responses and their ETags are keyed on it.
+    """
+    version_of = models.OneToOneField(User, on_delete=models.CASCADE)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    # Changes up to this version can't be replayed (see app.changes.reset).
+    resync_version = models.BigIntegerField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.version_of_id}: {self.version}"
+
+
+class Tombstone(models.Model):
+    """A deleted transaction or category, kept so syncing clients learn of the delete (see app.changes)."""
+    KINDS = (
+        ('transaction', 'Transaction'),
+        ('category', 'Category'),
+    )
+    tombstone_of = models.ForeignKey(User, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=11, choices=KINDS)
+    object_pk = models.BigIntegerField()
+    change_version = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['tombstone_of', 'change_version'], name='tombstone_owner_change_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_pk} @ {self.change_version}"
+
+
+class ExchangeRate(models.Model):
+    """Units of settings.BASE_CURRENCY one unit of ``currency`` was worth on ``date``."""
+    currency = models.CharField(max_length=3)
+    date = models.DateField()
+    rate = models.DecimalField(max_digits=18, decimal_places=8)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['currency', 'date'], name='unique_exchange_rate'),
+        ]
+
+    def __str__(self):
+        return f"{self.currency} {self.date}: {self.rate}"
+
+
+class ForecastState(models.Model):
+    """
+    Exponentially smoothed monthly income and expense levels over a user's
+    completed months ``first_month`` to ``last_month`` (``year * 12 + month - 1``).
+    See app.forecast.
+    """
+    forecast_of = models.OneToOneField(User, on_delete=models.CASCADE)
+    alpha = models.DecimalField(max_digits=4, decimal_places=3)
+    first_month = models.IntegerField()
+    last_month = models.IntegerField()
+    level_income = models.DecimalField(max_digits=20, decimal_places=8)
+    level_expense = models.DecimalField(max_digits=20, decimal_places=8)
+
+    def __str__(self):
+        return f"{self.forecast_of_id}: +{self.level_income:.2f} -{self.level_expense:.2f}"
+
+
+class RecurringTransaction(models.Model):
+    """
+    A transaction repeated every ``interval`` days, weeks, months or years
+    from ``start_date`` until ``end_date``. Monthly and yearly occurrences
+    fall on ``day_of_month``, or the last day of shorter months.
+    ``next_date`` is the first occurrence not yet materialized (see
+    app.recurring).
+    """
+    FREQUENCIES = (
+        ('daily', 'Daily'),
+        ('weekly', 'Weekly'),
+        ('monthly', 'Monthly'),
+        ('yearly', 'Yearly'),
+    )
+    name = models.CharField(max_length=255)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    currency = models.CharField(max_length=3, default=settings.BASE_CURRENCY)
+    transaction_type = models.CharField(max_length=7, default="expense", choices=Transaction.TRANSACTION_TYPES)
+    recurring_of = models.ForeignKey(User, on_delete=models.CASCADE)
+    category = models.ForeignKey(TransactionType, on_delete=models.CASCADE)
+    remarks = models.TextField(blank=True, null=True)
+    frequency = models.CharField(max_length=7, default='monthly', choices=FREQUENCIES)
+    interval = models.PositiveSmallIntegerField(default=1)
+    day_of_month = models.PositiveSmallIntegerField(null=True, blank=True)
+    start_date = models.DateField(default=timezone.now)
+    end_date = models.DateField(null=True, blank=True)
+    next_date = models.DateField(editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_date'], name='recurring_next_date_idx'),
+        ]
+
+    def clean(self):
+        if self.interval < 1:
+            raise ValidationError({'interval': "Interval must be at least 1."})
+        if self.day_of_month is not None and not 1 <= self.day_of_month <= 31:
+            raise ValidationError({'day_of_month': "Day of month must be between 1 and 31."})
+        if self.end_date is not None and self.end_date < self.start_date:
+            raise ValidationError({'end_date': "End date cannot be before the start date."})
+
+    def save(self, *args, **kwargs):
+        from . import recurring
+
+        if self.next_date is None:
+            self.next_date = recurring.first_occurrence(self)
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"{self.name} ({self.frequency})"
+
+
+class Job(models.Model):
+    """A unit of background work, claimed and run by ``manage.py run_worker`` (see app.jobs)."""
+    STATUSES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    )
+    kind = models.CharField(max_length=50)
+    job_of = models.ForeignKey(User, on_delete=models.CASCADE, null=True, blank=True)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=9, default='queued', choices=STATUSES)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='job_ready_idx'),
+            models.Index(fields=['job_of', '-created_at'], name='job_owner_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} #{self.pk} ({self.status})"
+
+
+class ShardAssignment(models.Model):
+    """
+    The database alias in settings.SHARDS holding a user's rows (see
+    app.shards). Always stored in ``default``.
+    """
+    shard_of = models.OneToOneField(User, on_delete=models.CASCADE)
+    database = models.CharField(max_length=100)
+    # Set while ``manage.py rebalance_shards`` copies the user to another shard.
+    moving = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['database'], name='shard_database_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.shard_of_id}: {self.database}"
@@ -0,0 +1,151 @@
+"""
+Keyset (cursor) pagination for transaction listings.
+
+Transactions are listed newest first, matching ``Transaction.Meta.ordering``,
+with the primary key as a tie breaker: ``ORDER BY date DESC, id DESC``. A page
+is fetched with ``WHERE (date, id) < (cursor_date, cursor_id) LIMIT n``, so
+the cost of a page does not depend on how deep into the history it is, unlike
+OFFSET pagination.
+
+The admin changelists page with OFFSET; :class:`EstimatedCountPaginator`
+keeps them from counting every row of a large table on each page load.
+"""
+import base64
+import binascii
+import datetime
+import json
+
+from django.core.paginator import Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+STREAM_CHUNK_SIZE = 2000
+# Rows counted exactly by bounded_count, e.g. before EstimatedCountPaginator
+# falls back to an estimate.
+EXACT_COUNT_LIMIT = 10000
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(date, pk):
+    raw = f"{date.isoformat()}:{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        date, pk = base64.urlsafe_b64decode(padded.encode()).decode().split(':')
+        return datetime.date.fromisoformat(date), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(f"Invalid cursor '{cursor}'.")
+
+
+def page_size(value, default=DEFAULT_PAGE_SIZE):
+    """Parse a ``limit`` query parameter, clamped to ``MAX_PAGE_SIZE``."""
+    if value in (None, ''):
+        return default
+    try:
+        size = int(value)
+    except ValueError:
+        raise InvalidCursor(f"Invalid limit '{value}'.")
+    if size < 1:
+        raise InvalidCursor(f"Invalid limit '{value}'.")
+    return min(size, MAX_PAGE_SIZE)
+
+
+def order_newest_first(queryset):
+    return queryset.order_by('-date', '-pk')
+
+
+def after_cursor(queryset, cursor):
+    """Restrict an already ordered queryset to the rows following ``cursor``."""
+    if not cursor:
+        return queryset
+    date, pk = decode_cursor(cursor)
+    return queryset.filter(Q(date__lt=date) | Q(date=date, pk__lt=pk))
+
+
+def keyset_page(queryset, cursor=None, limit=DEFAULT_PAGE_SIZE, key=lambda row: (row['date'], row['pk'])):
+    """
+    Return ``(rows, next_cursor)`` for one page of ``queryset``.
+
+    ``key`` extracts ``(date, pk)`` from a row; the default suits ``values()``
+    querysets that include ``pk``. ``next_cursor`` is ``None`` on the last page.
+    """
+    queryset = after_cursor(order_newest_first(queryset), cursor)
+    rows = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(*key(rows[-1]))
+    return rows, next_cursor
+
+
+def stream_json(rows, key='transactions', chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Yield ``{"<key>": [row, ...]}`` as JSON text, a chunk of rows at a time.
+
+    ``rows`` should be a lazy iterable such as ``queryset.iterator()`` so the
+    full result never has to be held in memory.
+    """
+    encoder = DjangoJSONEncoder()
+    yield '{"%s": [' % key
+    buffer = []
+    first = True
+    for row in rows:
+        buffer.append(encoder.encode(row))
+        if len(buffer) >= chunk_size:
+            yield ('' if first else ',') + ','.join(buffer)
+            first = False
+            buffer = []
+    if buffer:
+        yield ('' if first else ',') + ','.join(buffer)
+    yield ']}'
+
+
+def planner_estimate(queryset):
+    """The query planner's row estimate for ``queryset``, or None where the database has none."""
+    if connections[queryset.db].vendor != 'postgresql':
+        return None
+    plan = json.loads(queryset.explain(format='json'))
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def bounded_count(queryset):
+    """
+    Count ``queryset`` exactly up to ``EXACT_COUNT_LIMIT`` rows; a larger
+    result counts as ``EXACT_COUNT_LIMIT + 1`` without reading the rest.
+    """
+    return queryset[:EXACT_COUNT_LIMIT + 1].count()
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that never counts more than ``EXACT_COUNT_LIMIT + 1`` rows.
+
+    ``count`` can be passed in when the caller knows it cheaply, e.g. from
+    the rollups. Otherwise rows are counted with :func:`bounded_count`, and a
+    larger result reports the planner's estimate where the database has one
+    (PostgreSQL) and it is higher, or else ``EXACT_COUNT_LIMIT + 1``, so the
+    pages stop one row past the limit; the rows beyond it are reached by
+    filtering further.
+    """
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, count=None):
+        super().__init__(object_list, per_page, orphans, allow_empty_first_page)
+        self.known_count = count
+
+    @cached_property
+    def count(self):
+        if self.known_count is not None:
+            return self.known_count
+        counted = bounded_count(self.object_list)
+        if counted <= EXACT_COUNT_LIMIT:
+            return counted
+        return max(planner_estimate(self.object_list) or 0, counted)
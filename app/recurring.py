@@ -0,0 +1,177 @@
+"""
+Materializing recurring transactions.
+
+:func:`materialize` turns every occurrence that has come due into a real
+Transaction. Each user is handled in one database transaction: their rules
+are locked, the due occurrences are inserted with one ``bulk_create``, the
+balance is adjusted once by the net amount and each rule's ``next_date`` is
+moved past what was created. Reruns therefore pick up only what is still
+missing, and the ``(recurring, date)`` unique constraint on Transaction
+backs this up should two schedulers ever overlap.
+
+Users are independent of each other, so they are spread over a thread
+pool. On SQLite the per-user transactions still write one at a time: each
+takes the write lock when it begins (``BEGIN IMMEDIATE``) and the others
+wait for it for up to the busy timeout (see ``expensemanager.sqlite``).
+When a user's balance can't cover the expenses due, nothing is created for
+that user and their occurrences are retried on the next run.
+"""
+import calendar
+import datetime
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, OperationalError, connections, router, transaction
+from django.db.models import F
+
+from . import changes, currency, forecast, ledger, rollups, shards
+from .models import RecurringTransaction, Transaction
+
+DEFAULT_WORKERS = 4
+
+logger = logging.getLogger(__name__)
+
+
+def _date(value):
+    return RecurringTransaction._meta.get_field('start_date').to_python(value)
+
+
+def _on_day(year, month, day):
+    """``day`` of the month, or its last day if the month is shorter."""
+    return datetime.date(year, month, min(day, calendar.monthrange(year, month)[1]))
+
+
+def _add_months(date, months, day):
+    index = date.year * 12 + date.month - 1 + months
+    return _on_day(index // 12, index % 12 + 1, day)
+
+
+def _anchor_day(rule):
+    return rule.day_of_month or _date(rule.start_date).day
+
+
+def first_occurrence(rule):
+    """The first occurrence on or after ``rule.start_date``."""
+    start = _date(rule.start_date)
+    if rule.frequency in ('daily', 'weekly'):
+        return start
+    first = _on_day(start.year, start.month, _anchor_day(rule))
+    if first >= start:
+        return first
+    return _add_months(first, 12 if rule.frequency == 'yearly' else 1, _anchor_day(rule))
+
+
+def following(rule, date):
+    """The occurrence after ``date``."""
+    if rule.frequency == 'daily':
+        return date + datetime.timedelta(days=rule.interval)
+    if rule.frequency == 'weekly':
+        return date + datetime.timedelta(weeks=rule.interval)
+    months = rule.interval * (12 if rule.frequency == 'yearly' else 1)
+    return _add_months(date, months, _anchor_day(rule))
+
+
+def due(rule, today):
+    """Dates from ``rule.next_date`` up to ``today`` and ``rule.end_date``."""
+    last = today if rule.end_date is None else min(today, _date(rule.end_date))
+    date = _date(rule.next_date)
+    while date <= last:
+        yield date
+        date = following(rule, date)
+
+
+def materialize_user(user_id, today):
+    """
+    Create the user's due occurrences; returns ``(created, error)`` where
+    ``error`` is None on success. A database that stays locked past the busy
+    timeout fails only this user, who is retried on the next run.
+    """
+    try:
+        with shards.for_user(user_id):
+            return len(_create_due(user_id, today)), None
+    except (ValidationError, IntegrityError, shards.ShardMoving) as e:
+        return 0, '; '.join(getattr(e, 'messages', [str(e)]))
+    except OperationalError as e:
+        logger.warning('Could not materialize recurring transactions of user %s: %s', user_id, e)
+        return 0, str(e)
+
+
+def _create_due(user_id, today):
+    using = router.db_for_write(RecurringTransaction)
+    with transaction.atomic(using=using):
+        rules = list(
+            RecurringTransaction.objects
+            .select_for_update()
+            .filter(recurring_of_id=user_id, next_date__lte=today)
+            .exclude(end_date__lt=F('next_date'))
+            .order_by('pk')
+        )
+        pending = [(rule, date) for rule in rules for date in due(rule, today)]
+        if not pending:
+            return []
+        rates = currency.RateTable({rule.currency for rule in rules})
+        existing = set(
+            Transaction.objects
+            .filter(recurring__in=rules, date__gte=min(date for _, date in pending))
+            .values_list('recurring_id', 'date')
+        )
+        objs = []
+        for rule, date in pending:
+            if (rule.pk, date) in existing:
+                continue
+            objs.append(Transaction(
+                name=rule.name, amount=rule.amount, currency=rule.currency,
+                base_amount=rates.to_base(rule.amount, rule.currency, date), date=date,
+                transaction_type=rule.transaction_type, transaction_of_id=user_id,
+                category_id=rule.category_id, remarks=rule.remarks, recurring=rule,
+            ))
+        net = sum((ledger.effect(obj.transaction_type, obj.base_amount) for obj in objs), 0)
+        if net:
+            ledger.adjust(user_id, net, require_funds=net < 0)
+        # bulk_create sends no signals; stamping moves the user to a new version.
+        version = changes.stamp(user_id)
+        for obj in objs:
+            obj.change_version = version
+        Transaction.objects.bulk_create(objs)
+        if net:
+            ledger.record(user_id, net)
+        snapshots = [rollups.snapshot(obj) for obj in objs]
+        rollups.apply(snapshots)
+        forecast.apply(snapshots)
+        last_due = {rule.pk: date for rule, date in pending}
+        for rule in rules:
+            rule.next_date = following(rule, last_due[rule.pk])
+        RecurringTransaction.objects.bulk_update(rules, ['next_date'])
+    return objs
+
+
+def _materialize_in_thread(user_id, today):
+    try:
+        return materialize_user(user_id, today)
+    finally:
+        # Each pool thread has its own connection.
+        connections.close_all()
+
+
+def _pending_users(database, today, users):
+    # Rules past their end date keep their last next_date and are skipped.
+    pending = RecurringTransaction.objects.filter(next_date__lte=today).exclude(end_date__lt=F('next_date'))
+    if users is not None:
+        pending = pending.filter(recurring_of__in=users)
+    return list(pending.order_by('recurring_of').values_list('recurring_of', flat=True).distinct())
+
+
+def materialize(today=None, workers=DEFAULT_WORKERS, users=None):
+    """
+    Materialize every due occurrence for all users (or the given user ids);
+    returns ``{user_id: (created, error)}`` for the users that had any.
+    """
+    today = today or datetime.date.today()
+    found = shards.fan_out(lambda database: _pending_users(database, today, users))
+    user_ids = sorted(user_id for ids in found.values() for user_id in ids)
+    if workers <= 1 or len(user_ids) <= 1:
+        return {user_id: materialize_user(user_id, today) for user_id in user_ids}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(_materialize_in_thread, user_ids, [today] * len(user_ids))
+        return dict(zip(user_ids, results))
@@ -0,0 +1,102 @@
+"""
+Per-category breakdowns of a user's transactions, aggregated in the database.
+
+The category endpoint used to ship every transaction to the browser and sum
+them there; here a single ``GROUP BY category`` query does the work, so the
+response grows with the number of categories, not with the history.
+"""
+from decimal import Decimal
+
+from django.db.models import Count, F, Max, Min, Sum
+
+from .models import Transaction
+
+TRANSACTION_TYPES = [key for key, _ in Transaction.TRANSACTION_TYPES] + ['all']
+OTHER_CATEGORY = 'Other'
+
+CENT = Decimal('0.01')
+
+
+def _row(category_id, category, total, count, low, high):
+    return {
+        'category_id': category_id,
+        'category': category,
+        'total': Decimal(total).quantize(CENT),
+        'count': count,
+        'average': (Decimal(total) / count).quantize(CENT),
+        'min': Decimal(low).quantize(CENT),
+        'max': Decimal(high).quantize(CENT),
+    }
+
+
+def _grouped(queryset, transaction_type):
+    if transaction_type not in TRANSACTION_TYPES:
+        raise ValueError(f"Unknown transaction type '{transaction_type}'.")
+    if transaction_type != 'all':
+        queryset = queryset.filter(transaction_type=transaction_type)
+    return (
+        queryset
+        .order_by()
+        .values('category')
+        .annotate(name=F('category__name'), total=Sum('base_amount'), count=Count('id'),
+                  low=Min('base_amount'), high=Max('base_amount'))
+        .order_by('-total', 'name')
+    )
+
+
+def _breakdown_row(row):
+    return _row(row['category'], row['name'], row['total'], row['count'], row['low'], row['high'])
+
+
+def _combined(rows):
+    """Fold rows of the same category (hot and archived) into one, largest total first."""
+    combined = {}
+    for row in rows:
+        current = combined.get(row['category'])
+        if current is None:
+            combined[row['category']] = dict(row)
+            continue
+        current['total'] += row['total']
+        current['count'] += row['count']
+        current['low'] = min(current['low'], row['low'])
+        current['high'] = max(current['high'], row['high'])
+    return sorted(combined.values(), key=lambda row: (-row['total'], row['name']))
+
+
+def _top(rows, top):
+    if top is None or len(rows) <= top:
+        return rows
+    rest = rows[top:]
+    other = _row(
+        None,
+        OTHER_CATEGORY,
+        sum(row['total'] for row in rest),
+        sum(row['count'] for row in rest),
+        min(row['min'] for row in rest),
+        max(row['max'] for row in rest),
+    )
+    return rows[:top] + [other]
+
+
+def category_breakdown(queryset, transaction_type='expense', top=None, archived=None):
+    """
+    Return per-category ``total``, ``count``, ``average``, ``min`` and ``max``
+    for ``queryset`` in the base currency, largest total first.
+
+    ``transaction_type`` is ``'expense'``, ``'income'`` or ``'all'``. With
+    ``top`` only the ``top`` largest categories are listed and the rest are
+    folded into one trailing ``OTHER_CATEGORY`` row with no ``category_id``.
+    ``archived`` is an ArchivedTransaction queryset to include as well.
+    """
+    rows = list(_grouped(queryset, transaction_type))
+    if archived is not None:
+        rows = _combined(rows + list(_grouped(archived, transaction_type)))
+    return _top([_breakdown_row(row) for row in rows], top)
+
+
+async def acategory_breakdown(queryset, transaction_type='expense', top=None, archived=None):
+    """Async counterpart of :func:`category_breakdown`."""
+    rows = [row async for row in _grouped(queryset, transaction_type)]
+    if archived is not None:
+        rows = _combined(rows + [row async for row in _grouped(archived, transaction_type)])
+    return _top([_breakdown_row(row) for row in rows], top)
@@ -0,0 +1,320 @@
+"""
+Pre-aggregated transaction totals.
+
+Every Transaction contributes to one TransactionRollup bucket per granularity
+(day, week, month, year), keyed by owner, type and category. The buckets are
+adjusted in place whenever a transaction is created, edited or deleted, so the
+summary endpoints only have to read a handful of rows instead of scanning the
+user's whole history.
+"""
+import datetime
+import heapq
+import itertools
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, connections, router, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import Trunc
+
+from . import shards
+from .models import ArchivedTransaction, ForecastState, Transaction, TransactionRollup
+
+GRANULARITIES = [key for key, _ in TransactionRollup.GRANULARITIES]
+
+
+def period_start(date, granularity):
+    """Return the first day of the bucket ``date`` falls into."""
+    if isinstance(date, datetime.datetime):
+        date = date.date()
+    if granularity == 'day':
+        return date
+    if granularity == 'week':
+        return date - datetime.timedelta(days=date.weekday())
+    if granularity == 'month':
+        return date.replace(day=1)
+    if granularity == 'year':
+        return date.replace(month=1, day=1)
+    raise ValueError(f"Unknown granularity '{granularity}'")
+
+
+def snapshot(trans):
+    """The fields of a transaction that decide which buckets it counts towards (amount in the base currency)."""
+    return {
+        'transaction_of_id': trans.transaction_of_id,
+        'transaction_type': trans.transaction_type,
+        'category_id': trans.category_id,
+        'date': Transaction._meta.get_field('date').to_python(trans.date),
+        'amount': trans.base_amount,
+    }
+
+
+def _bucket_deltas(rows, sign):
+    deltas = defaultdict(lambda: [Decimal('0'), 0])
+    for row in rows:
+        for granularity in GRANULARITIES:
+            key = (
+                row['transaction_of_id'],
+                row['transaction_type'],
+                row['category_id'],
+                granularity,
+                period_start(row['date'], granularity),
+            )
+            deltas[key][0] += sign * Decimal(row['amount'])
+            deltas[key][1] += sign
+    return deltas
+
+
+# Periods per lookup query, to stay under SQLite's bound-parameter limit.
+LOOKUP_CHUNK_SIZE = 500
+
+
+def _existing_buckets(keys):
+    """Map the bucket keys that already have a row to that row's pk."""
+    wanted = defaultdict(set)
+    categories = defaultdict(set)
+    for user_id, _, category_id, granularity, period in keys:
+        wanted[user_id].add((granularity, period))
+        categories[user_id].add(category_id)
+    existing = {}
+    for user_id, pairs in wanted.items():
+        pairs = sorted(pairs)
+        for start in range(0, len(pairs), LOOKUP_CHUNK_SIZE):
+            by_granularity = defaultdict(list)
+            for granularity, period in pairs[start:start + LOOKUP_CHUNK_SIZE]:
+                by_granularity[granularity].append(period)
+            condition = Q()
+            for granularity, periods in by_granularity.items():
+                condition |= Q(granularity=granularity, period__in=periods)
+            rows = (
+                TransactionRollup.objects
+                .filter(condition, rollup_of_id=user_id, category_id__in=categories[user_id])
+                .values_list('pk', 'transaction_type', 'category_id', 'granularity', 'period')
+            )
+            for pk, trans_type, category_id, granularity, period in rows:
+                key = (user_id, trans_type, category_id, granularity, period)
+                if key in keys:
+                    existing[key] = pk
+    return existing
+
+
+def _increment(changes):
+    """
+    Apply ``(total, count, pk)`` increments with one prepared UPDATE.
+
+    A single ``executemany`` keeps each increment atomic in the database
+    (``total = total + %s``) without building a CASE expression per row,
+    which gets quadratically slower with the batch size.
+    """
+    if not changes:
+        return
+    connection = connections[router.db_for_write(TransactionRollup)]
+    table = connection.ops.quote_name(TransactionRollup._meta.db_table)
+    total = connection.ops.quote_name('total')
+    count = connection.ops.quote_name('count')
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f'UPDATE {table} SET {total} = {total} + %s, {count} = {count} + %s WHERE id = %s',
+            [(str(delta_total), delta_count, pk) for delta_total, delta_count, pk in changes],
+        )
+
+
+def _upsert(key, total, count):
+    user_id, trans_type, category_id, granularity, period = key
+    buckets = TransactionRollup.objects.filter(
+        rollup_of_id=user_id,
+        transaction_type=trans_type,
+        category_id=category_id,
+        granularity=granularity,
+        period=period,
+    )
+    if buckets.update(total=F('total') + total, count=F('count') + count):
+        return
+    try:
+        with transaction.atomic(using=router.db_for_write(TransactionRollup)):
+            TransactionRollup.objects.create(
+                rollup_of_id=user_id,
+                transaction_type=trans_type,
+                category_id=category_id,
+                granularity=granularity,
+                period=period,
+                total=total,
+                count=count,
+            )
+    except IntegrityError:
+        # Another writer created the bucket first.
+        buckets.update(total=F('total') + total, count=F('count') + count)
+
+
+def apply(rows, sign=1):
+    """
+    Add (``sign=1``) or remove (``sign=-1``) ``rows`` from their buckets.
+
+    ``rows`` are dicts shaped like :func:`snapshot`. Deltas are merged per
+    bucket first and then written set-wise: one lookup of the existing
+    buckets, one prepared ``UPDATE ... SET total = total + %s`` run with
+    ``executemany`` over them and one bulk INSERT for new ones, so a batch of
+    thousands of rows costs a few statements rather than a few per row.
+    """
+    deltas = {
+        key: (total, count)
+        for key, (total, count) in _bucket_deltas(rows, sign).items()
+        if total or count
+    }
+    if not deltas:
+        return
+    using = router.db_for_write(TransactionRollup)
+    with transaction.atomic(using=using):
+        existing = _existing_buckets(deltas)
+        _increment([(deltas[key][0], deltas[key][1], pk) for key, pk in existing.items()])
+        if sign < 0:
+            # Removing rows never creates buckets (the owner may be in the
+            # middle of a cascade delete); emptied buckets are dropped.
+            TransactionRollup.objects.filter(pk__in=list(existing.values()), count=0).delete()
+            return
+
+        missing = [key for key in deltas if key not in existing]
+        try:
+            with transaction.atomic(using=using):
+                TransactionRollup.objects.bulk_create([
+                    TransactionRollup(
+                        rollup_of_id=user_id,
+                        transaction_type=trans_type,
+                        category_id=category_id,
+                        granularity=granularity,
+                        period=period,
+                        total=deltas[key][0],
+                        count=deltas[key][1],
+                    )
+                    for key in missing
+                    for user_id, trans_type, category_id, granularity, period in [key]
+                ], batch_size=LOOKUP_CHUNK_SIZE)
+        except IntegrityError:
+            # Some buckets were created concurrently; fall back to one upsert each.
+            for key in missing:
+                _upsert(key, *deltas[key])
+
+
+def _monthly_totals(user, transaction_type):
+    return (
+        TransactionRollup.objects
+        .filter(rollup_of=user, granularity='month', transaction_type=transaction_type)
+        .values(month=F('period'))
+        .annotate(total=Sum('total'))
+        .order_by('-month')
+    )
+
+
+def monthly_totals(user, transaction_type):
+    """Per-month totals for one transaction type, newest month first."""
+    return list(_monthly_totals(user, transaction_type))
+
+
+async def amonthly_totals(user, transaction_type):
+    return [row async for row in _monthly_totals(user, transaction_type)]
+
+
+def _year_buckets(user):
+    return TransactionRollup.objects.filter(rollup_of=user, granularity='year')
+
+
+def _quantize_total(total):
+    return Decimal(total or 0).quantize(Decimal('0.01'))
+
+
+def grand_total(user):
+    """Sum of every transaction amount the user has, read from the year buckets."""
+    return _quantize_total(_year_buckets(user).aggregate(total=Sum('total'))['total'])
+
+
+async def agrand_total(user):
+    return _quantize_total((await _year_buckets(user).aaggregate(total=Sum('total')))['total'])
+
+
+def transaction_count(user, granularity='year', period=None, transaction_type=None, category_id=None):
+    """
+    How many of the user's transactions fall in ``period`` (the whole
+    history when None), optionally of one type or category, from the
+    buckets rather than the transactions.
+    """
+    buckets = TransactionRollup.objects.filter(rollup_of=user, granularity=granularity)
+    if period is not None:
+        buckets = buckets.filter(period=period)
+    if transaction_type is not None:
+        buckets = buckets.filter(transaction_type=transaction_type)
+    if category_id is not None:
+        buckets = buckets.filter(category_id=category_id)
+    return buckets.aggregate(count=Sum('count'))['count'] or 0
+
+
+def rebuild(users=None, batch_size=1000):
+    """
+    Recompute all buckets from the raw transactions, archived ones included,
+    in a few GROUP BY queries.
+
+    ``users`` limits the rebuild to the given user ids; by default every
+    user's rollups are replaced, on every shard. Returns the number of
+    buckets written.
+    """
+    written = 0
+    for database in shards.databases():
+        with shards.for_database(database):
+            written += _rebuild(database, users, batch_size)
+    return written
+
+
+def _grouped(queryset, granularity):
+    return (
+        queryset
+        .annotate(period=Trunc('date', granularity))
+        .order_by()
+        .values('transaction_of', 'transaction_type', 'category', 'period')
+        .annotate(total=Sum('base_amount'), count=Count('id'))
+        .order_by('transaction_of', 'transaction_type', 'category', 'period')
+    )
+
+
+def _bucket_key(row):
+    return row['transaction_of'], row['transaction_type'], row['category'], row['period']
+
+
+def _rebuild(database, users, batch_size):
+    transactions = Transaction.objects.all()
+    archived = ArchivedTransaction.objects.all()
+    rollups = TransactionRollup.objects.all()
+    forecasts = ForecastState.objects.all()
+    if users is not None:
+        transactions = transactions.filter(transaction_of__in=users)
+        archived = archived.filter(transaction_of__in=users)
+        rollups = rollups.filter(rollup_of__in=users)
+        forecasts = forecasts.filter(forecast_of__in=users)
+
+    written = 0
+    with transaction.atomic(using=database):
+        rollups.delete()
+        # Forecasts are fitted from the buckets; they refit on their next read.
+        forecasts.delete()
+        for granularity in GRANULARITIES:
+            # Both sides come sorted by bucket, so a bucket with hot and
+            # archived rows is summed from two adjacent groups.
+            grouped = heapq.merge(_grouped(transactions, granularity).iterator(),
+                                  _grouped(archived, granularity).iterator(), key=_bucket_key)
+            batch = []
+            for (owner, transaction_type, category, period), rows in itertools.groupby(grouped, key=_bucket_key):
+                rows = list(rows)
+                batch.append(TransactionRollup(
+                    rollup_of_id=owner,
+                    transaction_type=transaction_type,
+                    category_id=category,
+                    granularity=granularity,
+                    period=period,
+                    total=sum(row['total'] for row in rows),
+                    count=sum(row['count'] for row in rows),
+                ))
+                if len(batch) >= batch_size:
+                    TransactionRollup.objects.bulk_create(batch)
+                    written += len(batch)
+                    batch = []
+            TransactionRollup.objects.bulk_create(batch)
+            written += len(batch)
+    return written
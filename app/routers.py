@@ -0,0 +1,102 @@
+"""
+Routing read-only analytics traffic to a read replica.
+
+With ``settings.READ_REPLICA`` on, views wrapped in :func:`replica_reads`
+run their queries against the ``settings.REPLICA_DATABASE`` alias instead
+of ``default``; all other reads and every write stay on ``default``.
+
+Replicas lag, so a user who has just written is pinned to ``default`` for
+``READ_REPLICA_STICKY_SECONDS`` and keeps reading their own writes. Every
+write already goes through :func:`app.caching.bump_version`, which stamps
+the user's DataVersion with the time, so the pin is read from that row on
+``default``; every server process sees it, whatever the cache backend.
+
+Replicas are never migrated; they are copies of ``default`` (see the
+``sync_replica`` command for a local SQLite stand-in).
+"""
+import asyncio
+import contextvars
+import datetime
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+
+from .models import DataVersion
+
+REPLICA_DATABASE = getattr(settings, 'REPLICA_DATABASE', 'replica')
+STICKY_SECONDS = getattr(settings, 'READ_REPLICA_STICKY_SECONDS', 5)
+
+_read_alias = contextvars.ContextVar('read_alias', default=None)
+
+
+def replica():
+    """The replica alias, or None when reads aren't routed."""
+    if getattr(settings, 'READ_REPLICA', False) and REPLICA_DATABASE in connections.settings:
+        return REPLICA_DATABASE
+    return None
+
+
+def read_alias():
+    """The alias reads are routed to in the current context; None means ``default``."""
+    return _read_alias.get()
+
+
+def _routable(request):
+    return replica() is not None and request.user.is_authenticated
+
+
+def _recent_writes(user_id):
+    # Runs before the view's reads are routed, so on the user's shard of default.
+    cutoff = timezone.now() - datetime.timedelta(seconds=STICKY_SECONDS)
+    return DataVersion.objects.filter(version_of_id=user_id, updated_at__gt=cutoff)
+
+
+def _alias_for(request):
+    if not _routable(request) or _recent_writes(request.user.pk).exists():
+        return None
+    return replica()
+
+
+async def _aalias_for(request):
+    if not _routable(request) or await _recent_writes(request.user.pk).aexists():
+        return None
+    return replica()
+
+
+def replica_reads(view):
+    """Route the view's reads to the replica unless the user wrote recently."""
+    if asyncio.iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            token = _read_alias.set(await _aalias_for(request))
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                _read_alias.reset(token)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = _read_alias.set(_alias_for(request))
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            _read_alias.reset(token)
+    return wrapper
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _read_alias.get()
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as default.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA_DATABASE
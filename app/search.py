@@ -0,0 +1,184 @@
+"""
+Full-text search over transaction names and remarks.
+
+On SQLite the search runs against ``app_transaction_fts``, an FTS5 index
+created by migration 0008 and kept in sync by triggers on
+``app_transaction``. SQLite drops those triggers whenever a migration
+rebuilds the table, so they are recreated, and the index rebuilt, after
+every ``migrate``; until then search falls back as below. Matches are
+ranked with BM25, a hit in the name weighing more than one in the remarks,
+and filtered and paginated in the same query, so only one page of ids is
+ever read back.
+
+Without FTS5 (other backends, or an SQLite build without it) the same
+queries fall back to ``icontains`` lookups, newest first and unranked.
+
+Every word of the query has to match. A word ending in ``*`` matches as a
+prefix, and so does the last word, so results can follow the user's typing.
+"""
+import re
+
+from django.db import connections, router, transaction
+from django.db.models import Q
+
+from . import shards
+from .exporters import filter_transactions
+from .models import Transaction
+from .pagination import DEFAULT_PAGE_SIZE
+from .serializers import transaction_values
+
+FTS_TABLE = 'app_transaction_fts'
+NAME_WEIGHT = 10.0
+REMARKS_WEIGHT = 1.0
+
+# As created by migration 0008.
+TRIGGERS = {
+    'app_transaction_fts_insert': """
+        CREATE TRIGGER app_transaction_fts_insert AFTER INSERT ON app_transaction BEGIN
+            INSERT INTO app_transaction_fts(rowid, name, remarks) VALUES (new.id, new.name, new.remarks);
+        END
+    """,
+    'app_transaction_fts_delete': """
+        CREATE TRIGGER app_transaction_fts_delete AFTER DELETE ON app_transaction BEGIN
+            INSERT INTO app_transaction_fts(app_transaction_fts, rowid, name, remarks)
+            VALUES ('delete', old.id, old.name, old.remarks);
+        END
+    """,
+    'app_transaction_fts_update': """
+        CREATE TRIGGER app_transaction_fts_update AFTER UPDATE OF name, remarks ON app_transaction BEGIN
+            INSERT INTO app_transaction_fts(app_transaction_fts, rowid, name, remarks)
+            VALUES ('delete', old.id, old.name, old.remarks);
+            INSERT INTO app_transaction_fts(rowid, name, remarks) VALUES (new.id, new.name, new.remarks);
+        END
+    """,
+}
+
+_TERM = re.compile(r'(\w+)(\*?)')
+
+_enabled = {}
+
+
+def _missing_triggers(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'app_transaction'")
+        return set(TRIGGERS) - {name for name, in cursor.fetchall()}
+
+
+def fts_enabled(using='default'):
+    """
+    Whether the FTS5 index and the triggers keeping it current exist on this
+    database; looked up once per database.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    key = (using, connection.settings_dict['NAME'])
+    if key not in _enabled:
+        _enabled[key] = FTS_TABLE in connection.introspection.table_names() and not _missing_triggers(connection)
+    return _enabled[key]
+
+
+def restore_triggers(using='default'):
+    """
+    Recreate the index triggers a rebuild of ``app_transaction`` dropped,
+    then rebuild the index, which missed the writes made without them.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    _enabled.pop((using, connection.settings_dict['NAME']), None)
+    if FTS_TABLE not in connection.introspection.table_names():
+        return
+    missing = _missing_triggers(connection)
+    if not missing:
+        return
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        for name in sorted(missing):
+            cursor.execute(TRIGGERS[name])
+        cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def parse_query(query):
+    """Split a query into ``(word, is_prefix)`` terms; punctuation is ignored."""
+    terms = [(word, bool(star)) for word, star in _TERM.findall(query or '')]
+    if terms:
+        terms[-1] = (terms[-1][0], True)
+    return terms
+
+
+def match_expression(terms):
+    """An FTS5 MATCH string; every word is quoted so none is read as an operator."""
+    return ' '.join('"%s"%s' % (word, '*' if prefix else '') for word, prefix in terms)
+
+
+def search(user, query, start=None, end=None, categories=None, offset=0, limit=DEFAULT_PAGE_SIZE):
+    """
+    Return ``(rows, next_offset)`` for one page of the user's transactions
+    matching ``query``; rows are ``transaction_values`` dicts with a
+    ``rank`` (lower is better, None in the fallback). ``next_offset`` is
+    None on the last page.
+    """
+    terms = parse_query(query)
+    if not terms:
+        return [], None
+    using = router.db_for_read(Transaction)
+    if fts_enabled(using):
+        hits = _fts_hits(using, user.pk, terms, start, end, categories, offset, limit + 1)
+    else:
+        hits = _fallback_hits(user.pk, terms, start, end, categories, offset, limit + 1)
+    next_offset = None
+    if len(hits) > limit:
+        hits = hits[:limit]
+        next_offset = offset + limit
+    ranks = dict(hits)
+    rows = {row['pk']: row for row in transaction_values(Transaction.objects.filter(pk__in=ranks))}
+    page = []
+    for pk, rank in hits:
+        row = rows[pk]
+        row['rank'] = rank
+        page.append(row)
+    return page, next_offset
+
+
+def _fts_hits(using, user_id, terms, start, end, categories, offset, limit):
+    connection = connections[using]
+    table = Transaction._meta.db_table
+    where = [f'{FTS_TABLE} MATCH %s', 't.transaction_of_id = %s']
+    params = [match_expression(terms), user_id]
+    if start is not None:
+        where.append('t.date >= %s')
+        params.append(connection.ops.adapt_datefield_value(start))
+    if end is not None:
+        where.append('t.date <= %s')
+        params.append(connection.ops.adapt_datefield_value(end))
+    if categories:
+        where.append('t.category_id IN (%s)' % ', '.join(['%s'] * len(categories)))
+        params.extend(categories)
+    sql = (
+        f'SELECT t.id, bm25({FTS_TABLE}, %s, %s) AS score '
+        f'FROM {FTS_TABLE} JOIN {table} t ON t.id = {FTS_TABLE}.rowid '
+        f'WHERE {" AND ".join(where)} '
+        f'ORDER BY score, t.date DESC, t.id DESC LIMIT %s OFFSET %s'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [NAME_WEIGHT, REMARKS_WEIGHT, *params, limit, offset])
+        return [(pk, round(score, 4)) for pk, score in cursor.fetchall()]
+
+
+def _fallback_hits(user_id, terms, start, end, categories, offset, limit):
+    transactions = filter_transactions(Transaction.objects.filter(transaction_of_id=user_id), start, end, categories)
+    for word, _ in terms:
+        transactions = transactions.filter(Q(name__icontains=word) | Q(remarks__icontains=word))
+    pks = transactions.order_by('-date', '-pk').values_list('pk', flat=True)[offset:offset + limit]
+    return [(pk, None) for pk in pks]
+
+
+def rebuild():
+    """Rebuild the FTS5 index on every shard; False if none of them has FTS5."""
+    rebuilt = False
+    for database in shards.databases():
+        if fts_enabled(database):
+            with connections[database].cursor() as cursor:
+                cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+            rebuilt = True
+    return rebuilt
@@ -0,0 +1,34 @@
+"""
+Row serialization for Transaction listings.
+
+All listing and export paths build their rows from a single ``values()``
+query that joins the category name in, instead of loading model instances
+and following ``transaction.category`` for every row.
+"""
+from .models import Transaction
+
+TRANSACTION_TYPE_LABELS = dict(Transaction.TRANSACTION_TYPES)
+
+TRANSACTION_FIELDS = ('pk', 'name', 'amount', 'currency', 'date', 'transaction_type', 'category__name', 'remarks')
+
+
+def transaction_values(queryset):
+    """Turn a Transaction (or ArchivedTransaction) queryset into one that yields plain row dicts."""
+    return queryset.values(*TRANSACTION_FIELDS)
+
+
+def display_row(row):
+    """Shape a ``transaction_values`` row the way the list page's AJAX endpoint expects it."""
+    return {
+        'name': row['name'],
+        'amount': str(row['amount']),
+        'currency': row['currency'],
+        'date': str(row['date']),
+        'type': TRANSACTION_TYPE_LABELS.get(row['transaction_type'], row['transaction_type']),
+        'category': row['category__name'],
+        'remarks': row['remarks'],
+    }
+
+
+def display_rows(rows):
+    return [display_row(row) for row in rows]
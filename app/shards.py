@@ -0,0 +1,302 @@
+"""
+Spreading users over several databases.
+
+All of a user's own rows live together in one database alias out of
+``settings.SHARDS``: their transactions, categories, balance, and the
+ledger, rollups, versions and forecasts derived from them. Accounts,
+sessions, jobs, exchange rates and the shard map itself stay in
+``default``.
+
+A user is placed the first time they are seen, on the shard picked by a
+hash of their id. The placement is recorded in ShardAssignment, so adding
+a shard later moves nobody by accident; ``manage.py rebalance_shards``
+moves users explicitly (see :func:`move`). Each shard keeps a stub
+``auth_user`` row for every user placed on it, so foreign keys hold there
+too.
+
+Django's routers can't see which user a query filters on, so the shard
+comes from a context. ShardMiddleware enters :func:`for_user` for the
+signed-in user. Jobs, commands and model saves enter it themselves. Writes
+to a model instance go to its owner's shard whatever the context. With a
+single shard, all of this is a no-op and the shard map is never read.
+"""
+import contextlib
+import contextvars
+import time
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+
+from .models import (ArchivedTransaction, Balance, BalanceCheckpoint, BalanceEntry, DataVersion, ForecastState,
+                     RecurringTransaction, ShardAssignment, Tombstone, Transaction, TransactionRollup,
+                     TransactionType)
+
+# Seconds between marking a user as moving and copying their rows, so
+# writes routed before the mark can finish.
+MOVE_GRACE = getattr(settings, 'SHARD_MOVE_GRACE', 2)
+
+# The field holding the owner of each sharded model.
+OWNER_FIELDS = {
+    TransactionType: 'added_by_id',
+    RecurringTransaction: 'recurring_of_id',
+    Transaction: 'transaction_of_id',
+    ArchivedTransaction: 'transaction_of_id',
+    Balance: 'balance_of_id',
+    BalanceEntry: 'balance_of_id',
+    BalanceCheckpoint: 'balance_of_id',
+    TransactionRollup: 'rollup_of_id',
+    DataVersion: 'version_of_id',
+    ForecastState: 'forecast_of_id',
+    Tombstone: 'tombstone_of_id',
+}
+
+# Copied in this order, with the ids they refer to remapped to the copies
+# (of whichever of several models has the id). Forecasts aren't copied;
+# they refit on their next read. Nor are tombstones: the copies get new
+# ids, so syncing clients start over anyway.
+COPIED = (
+    (TransactionType, {}),
+    (RecurringTransaction, {'category_id': TransactionType}),
+    (Transaction, {'category_id': TransactionType, 'recurring_id': RecurringTransaction}),
+    (ArchivedTransaction, {'category_id': TransactionType}),
+    (Balance, {}),
+    (BalanceEntry, {'transaction_pk': (Transaction, ArchivedTransaction)}),
+    (BalanceCheckpoint, {'entry_id': BalanceEntry}),
+    (TransactionRollup, {'category_id': TransactionType}),
+    (DataVersion, {}),
+)
+
+Placement = namedtuple('Placement', 'user_id database moving')
+
+_placement = contextvars.ContextVar('shard_placement', default=None)
+
+
+class ShardMoving(DatabaseError):
+    """A write for a user whose rows are being moved to another shard."""
+
+
+def databases():
+    return list(getattr(settings, 'SHARDS', [DEFAULT_DB_ALIAS]))
+
+
+def enabled():
+    return len(databases()) > 1
+
+
+def hashed(user_id):
+    """The shard a new user is placed on."""
+    shards = databases()
+    return shards[zlib.crc32(str(user_id).encode()) % len(shards)]
+
+
+def _stub_user(user_id, database):
+    if database == DEFAULT_DB_ALIAS or User.objects.using(database).filter(pk=user_id).exists():
+        return
+    username = User.objects.using(DEFAULT_DB_ALIAS).values_list('username', flat=True).get(pk=user_id)
+    User.objects.db_manager(database).create(pk=user_id, username=username, password=make_password(None),
+                                             is_active=False)
+
+
+def placement(user_id):
+    """Where the user's rows are; places new users on their hashed shard."""
+    current = _placement.get()
+    if current is not None and current.user_id == user_id:
+        return current
+    if not enabled():
+        return Placement(user_id, DEFAULT_DB_ALIAS, False)
+    assignments = ShardAssignment.objects.using(DEFAULT_DB_ALIAS).filter(shard_of_id=user_id)
+    row = assignments.values_list('database', 'moving').first()
+    if row is None:
+        database = hashed(user_id)
+        _stub_user(user_id, database)
+        assignment, _ = ShardAssignment.objects.using(DEFAULT_DB_ALIAS).get_or_create(
+            shard_of_id=user_id, defaults={'database': database})
+        row = (assignment.database, assignment.moving)
+    return Placement(user_id, *row)
+
+
+@contextlib.contextmanager
+def use(value):
+    """Route the block's queries on sharded models by a :func:`placement`; None means ``default``."""
+    token = _placement.set(value)
+    try:
+        yield value
+    finally:
+        _placement.reset(token)
+
+
+def for_user(user_id):
+    """Route the block's queries on sharded models to the user's shard."""
+    return use(placement(user_id) if user_id is not None else _placement.get())
+
+
+def for_database(database):
+    """Route the block's queries on sharded models to ``database``."""
+    return use(Placement(None, database, False))
+
+
+def _run(func, database):
+    with for_database(database):
+        return func(database)
+
+
+def _run_in_thread(func, database):
+    try:
+        return _run(func, database)
+    finally:
+        # Each pool thread has its own connections.
+        connections.close_all()
+
+
+def fan_out(func, aliases=None):
+    """
+    Call ``func(database)`` for each shard, in parallel; returns
+    ``{database: result}``.
+    """
+    aliases = list(aliases or databases())
+    if len(aliases) <= 1 or any(connections[alias].in_atomic_block for alias in aliases):
+        # Threads would get connections of their own, which can't see the
+        # open transaction's writes.
+        return {alias: _run(func, alias) for alias in aliases}
+    with ThreadPoolExecutor(max_workers=len(aliases)) as pool:
+        return dict(zip(aliases, pool.map(_run_in_thread, [func] * len(aliases), aliases)))
+
+
+def _owned(model, user_id, database):
+    return model._base_manager.using(database).filter(**{OWNER_FIELDS[model]: user_id})
+
+
+def _remapped(ids, referenced, value):
+    for model in referenced if isinstance(referenced, tuple) else (referenced,):
+        if value in ids[model]:
+            return ids[model][value]
+    return None
+
+
+def _copy(user_id, source, target):
+    from . import archive
+
+    ids = {}
+    copied = 0
+    for model, references in COPIED:
+        objs = list(_owned(model, user_id, source).order_by('pk'))
+        ids[model] = {}
+        old_pks = []
+        for obj in objs:
+            old_pks.append(obj.pk)
+            obj.pk = None
+            obj._state.adding, obj._state.db = True, None
+            for field, referenced in references.items():
+                value = getattr(obj, field)
+                if value is not None:
+                    # Entries can outlive the transaction they were made for.
+                    setattr(obj, field, _remapped(ids, referenced, value))
+        # Ids are allocated per database, so the copies get new ones; this
+        # needs a backend that returns them from bulk inserts.
+        if model is ArchivedTransaction:
+            archive.allocate_ids(objs, target)
+        model._base_manager.using(target).bulk_create(objs, batch_size=500)
+        ids[model] = {old: obj.pk for old, obj in zip(old_pks, objs)}
+        copied += len(objs)
+    return copied
+
+
+def _delete(user_id, database):
+    for model in reversed(OWNER_FIELDS):
+        # No signals: the rows are moving, not being deleted.
+        rows = _owned(model, user_id, database)
+        rows._raw_delete(rows.db)
+
+
+def move(user_id, database, grace=MOVE_GRACE):
+    """
+    Move the user's rows to ``database`` while the site stays up; returns
+    the number of rows copied.
+
+    The user is marked as moving first. Until the move is done their writes
+    raise ShardMoving, which the middleware answers with 503 and jobs
+    retry, and their reads carry on from the old shard. After ``grace``
+    seconds the rows are copied under the old shard's write lock, the map
+    is switched and the originals are deleted. Copies get new ids, so links
+    to individual transactions change. A failed move leaves the user where
+    they were and can simply be run again.
+    """
+    if database not in databases():
+        raise ValueError(f"'{database}' is not one of the configured shards.")
+    source = placement(user_id).database
+    if source == database:
+        return 0
+    _stub_user(user_id, database)
+    assignments = ShardAssignment.objects.using(DEFAULT_DB_ALIAS).filter(shard_of_id=user_id)
+    assignments.update(moving=True)
+    try:
+        time.sleep(grace)
+        with transaction.atomic(using=source):
+            with transaction.atomic(using=database):
+                _delete(user_id, database)
+                copied = _copy(user_id, source, database)
+            assignments.update(database=database, moving=False)
+            _delete(user_id, source)
+    except BaseException:
+        assignments.update(moving=False)
+        raise
+
+    from . import changes
+
+    # Cached responses and syncing clients hold the old ids.
+    with for_user(user_id):
+        changes.reset(user_id)
+    return copied
+
+
+def rebalance(grace=MOVE_GRACE):
+    """Move every user not on their hashed shard there; returns ``{user_id: rows copied}``."""
+    moved = {}
+    assignments = ShardAssignment.objects.using(DEFAULT_DB_ALIAS).order_by('pk').values_list('shard_of', 'database')
+    for user_id, database in assignments.iterator():
+        if database != hashed(user_id):
+            moved[user_id] = move(user_id, hashed(user_id), grace=grace)
+    return moved
+
+
+def forget(user_id):
+    """Remove a deleted user's stub, and with it their rows, from their shard."""
+    if not enabled():
+        return
+    row = ShardAssignment.objects.using(DEFAULT_DB_ALIAS).filter(shard_of_id=user_id).values_list('database').first()
+    if row is not None and row[0] != DEFAULT_DB_ALIAS:
+        User.objects.using(row[0]).filter(pk=user_id).delete()
+
+
+class ShardRouter:
+    """Send queries on the sharded models to the shard of their owner or of the current context."""
+
+    def _placement(self, model, hints):
+        if model not in OWNER_FIELDS:
+            return None
+        instance = hints.get('instance')
+        if type(instance) in OWNER_FIELDS:
+            owner = getattr(instance, OWNER_FIELDS[type(instance)])
+            if owner is not None:
+                return placement(owner)
+        return _placement.get()
+
+    def db_for_read(self, model, **hints):
+        current = self._placement(model, hints)
+        # The read replica only covers the default shard.
+        if current is None or current.database == DEFAULT_DB_ALIAS:
+            return None
+        return current.database
+
+    def db_for_write(self, model, **hints):
+        current = self._placement(model, hints)
+        if current is None:
+            return None
+        if current.moving:
+            raise ShardMoving(f'User {current.user_id} is being moved to another shard; try again shortly.')
+        return current.database
@@ -0,0 +1,84 @@
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import caching, changes, forecast, ledger, rollups, search, shards
+from .models import ArchivedTransaction, Balance, Transaction, TransactionType
+
+
+def _owner_deleted(origin):
+    """Whether this delete is a cascade from removing the user account itself."""
+    if isinstance(origin, QuerySet):
+        return origin.model is User
+    return isinstance(origin, User)
+
+
+# Archived transactions still count; they're only deleted with their category.
+@receiver(post_delete, sender=Transaction)
+@receiver(post_delete, sender=ArchivedTransaction)
+def remove_from_rollups(sender, instance, origin=None, **kwargs):
+    # The owner's rollups are removed by the same cascade.
+    if _owner_deleted(origin):
+        return
+    with shards.for_user(instance.transaction_of_id):
+        rollups.apply([rollups.snapshot(instance)], sign=-1)
+        forecast.apply([rollups.snapshot(instance)], sign=-1)
+
+
+@receiver(post_delete, sender=Transaction)
+@receiver(post_delete, sender=ArchivedTransaction)
+def revert_balance(sender, instance, origin=None, **kwargs):
+    if _owner_deleted(origin):
+        return
+    with shards.for_user(instance.transaction_of_id):
+        for user_id, delta in ledger.postings(instance, None):
+            # Deleting an income the balance can't give back raises
+            # ValidationError, which undoes the delete.
+            ledger.post(user_id, delta, transaction_pk=instance.pk, require_funds=True)
+
+
+@receiver(post_delete, sender=Transaction)
+@receiver(post_delete, sender=ArchivedTransaction)
+@receiver(post_delete, sender=TransactionType)
+def leave_tombstone(sender, instance, origin=None, **kwargs):
+    # Syncing clients of a deleted account have nothing left to sync.
+    if _owner_deleted(origin):
+        return
+    kind = 'category' if sender is TransactionType else 'transaction'
+    changes.record_deletions(_owner_id(instance), kind, [instance.pk])
+
+
+@receiver(pre_delete, sender=User)
+def remove_from_shard(sender, instance, using, **kwargs):
+    # The cascade only reaches the user's rows in the database the account
+    # is deleted from; their shard is cleared through its stub account.
+    if using == DEFAULT_DB_ALIAS:
+        shards.forget(instance.pk)
+
+
+def _owner_id(instance):
+    if isinstance(instance, (Transaction, ArchivedTransaction)):
+        return instance.transaction_of_id
+    if isinstance(instance, TransactionType):
+        return instance.added_by_id
+    return instance.balance_of_id
+
+
+# Transactions and categories move their owner on when they are stamped,
+# in save() and by leave_tombstone, so only balance rows are handled here.
+@receiver(post_save, sender=Balance)
+@receiver(post_delete, sender=Balance)
+def bump_data_version(sender, instance, origin=None, **kwargs):
+    # Nothing is left to cache once the owner themselves is gone.
+    if _owner_deleted(origin):
+        return
+    caching.bump_version(_owner_id(instance))
+
+
+# Migrations that rebuild app_transaction on SQLite drop the search index's triggers.
+@receiver(post_migrate)
+def restore_search_triggers(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    if sender.name == 'app':
+        search.restore_triggers(using)
@@ -0,0 +1,100 @@
+import datetime
+from unittest import mock
+
+from django.contrib.admin import helpers
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.urls import reverse
+from decimal import Decimal
+
+from .models import Balance, BalanceEntry, Transaction, TransactionRollup, TransactionType
+from . import archive, pagination
+
+
+class TransactionAdminTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser(username='adminuser', password='password123')
+        self.food = TransactionType.objects.create(name='Food', added_by=self.user)
+        self.travel = TransactionType.objects.create(name='Travel', added_by=self.user)
+        Balance.objects.create(balance_of=self.user, balance=Decimal('100.00'))
+        self.lunch = Transaction.objects.create(name='Lunch', amount=Decimal('10.00'), transaction_type='expense',
+                                                transaction_of=self.user, category=self.food, date='2024-01-05')
+        self.dinner = Transaction.objects.create(name='Dinner', amount=Decimal('20.00'), transaction_type='expense',
+                                                 transaction_of=self.user, category=self.food, date='2024-02-05')
+        self.salary = Transaction.objects.create(name='Salary', amount=Decimal('50.00'), transaction_type='income',
+                                                 transaction_of=self.user, category=self.travel, date='2024-02-01')
+        self.client.login(username='adminuser', password='password123')
+        self.url = reverse('admin:app_transaction_changelist')
+
+    def test_changelist_counts_from_the_rollups(self):
+        """Filters the rollups can answer are counted from them, without a COUNT over the transactions."""
+        response = self.client.get(self.url, {'date__year': '2024', 'date__month': '2', 'category': self.food.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 1)
+        self.assertEqual(response.context['cl'].paginator.known_count, 1)
+        response = self.client.get(self.url, {'transaction_type__exact': 'expense'})
+        self.assertEqual(response.context['cl'].result_count, 2)
+
+    def test_changelist_counts_only_hot_rows_once_archived(self):
+        """Archived rows still count in the rollups, so the changelist counts what it lists instead."""
+        list(archive.archive(datetime.date(2024, 2, 1)))
+        response = self.client.get(self.url)
+        self.assertEqual((response.context['cl'].result_count, len(response.context['cl'].result_list)), (2, 2))
+        response = self.client.get(self.url, {'date__year': '2024', 'date__month': '1'})
+        self.assertEqual(response.context['cl'].result_count, 0)
+
+    def test_recategorize(self):
+        """The action moves the rows with one update and keeps the rollups in step."""
+        data = {'action': 'recategorize', helpers.ACTION_CHECKBOX_NAME: [self.lunch.pk, self.dinner.pk]}
+        response = self.client.post(self.url, data)
+        self.assertContains(response, 'Move transactions')
+        response = self.client.post(self.url, {**data, 'apply': '1', 'category': self.travel.pk})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Transaction.objects.filter(category=self.travel).count(), 3)
+        self.assertFalse(TransactionRollup.objects.filter(category=self.food).exists())
+        self.assertEqual(TransactionRollup.objects.get(category=self.travel, granularity='year',
+                                                       transaction_type='expense').total, Decimal('30.00'))
+
+    def test_bulk_delete_adjusts_the_balance(self):
+        """Deleting selected rows reverts their effect with one ledger entry per owner."""
+        entries = BalanceEntry.objects.count()
+        response = self.client.post(self.url, {
+            'action': 'delete_selected', 'post': 'yes',
+            helpers.ACTION_CHECKBOX_NAME: [self.lunch.pk, self.salary.pk],
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(list(Transaction.objects.values_list('name', flat=True)), ['Dinner'])
+        self.assertEqual(Balance.objects.get(balance_of=self.user).balance, Decimal('80.00'))
+        self.assertEqual(BalanceEntry.objects.count(), entries + 1)
+        self.assertEqual(TransactionRollup.objects.get(granularity='year').count, 1)
+
+    def test_bulk_delete_that_would_overdraw_is_refused(self):
+        """Deleting an income the balance has already spent deletes nothing and reports why."""
+        Transaction.objects.create(name='Rent', amount=Decimal('100.00'), transaction_type='expense',
+                                   transaction_of=self.user, category=self.food, date='2024-02-10')
+        response = self.client.post(self.url, {
+            'action': 'delete_selected', 'post': 'yes',
+            helpers.ACTION_CHECKBOX_NAME: [self.lunch.pk, self.salary.pk],
+        }, follow=True)
+        self.assertContains(response, 'Insufficient balance')
+        self.assertEqual(Transaction.objects.count(), 4)
+        self.assertEqual(Balance.objects.get(balance_of=self.user).balance, Decimal('20.00'))
+
+        response = self.client.post(reverse('admin:app_transaction_delete', args=[self.salary.pk]), {'post': 'yes'},
+                                    follow=True)
+        self.assertContains(response, 'Insufficient balance')
+        self.assertTrue(Transaction.objects.filter(pk=self.salary.pk).exists())
+
+    def test_estimated_count(self):
+        """Past the exact-count limit the paginator stops counting."""
+        with mock.patch.object(pagination, 'EXACT_COUNT_LIMIT', 2):
+            paginator = pagination.EstimatedCountPaginator(Transaction.objects.all(), 1)
+            self.assertEqual(paginator.count, 3)
+            paginator = pagination.EstimatedCountPaginator(Transaction.objects.filter(category=self.travel), 1)
+            self.assertEqual(paginator.count, 1)
+
+    def test_shard_filter_counts_are_bounded(self):
+        """The shard filter counts each shard's transactions only up to the exact-count limit."""
+        with mock.patch.object(pagination, 'EXACT_COUNT_LIMIT', 2):
+            response = self.client.get(reverse('admin:app_shardassignment_changelist'))
+        self.assertContains(response, 'default (over 2 transactions)')
@@ -0,0 +1,78 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.urls import reverse
+from decimal import Decimal
+
+from .models import Transaction, TransactionType
+from . import analytics
+
+
+class AnalyticsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='analyticsuser', password='password123')
+        self.food = TransactionType.objects.create(name='Food', added_by=self.user)
+        self.rent = TransactionType.objects.create(name='Rent', added_by=self.user)
+        for name, amount, date, trans_type, category in [
+            ('Pay', '1000.00', '2024-01-01', 'income', self.rent),
+            ('Lunch', '10.00', '2024-01-02', 'expense', self.food),
+            ('Rent', '500.00', '2024-01-03', 'expense', self.rent),
+            ('Pay', '1000.00', '2024-03-01', 'income', self.rent),
+            ('Dinner', '30.00', '2024-03-02', 'expense', self.food),
+            ('Rent', '500.00', '2024-03-03', 'expense', self.rent),
+        ]:
+            Transaction.objects.create(name=name, amount=Decimal(amount), date=date, transaction_type=trans_type,
+                                       transaction_of=self.user, category=category)
+        self.client.login(username='analyticsuser', password='password123')
+
+    def test_columns_are_cached_until_a_write(self):
+        """Columns load in one query, are reused, and reload after the user's data changes."""
+        cols = analytics.columns(self.user.pk)
+        self.assertEqual(len(cols), 6)
+        self.assertEqual(cols.cents.tolist(), [100000, 1000, 50000, 100000, 3000, 50000])
+        # Only the data version, which a per-process cache doesn't keep.
+        with self.assertNumQueries(1):
+            self.assertIs(analytics.columns(self.user.pk), cols)
+        Transaction.objects.create(name='Snack', amount=Decimal('1.00'), date='2024-03-04',
+                                   transaction_type='expense', transaction_of=self.user, category=self.food)
+        self.assertEqual(len(analytics.columns(self.user.pk)), 7)
+
+    def test_monthly_fills_gaps_and_computes_rates(self):
+        """Every month in range is listed, with expense changes and savings rates."""
+        data = analytics.monthly(analytics.columns(self.user.pk))
+        self.assertEqual(data['months'], ['2024-01', '2024-02', '2024-03'])
+        self.assertEqual(data['expense'], [510.0, 0.0, 530.0])
+        self.assertEqual(data['net'], [490.0, 0.0, 470.0])
+        self.assertEqual(data['expense_change'], [None, -510.0, 530.0])
+        self.assertEqual(data['expense_change_pct'], [None, -100.0, None])
+        self.assertEqual(data['savings_rate'], [49.0, None, 47.0])
+
+    def test_rolling_average(self):
+        """The trailing average covers at most ``window`` days, fewer at the start."""
+        data = analytics.rolling(analytics.columns(self.user.pk), window=2)
+        self.assertEqual(data['dates'][:3], ['2024-01-02', '2024-01-03', '2024-01-04'])
+        self.assertEqual(data['daily'][:3], [10.0, 500.0, 0.0])
+        self.assertEqual(data['average'][:3], [10.0, 255.0, 250.0])
+        self.assertEqual(data['dates'][-1], '2024-03-03')
+
+    def test_spending_percentiles_and_volatility(self):
+        """Expense percentiles and per-category monthly mean, deviation and volatility."""
+        data = analytics.spending(analytics.columns(self.user.pk))
+        self.assertEqual(data['percentiles']['p50'], 265.0)
+        rent, food = data['categories']
+        self.assertEqual((rent['category'], rent['months'], rent['mean_monthly']), ('Rent', 3, 333.33))
+        self.assertEqual(food['mean_monthly'], 13.33)
+        self.assertAlmostEqual(rent['volatility'], 0.7071, places=4)
+
+    def test_endpoints(self):
+        """The analytics endpoints return JSON for the signed-in user and validate the window."""
+        for name in ('analytics_monthly', 'analytics_rolling', 'analytics_spending'):
+            response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, 200, name)
+            self.assertIn('ETag', response, name)
+        self.assertEqual(self.client.get(reverse('analytics_rolling'), {'window': 7}).json()['window'], 7)
+        self.assertEqual(self.client.get(reverse('analytics_rolling'), {'window': 0}).status_code, 400)
+
+        User.objects.create_user(username='analyticsother', password='password123')
+        self.client.login(username='analyticsother', password='password123')
+        self.assertEqual(self.client.get(reverse('analytics_monthly')).json()['months'], [])
+        self.assertEqual(self.client.get(reverse('analytics_spending')).json()['categories'], [])
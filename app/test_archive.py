@@ -0,0 +1,80 @@
+import datetime
+import json
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.urls import reverse
+from decimal import Decimal
+
+from .models import ArchivedTransaction, Balance, Transaction, TransactionRollup, TransactionType
+from . import archive, rollups
+
+
+class ArchiveTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='archiveuser', password='password123')
+        self.food = TransactionType.objects.create(name='Food', added_by=self.user)
+        self.client.login(username='archiveuser', password='password123')
+        Transaction.objects.create(name='Salary', amount=Decimal('500.00'), transaction_type='income',
+                                   transaction_of=self.user, category=self.food, date='2020-01-01')
+        for day in range(1, 6):
+            Transaction.objects.create(name=f'Old lunch {day}', amount=Decimal('10.00'), transaction_type='expense',
+                                       transaction_of=self.user, category=self.food, date=f'2020-03-0{day}')
+        for day in range(1, 4):
+            Transaction.objects.create(name=f'Lunch {day}', amount=Decimal('20.00'), transaction_type='expense',
+                                       transaction_of=self.user, category=self.food, date=f'2024-03-0{day}')
+
+    def test_archives_in_resumable_batches(self):
+        """Old rows move a batch at a time; rollups and balance are left alone and a rerun finishes the job."""
+        buckets = list(TransactionRollup.objects.order_by('pk').values_list('total', 'count'))
+        batches = archive.archive(datetime.date(2021, 1, 1), batch_size=2)
+        self.assertEqual(next(batches), (self.user.pk, 2))
+        batches.close()
+        self.assertEqual(ArchivedTransaction.objects.count(), 2)
+
+        out = StringIO()
+        call_command('archive_transactions', '--before', '2021-01-01', '--batch-size', '2', stdout=out)
+        self.assertIn('Archived 4 transactions', out.getvalue())
+        self.assertEqual(Transaction.objects.count(), 3)
+        self.assertEqual(ArchivedTransaction.objects.count(), 6)
+        self.assertEqual(list(TransactionRollup.objects.order_by('pk').values_list('total', 'count')), buckets)
+        self.assertEqual(Balance.objects.get(balance_of=self.user).balance, Decimal('390.00'))
+
+        # Rebuilt buckets still count the archived rows.
+        rollups.rebuild(users=[self.user.pk])
+        self.assertEqual(rollups.transaction_count(self.user, transaction_type='expense'), 8)
+
+    def test_listing_spans_hot_and_archived_rows(self):
+        """Cursor pages and streams run on into the archive in date order."""
+        call_command('archive_transactions', '--before', '2021-01-01', stdout=StringIO())
+        names, cursor = [], ''
+        while cursor is not None:
+            data = self.client.get(reverse('transaction_list'), {'limit': 4, 'cursor': cursor}).json()
+            names += [row['name'] for row in data['transactions']]
+            cursor = data['next_cursor']
+        expected = ['Lunch 3', 'Lunch 2', 'Lunch 1'] + [f'Old lunch {day}' for day in range(5, 0, -1)] + ['Salary']
+        self.assertEqual(names, expected)
+
+        response = self.client.get(reverse('transaction_list'), {'stream': '1'})
+        rows = json.loads(b''.join(response.streaming_content))['transactions']
+        self.assertEqual([row['name'] for row in rows], expected)
+
+    def test_archive_is_read_only_when_in_range(self):
+        """A recent page never touches the archive, and exports and breakdowns include it by range."""
+        call_command('archive_transactions', '--before', '2021-01-01', stdout=StringIO())
+        self.assertFalse(archive.needed(self.user, start=datetime.date(2024, 1, 1)))
+        with self.assertNumQueries(2):
+            rows, next_cursor = archive.keyset_page(self.user, limit=2)
+        self.assertEqual([row['name'] for row in rows], ['Lunch 3', 'Lunch 2'])
+
+        response = self.client.get(reverse('transaction_export', args=['ndjson']), {'start': '2020-03-04'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['name'] for line in lines],
+                         ['Old lunch 4', 'Old lunch 5', 'Lunch 1', 'Lunch 2', 'Lunch 3'])
+
+        data = self.client.get(reverse('category_wise_expenses')).json()['data']
+        self.assertEqual((data[0]['total'], data[0]['count']), ('110.00', 8))
+        data = self.client.get(reverse('category_wise_expenses'), {'start': '2024-01-01'}).json()['data']
+        self.assertEqual((data[0]['total'], data[0]['count']), ('60.00', 3))
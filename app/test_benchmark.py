@@ -0,0 +1,45 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.management import call_command
+import io
+import json
+import os
+import tempfile
+
+from . import benchmark, ledger, rollups
+from .models import Balance, Transaction, TransactionRollup, TransactionType
+
+
+class BenchmarkTestCase(TestCase):
+    def test_seed_keeps_balances_and_rollups_consistent(self):
+        """Test seeded data has matching balances and rollups, and clear removes it."""
+        users = benchmark.seed(users=2, transactions=300, categories=5)
+        self.assertEqual(len(users), 2)
+        for user in users:
+            self.assertEqual(Transaction.objects.filter(transaction_of=user).count(), 300)
+            self.assertEqual(TransactionType.objects.filter(added_by=user).count(), 5)
+            balance = Balance.objects.get(balance_of=user).balance
+            self.assertEqual(balance, ledger.ledger_balance(user.pk))
+            total = sum(Transaction.objects.filter(transaction_of=user).values_list('amount', flat=True))
+            self.assertEqual(rollups.grand_total(user), total)
+
+        self.assertEqual(benchmark.clear(), 2)
+        self.assertFalse(User.objects.filter(username__startswith=benchmark.USERNAME_PREFIX).exists())
+        self.assertFalse(TransactionRollup.objects.exists())
+
+    def test_run_benchmark_writes_report(self):
+        """Test the runner times every endpoint at each size and writes a JSON report."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'report.json')
+            call_command('run_benchmark', sizes='20,40', requests=2, output=path, stderr=io.StringIO())
+            with open(path) as report_file:
+                report = json.load(report_file)
+
+        self.assertEqual([run['transactions_per_user'] for run in report['runs']], [20, 40])
+        endpoints = report['runs'][0]['endpoints']
+        self.assertNotIn('transaction_delete', endpoints)
+        for label in ('transaction_summary', 'balance', 'transaction_export[csv]', 'transaction_list[stream]'):
+            self.assertEqual(endpoints[label]['status'], 200, label)
+            self.assertLessEqual(endpoints[label]['p50_ms'], endpoints[label]['p99_ms'])
+            self.assertGreater(endpoints[label]['bytes'], 0)
+        self.assertFalse(User.objects.filter(username__startswith=benchmark.USERNAME_PREFIX).exists())
@@ -0,0 +1,96 @@
+import io
+
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.urls import reverse
+from decimal import Decimal
+
+from .models import DataVersion, Tombstone, Transaction, TransactionType
+from . import bulk, changes, importers
+from .test_importers import CSV_STATEMENT
+
+
+class ChangesTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='syncuser', password='password123')
+        self.food = TransactionType.objects.create(name='Food', added_by=self.user)
+        self.client.login(username='syncuser', password='password123')
+        self.salary = Transaction.objects.create(name='Salary', amount=Decimal('100.00'), transaction_type='income',
+                                                 transaction_of=self.user, category=self.food)
+
+    def get_changes(self, since):
+        return self.client.get(reverse('transaction_changes'), {'since': since}).json()
+
+    def test_only_later_writes_are_sent(self):
+        """A sync from the last version returns just the rows written since, in version order."""
+        full = self.get_changes(0)
+        self.assertEqual(([row['name'] for row in full['transactions']], full['reset']), (['Salary'], False))
+        self.assertEqual([row['name'] for row in full['categories']], ['Food'])
+        self.assertEqual(self.get_changes(full['version'])['transactions'], [])
+
+        travel = TransactionType.objects.create(name='Travel', added_by=self.user)
+        lunch = Transaction.objects.create(name='Lunch', amount=Decimal('5.00'), transaction_type='expense',
+                                           transaction_of=self.user, category=self.food)
+        self.salary.name = 'Pay'
+        self.salary.save()
+        delta = self.get_changes(full['version'])
+        self.assertEqual([row['name'] for row in delta['transactions']], ['Lunch', 'Pay'])
+        self.assertEqual([row['pk'] for row in delta['categories']], [travel.pk])
+        self.assertEqual(delta['transactions'][0]['category'], self.food.pk)
+        self.assertLess(lunch.change_version, self.salary.change_version)
+        self.assertEqual(delta['deleted'], {'transactions': [], 'categories': []})
+
+    def test_each_write_bumps_the_version_once(self):
+        """Saving or deleting a transaction or category moves the owner on by exactly one version."""
+        def version():
+            return DataVersion.objects.get(version_of=self.user).version
+
+        before = version()
+        lunch = Transaction.objects.create(name='Lunch', amount=Decimal('5.00'), transaction_type='expense',
+                                           transaction_of=self.user, category=self.food)
+        self.assertEqual(version(), before + 1)
+        lunch.amount = Decimal('7.00')
+        lunch.save()
+        self.assertEqual(version(), before + 2)
+        lunch.delete()
+        self.assertEqual(version(), before + 3)
+        TransactionType.objects.create(name='Travel', added_by=self.user).delete()
+        self.assertEqual(version(), before + 5)
+
+    def test_deletions_leave_tombstones(self):
+        """Deleted transactions and categories are reported by id; a full sync leaves them out."""
+        version = self.get_changes(0)['version']
+        salary_pk = self.salary.pk
+        response = self.client.delete(reverse('transaction_delete', args=[salary_pk]))
+        self.assertTrue(response.json()['success'])
+        self.assertEqual(self.get_changes(version)['deleted']['transactions'], [salary_pk])
+
+        lunch = Transaction.objects.create(name='Lunch', amount=Decimal('0.00'), transaction_type='expense',
+                                           transaction_of=self.user, category=self.food)
+        food_pk = self.food.pk
+        self.food.delete()
+        delta = self.get_changes(version)
+        self.assertEqual(delta['deleted'], {'transactions': [salary_pk, lunch.pk], 'categories': [food_pk]})
+        self.assertEqual(delta['transactions'], [])
+        self.assertEqual(self.get_changes(0)['deleted'], {'transactions': [], 'categories': []})
+
+        self.user.delete()
+        self.assertFalse(Tombstone.objects.exists())
+
+    def test_bulk_writes_are_stamped(self):
+        """Imports and bulk recategorizing are synced like single saves; bad versions are refused or reset."""
+        version = self.get_changes(0)['version']
+        importers.import_file(self.user, io.StringIO(CSV_STATEMENT, newline=''), 'csv')
+        self.assertEqual(len(self.get_changes(version)['transactions']), 3)
+
+        version = self.get_changes(0)['version']
+        travel = TransactionType.objects.create(name='Travel', added_by=self.user)
+        bulk.recategorize(Transaction.objects.filter(pk=self.salary.pk), travel)
+        delta = self.get_changes(version)
+        self.assertEqual([(row['name'], row['category']) for row in delta['transactions']], [('Salary', travel.pk)])
+
+        self.assertTrue(self.get_changes(delta['version'] + 100)['reset'])
+        changes.reset(self.user.pk)
+        self.assertTrue(self.get_changes(delta['version'])['reset'])
+        response = self.client.get(reverse('transaction_changes'), {'since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
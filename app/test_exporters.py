@@ -0,0 +1,61 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.urls import reverse
+from decimal import Decimal
+import csv
+import io
+import json
+
+from .models import Transaction, TransactionType
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='exportuser', password='password123')
+        self.salary = TransactionType.objects.create(name='Salary', added_by=self.user)
+        self.food = TransactionType.objects.create(name='Food', added_by=self.user)
+        for name, amount, date, trans_type, category in [
+            ('Pay', '1000.00', '2023-01-01', 'income', self.salary),
+            ('Lunch', '12.00', '2023-01-15', 'expense', self.food),
+            ('Dinner', '30.00', '2023-02-10', 'expense', self.food),
+        ]:
+            Transaction.objects.create(name=name, amount=Decimal(amount), date=date, transaction_type=trans_type,
+                                       transaction_of=self.user, category=category)
+        other = User.objects.create_user(username='exportother', password='password123')
+        other_category = TransactionType.objects.create(name='Other', added_by=other)
+        Transaction.objects.create(name='Not mine', amount=Decimal('5.00'), transaction_type='income',
+                                   transaction_of=other, category=other_category)
+        self.client.login(username='exportuser', password='password123')
+
+    def test_csv_export_streams_own_rows_oldest_first(self):
+        """Test the CSV export streams only the user's rows, oldest first."""
+        response = self.client.get(reverse('transaction_export', args=['csv']))
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([row['name'] for row in rows], ['Pay', 'Lunch', 'Dinner'])
+        self.assertEqual(rows[1]['category'], 'Food')
+        self.assertEqual(rows[1]['type'], 'expense')
+
+    def test_ndjson_export_filters(self):
+        """Test the NDJSON export honours the date and category filters."""
+        response = self.client.get(reverse('transaction_export', args=['ndjson']),
+                                   {'start': '2023-01-10', 'category': self.food.pk})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['name'] for line in lines], ['Lunch', 'Dinner'])
+
+    def test_export_rejects_bad_filters(self):
+        """Test malformed filters and unknown formats are rejected."""
+        response = self.client.get(reverse('transaction_export', args=['csv']), {'start': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(reverse('transaction_export', args=['xml']))
+        self.assertEqual(response.status_code, 404)
+
+    def test_export_command_dumps_all_users(self):
+        """Test the management command dumps every user's rows with an owner column."""
+        out = io.StringIO()
+        call_command('export_transactions', '--format', 'csv', stdout=out)
+        rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual({row['user'] for row in rows}, {'exportuser', 'exportother'})
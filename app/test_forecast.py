@@ -0,0 +1,88 @@
+import datetime
+
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.urls import reverse
+from decimal import Decimal
+
+from .models import Balance, ForecastState, Transaction, TransactionType
+from . import forecast
+
+TODAY = datetime.date(2024, 4, 15)
+
+
+class ForecastTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='forecastuser', password='password123')
+        self.food = TransactionType.objects.create(name='Food', added_by=self.user)
+        Balance.objects.create(balance_of=self.user, balance=Decimal('1100.00'))
+        for name, amount, date, trans_type in [
+            ('Pay', '1000.00', '2024-01-01', 'income'),
+            ('Groceries', '600.00', '2024-01-05', 'expense'),
+            ('Pay', '1000.00', '2024-02-01', 'income'),
+            ('Groceries', '800.00', '2024-02-05', 'expense'),
+            ('Groceries', '1500.00', '2024-03-05', 'expense'),
+            ('Groceries', '100.00', '2024-04-02', 'expense'),
+        ]:
+            self.add(name, amount, date, trans_type)
+        self.client.login(username='forecastuser', password='password123')
+
+    def add(self, name, amount, date, trans_type):
+        return Transaction.objects.create(name=name, amount=Decimal(amount), date=date, transaction_type=trans_type,
+                                          transaction_of=self.user, category=self.food)
+
+    def levels(self):
+        state = forecast.current_state(self.user.pk, TODAY)
+        return state.level_income.quantize(Decimal('0.0001')), state.level_expense.quantize(Decimal('0.0001'))
+
+    def refit(self):
+        ForecastState.objects.filter(forecast_of=self.user).delete()
+        return self.levels()
+
+    def test_fit_smooths_completed_months(self):
+        """Levels are exponentially smoothed over January to March, ignoring the open month."""
+        # income: 1000, 1000, 0; expense: 600, 800, 1500 with alpha 0.3
+        self.assertEqual(self.levels(), (Decimal('700.0000'), Decimal('912.0000')))
+
+    def test_incremental_updates_match_a_refit(self):
+        """Edits and deletes in folded months adjust the state to what a full refit gives."""
+        self.levels()
+        groceries = Transaction.objects.get(date='2024-02-05')
+        groceries.amount = Decimal('300.00')
+        groceries.save()
+        self.add('Bonus', '200.00', '2024-01-20', 'income')
+        Transaction.objects.get(date='2024-03-05').delete()
+        incremental = self.levels()
+        self.assertEqual(incremental, self.refit())
+
+    def test_open_month_and_new_months_are_folded_on_read(self):
+        """Writes to the open month wait until it completes, then count like any other month."""
+        self.levels()
+        self.add('Pay', '1000.00', '2024-04-01', 'income')
+        self.assertEqual(ForecastState.objects.get(forecast_of=self.user).last_month, forecast.month_number(
+            datetime.date(2024, 3, 1)))
+        may = datetime.date(2024, 5, 1)
+        state = forecast.current_state(self.user.pk, may)
+        self.assertEqual(state.last_month, forecast.month_number(datetime.date(2024, 4, 1)))
+        incremental = (state.level_income, state.level_expense)
+        ForecastState.objects.filter(forecast_of=self.user).delete()
+        state = forecast.current_state(self.user.pk, may)
+        self.assertEqual(incremental, (state.level_income, state.level_expense))
+
+    def test_projection_and_runs_out(self):
+        """The balance moves by the smoothed net each month and the first negative month is reported."""
+        data = forecast.project(self.user.pk, months=3, today=TODAY)
+        self.assertEqual(data['balance'], Decimal('100.00'))
+        self.assertEqual(data['monthly_net'], Decimal('-212.00'))
+        # April still expects 700 of income and 812 more spending.
+        self.assertEqual([point['balance'] for point in data['months']],
+                         [Decimal('-12.00'), Decimal('-224.00'), Decimal('-436.00')])
+        self.assertEqual(data['runs_out'], '2024-04')
+
+    def test_forecast_endpoint(self):
+        """The endpoint returns the projection and validates ``months``."""
+        response = self.client.get(reverse('balance_forecast'), {'months': 6})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['months']), 6)
+        response = self.client.get(reverse('balance_forecast'), {'months': forecast.MAX_MONTHS + 1})
+        self.assertEqual(response.status_code, 400)
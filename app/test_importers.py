@@ -0,0 +1,110 @@
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+from decimal import Decimal
+import io
+
+from .models import Transaction, TransactionType, Balance, BalanceEntry, ExchangeRate, TransactionRollup
+from . import importers
+
+CSV_STATEMENT = """Date,Description,Amount,Category,Memo
+2023-01-01,Salary,1000.00,Salary,January
+2023-01-03,Groceries,-120.50,Food,
+2023-01-04,Coffee,-3.50,food,
+not-a-date,Broken,-1.00,Food,
+"""
+
+OFX_STATEMENT = """OFXHEADER:100
+DATA:OFXSGML
+
+<OFX><BANKMSGSRSV1><STMTTRNRS><STMTRS><BANKTRANLIST>
+<STMTTRN><TRNTYPE>CREDIT<DTPOSTED>20230105120000<TRNAMT>250.00<NAME>Refund<MEMO>Store refund</STMTTRN>
+<STMTTRN><TRNTYPE>DEBIT<DTPOSTED>20230106<TRNAMT>-50.00<NAME>Taxi</STMTTRN>
+</BANKTRANLIST></STMTRS></STMTTRNRS></BANKMSGSRSV1></OFX>
+"""
+
+
+class ImportTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='importuser', password='password123')
+        self.food = TransactionType.objects.create(name='Food', added_by=self.user)
+
+    def test_csv_import(self):
+        """Valid rows are inserted, invalid rows reported, and categories resolved case-insensitively."""
+        result = importers.import_file(self.user, io.StringIO(CSV_STATEMENT), 'csv', batch_size=2)
+
+        self.assertEqual(result['created'], 3)
+        self.assertEqual([error['line'] for error in result['errors']], [5])
+        self.assertIn('date', result['errors'][0]['errors'])
+        self.assertEqual(Transaction.objects.filter(transaction_of=self.user, category=self.food).count(), 2)
+        self.assertTrue(TransactionType.objects.filter(added_by=self.user, name='Salary').exists())
+        groceries = Transaction.objects.get(name='Groceries')
+        self.assertEqual((groceries.transaction_type, groceries.amount), ('expense', Decimal('120.50')))
+
+    def test_import_applies_one_balance_change_per_batch(self):
+        """Each batch moves the balance once, and the rollups see every row."""
+        importers.import_file(self.user, io.StringIO(CSV_STATEMENT), 'csv', batch_size=2)
+
+        self.assertEqual(Balance.objects.get(balance_of=self.user).balance, Decimal('876.00'))
+        deltas = list(BalanceEntry.objects.filter(balance_of=self.user).order_by('pk').values_list('delta', flat=True))
+        self.assertEqual(deltas, [Decimal('879.50'), Decimal('-3.50')])
+        food = TransactionRollup.objects.get(rollup_of=self.user, granularity='year', category=self.food)
+        self.assertEqual((food.total, food.count), (Decimal('124.00'), 2))
+
+    def test_import_converts_currencies(self):
+        """Rows in another currency are converted with the loaded rates; unknown currencies are reported."""
+        ExchangeRate.objects.create(currency='EUR', date='2023-01-01', rate=Decimal('2.00'))
+        statement = ("Date,Description,Amount,Currency\n"
+                     "2023-01-02,Pay,100.00,eur\n"
+                     "2023-01-02,Pay,100.00,\n"
+                     "2023-01-02,Pay,100.00,GBP\n")
+        result = importers.import_file(self.user, io.StringIO(statement), 'csv')
+        self.assertEqual(result['created'], 2)
+        self.assertEqual([error['line'] for error in result['errors']], [4])
+        self.assertIn('currency', result['errors'][0]['errors'])
+        self.assertEqual(sorted(Transaction.objects.values_list('currency', 'base_amount')),
+                         [('EUR', Decimal('200.00')), ('USD', Decimal('100.00'))])
+        self.assertEqual(Balance.objects.get(balance_of=self.user).balance, Decimal('300.00'))
+
+    def test_batch_that_overdraws_is_rejected(self):
+        """A batch whose net amount the balance can't cover is skipped as a whole."""
+        statement = "Date,Description,Amount\n2023-01-01,Rent,-500.00\n"
+        result = importers.import_file(self.user, io.StringIO(statement), 'csv')
+        self.assertEqual(result['created'], 0)
+        self.assertEqual(len(result['errors']), 1)
+        self.assertFalse(Transaction.objects.filter(transaction_of=self.user).exists())
+
+    def test_ofx_import_view(self):
+        """The import endpoint parses OFX uploads, signs deciding the type."""
+        self.client.login(username='importuser', password='password123')
+        upload = SimpleUploadedFile('statement.ofx', OFX_STATEMENT.encode())
+        response = self.client.post(reverse('transaction_import'), {'file': upload})
+
+        self.assertEqual(response.json(), {'success': True, 'created': 2, 'errors': []})
+        refund = Transaction.objects.get(name='Refund')
+        self.assertEqual((refund.transaction_type, str(refund.date), refund.remarks),
+                         ('income', '2023-01-05', 'Store refund'))
+        self.assertEqual(Transaction.objects.get(name='Taxi').transaction_type, 'expense')
+        self.assertEqual(Balance.objects.get(balance_of=self.user).balance, Decimal('200.00'))
+
+    def test_upload_that_is_not_utf8_is_rejected(self):
+        """Uploads that aren't UTF-8 get a 400 instead of an error page."""
+        self.client.login(username='importuser', password='password123')
+        latin1 = SimpleUploadedFile('statement.csv', 'Date,Description,Amount\n2023-01-01,Caf\xe9,-3.00\n'.encode('latin-1'))
+        response = self.client.post(reverse('transaction_import'), {'file': latin1})
+        self.assertEqual((response.status_code, response.json()['success']), (400, False))
+
+        self.assertFalse(Transaction.objects.filter(transaction_of=self.user).exists())
+
+    def test_import_stops_at_an_unreadable_line(self):
+        """Rows before a line the csv module can't read are imported, and the response says where it stopped."""
+        self.client.login(username='importuser', password='password123')
+        # Fields past the csv module's size limit make the reader raise.
+        content = 'Date,Description,Amount\n2023-01-01,Salary,100.00\n2023-01-02,Bonus,5.00\n2023-01-03,' + 'x' * 200000
+        upload = SimpleUploadedFile('statement.csv', content.encode())
+        result = self.client.post(reverse('transaction_import'), {'file': upload}).json()
+        self.assertEqual((result['success'], result['created']), (True, 2))
+        self.assertEqual([error['line'] for error in result['errors']], [4])
+        self.assertIn('nothing after it was imported', result['errors'][0]['errors']['__all__'][0])
+        self.assertEqual(Transaction.objects.filter(transaction_of=self.user).count(), 2)
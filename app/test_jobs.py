@@ -0,0 +1,125 @@
+import datetime
+import os
+import tempfile
+import time
+from unittest import mock
+
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.contrib.auth.models import User
+from django.urls import reverse
+from django.utils import timezone
+from decimal import Decimal
+
+from .models import Job, Transaction, TransactionRollup, TransactionType
+from . import jobs
+from .test_importers import CSV_STATEMENT
+
+
+@jobs.task('test_flaky')
+def flaky(job):
+    if job.attempts < 2:
+        raise RuntimeError('not yet')
+    return {'attempts': job.attempts}
+
+
+@jobs.task('test_slow')
+def slow(job):
+    # Outlasts the lock timeout; only the heartbeat keeps the job from being reclaimed.
+    time.sleep(jobs.LOCK_TIMEOUT * 2)
+    return {'reclaimed': jobs.claim('worker-2') is not None}
+
+
+class JobQueueTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='jobuser', password='password123')
+        self.food = TransactionType.objects.create(name='Food', added_by=self.user)
+        self.client.login(username='jobuser', password='password123')
+
+    def test_claim_is_exclusive(self):
+        """A claimed job is not handed to a second worker until its lock times out."""
+        job = jobs.enqueue('rebuild_rollups', self.user)
+        claimed = jobs.claim('worker-1')
+        self.assertEqual((claimed.pk, claimed.status, claimed.attempts), (job.pk, 'running', 1))
+        self.assertIsNone(jobs.claim('worker-2'))
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - datetime.timedelta(hours=1))
+        self.assertEqual(jobs.claim('worker-2').locked_by, 'worker-2')
+
+    def test_retries_with_backoff(self):
+        """A failing job is requeued for later, then succeeds on its next attempt."""
+        job = jobs.enqueue('test_flaky')
+        with self.assertLogs('app.jobs', 'WARNING'):
+            self.assertEqual(jobs.work('worker', once=True), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error), ('queued', 'RuntimeError: not yet'))
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertEqual(jobs.work('worker', once=True), 0)
+
+        Job.objects.filter(pk=job.pk).update(run_after=timezone.now())
+        jobs.work('worker', once=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result, job.error), ('succeeded', {'attempts': 2}, ''))
+
+    def test_gives_up_after_max_attempts(self):
+        """The last failed attempt marks the job failed."""
+        job = jobs.enqueue('test_flaky', max_attempts=1)
+        with self.assertLogs('app.jobs', 'ERROR'):
+            jobs.work('worker', once=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertIsNotNone(job.finished_at)
+
+    def test_enqueue_and_poll(self):
+        """Users can start their own maintenance jobs and poll only their own jobs."""
+        Transaction.objects.create(name='Lunch', amount=Decimal('5.00'), transaction_type='income',
+                                   transaction_of=self.user, category=self.food)
+        TransactionRollup.objects.all().delete()
+        response = self.client.post(reverse('job_list'), {'kind': 'rebuild_rollups'})
+        self.assertEqual(response.status_code, 202)
+        status_url = response.json()['status_url']
+        self.assertEqual(self.client.get(status_url).json()['status'], 'queued')
+
+        jobs.work('worker', once=True)
+        self.assertEqual(self.client.get(status_url).json()['result'], {'written': 4})
+        self.assertEqual(TransactionRollup.objects.count(), 4)
+        self.assertEqual(self.client.post(reverse('job_list'), {'kind': 'import_transactions'}).status_code, 400)
+
+        User.objects.create_user(username='otherjobuser', password='password123')
+        self.client.login(username='otherjobuser', password='password123')
+        self.assertEqual(self.client.get(status_url).status_code, 404)
+
+    def test_large_imports_run_in_the_background(self):
+        """Uploads above the size limit are stored, queued by path and streamed in by the worker."""
+        with tempfile.TemporaryDirectory() as media, override_settings(IMPORT_BACKGROUND_BYTES=10, MEDIA_ROOT=media):
+            upload = SimpleUploadedFile('statement.csv', CSV_STATEMENT.encode())
+            response = self.client.post(reverse('transaction_import'), {'file': upload})
+            self.assertEqual(response.status_code, 202)
+            self.assertFalse(Transaction.objects.exists())
+            job = Job.objects.get()
+            self.assertEqual(set(job.payload), {'format', 'name', 'path'})
+            self.assertTrue(default_storage.exists(job.payload['path']))
+
+            jobs.work('worker', once=True)
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.result['created']), ('succeeded', 3))
+            self.assertEqual(set(job.payload), {'format', 'name'})
+            self.assertEqual(os.listdir(os.path.join(media, 'imports')), [])
+            self.assertEqual(Transaction.objects.filter(transaction_of=self.user).count(), 3)
+
+            latin1 = 'Date,Description,Amount\n2023-01-01,Caf\xe9,-3.00\n'.encode('latin-1')
+            latin1 = SimpleUploadedFile('statement.csv', latin1)
+            self.assertEqual(self.client.post(reverse('transaction_import'), {'file': latin1}).status_code, 400)
+            self.assertEqual(Job.objects.count(), 1)
+
+
+class JobHeartbeatTestCase(TransactionTestCase):
+    # The heartbeat writes from its own thread, so the job row has to be committed.
+
+    @mock.patch.object(jobs, 'LOCK_TIMEOUT', 0.3)
+    def test_long_running_job_keeps_its_lock(self):
+        """A job running longer than the lock timeout is not handed to a second worker."""
+        job = jobs.enqueue('test_slow')
+        self.assertEqual(jobs.work('worker-1', once=True), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result, job.attempts), ('succeeded', {'reclaimed': False}, 1))
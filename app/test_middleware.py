@@ -0,0 +1,98 @@
+from django.test import TestCase, AsyncClient, Client, override_settings
+from django.contrib.auth.models import User
+from django.urls import reverse
+from decimal import Decimal
+import json
+
+from asgiref.sync import iscoroutinefunction
+
+from expensemanager.middleware import AuthenticationMiddleware, RequestTiming
+
+from .models import TransactionType, Balance
+
+
+@override_settings(REQUEST_TIMING=True, REQUEST_TIMING_DUPLICATE_THRESHOLD=3)
+class QueryTimingMiddlewareTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='timinguser', password='password123')
+        self.category = TransactionType.objects.create(name='Timing', added_by=self.user)
+        Balance.objects.create(balance_of=self.user, balance=Decimal('100.00'))
+        self.client.login(username='timinguser', password='password123')
+
+    def test_server_timing_header_and_log_line(self):
+        """Test a request gets a Server-Timing header and a JSON log line with its query count."""
+        with self.assertLogs('expensemanager.timing', level='INFO') as logs:
+            response = self.client.get(reverse('balance'))
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('view;dur=', response['Server-Timing'])
+        self.assertIn('total;dur=', response['Server-Timing'])
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['path'], reverse('balance'))
+        self.assertEqual(record['status'], 200)
+        self.assertGreater(record['queries'], 0)
+        self.assertEqual(record['duplicates'], [])
+
+    def test_template_render_time_is_measured(self):
+        """Test class-based views report template rendering separately from the view."""
+        with self.assertLogs('expensemanager.timing', level='INFO'):
+            response = self.client.get(reverse('home'))
+        self.assertIn('render;dur=', response['Server-Timing'])
+
+    def test_repeated_statements_are_flagged(self):
+        """Test statements of the same shape are grouped (whatever their IN list length) and flagged."""
+        timing = RequestTiming()
+        execute = lambda sql, params, many, context: None
+        for size in (1, 2, 3):
+            placeholders = ', '.join(['%s'] * size)
+            timing.execute(execute, f'SELECT * FROM app_transaction WHERE id IN ({placeholders})', [0] * size,
+                           False, {})
+        timing.execute(execute, 'SELECT 1', [], False, {})
+        timing.finish()
+        self.assertEqual(timing.queries, 4)
+        self.assertEqual(timing.duplicates(3), [('SELECT * FROM app_transaction WHERE id IN (...)', 3)])
+        self.assertIn('n1;desc="1 repeated statements"', timing.header(timing.duplicates(3)))
+
+    @override_settings(REQUEST_TIMING=False)
+    def test_disabled_by_default(self):
+        """Test the middleware stays out of the way unless REQUEST_TIMING is set."""
+        client = Client()
+        client.login(username='timinguser', password='password123')
+        self.assertNotIn('Server-Timing', client.get(reverse('balance')))
+
+
+class AsyncAuthenticationMiddlewareTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='asyncuser', password='password123')
+        self.category = TransactionType.objects.create(name='Async', added_by=self.user)
+        Balance.objects.create(balance_of=self.user, balance=Decimal('100.00'))
+        self.async_client.force_login(self.user)
+
+    def test_middleware_adapts_to_the_handler(self):
+        """Test the middleware runs as a coroutine under ASGI and as a plain callable under WSGI."""
+        async def async_view(request):
+            return None
+
+        self.assertTrue(iscoroutinefunction(AuthenticationMiddleware(async_view)))
+        self.assertFalse(iscoroutinefunction(AuthenticationMiddleware(lambda request: None)))
+
+    def test_exempt_paths_are_resolved_once(self):
+        """Test the login and registration paths are looked up when the middleware is created."""
+        middleware = AuthenticationMiddleware(lambda request: None)
+        self.assertEqual(middleware.exempt_paths, {reverse('login'), reverse('register')})
+        self.assertTrue(middleware.is_exempt('/captcha/image/abc/'))
+        self.assertFalse(middleware.is_exempt(reverse('balance')))
+
+    async def test_async_redirects_anonymous_users(self):
+        """Test anonymous requests are sent to the login page on the async path."""
+        response = await AsyncClient().get(reverse('transaction_summary'))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response.url, reverse('login'))
+
+    async def test_async_analytics_endpoints(self):
+        """Test the async JSON endpoints answer under the async handler, with conditional GETs."""
+        for name in ('transaction_summary', 'expense_summary', 'category_wise_expenses', 'balance'):
+            response = await self.async_client.get(reverse(name))
+            self.assertEqual(response.status_code, 200, name)
+            # AsyncClient takes raw header names.
+            response = await self.async_client.get(reverse(name), **{'if-none-match': response['ETag']})
+            self.assertEqual(response.status_code, 304, name)
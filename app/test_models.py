@@ -1,9 +1,24 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
+from django.db import IntegrityError, OperationalError, connection, transaction
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db.models.functions import Lower
+from django.db.migrations.executor import MigrationExecutor
+from unittest import skipUnless
 from decimal import Decimal
-
-from .models import Transaction, TransactionType, Balance
+import datetime
+import io
+import os
+import tempfile
+import threading
+import time
+
+from .models import (Transaction, TransactionType, Balance, BalanceCheckpoint, BalanceEntry, ExchangeRate,
+                     TransactionRollup)
+from . import currency, exporters, ledger, rollups
+from .pagination import after_cursor, encode_cursor, order_newest_first
+from .serializers import transaction_values
 
 class ModelTestCase(TestCase):
     def setUp(self):
@@ -116,24 +131,35 @@ class ModelTestCase(TestCase):
         balance = Balance.objects.get(balance_of=self.user)
         self.assertEqual(balance.balance, Decimal('200.00'))
 
-        # Change income to expense
+        # Change income to expense with nothing else to cover it.
+        # Reverting income: 200 - 200 = 0. Applying new expense: 0 - 200 = -200,
+        # which would overdraw, so the change is refused and nothing moves.
         transaction.transaction_type = 'expense'
-        transaction.save()
+        with self.assertRaisesMessage(ValidationError, "Insufficient balance to complete this transaction."):
+            transaction.save()
         balance.refresh_from_db()
-        # Expected: -200 (original income reverted) - 200 (new expense) = -400 from original state.
-        # Since original state was 0, then +200, now it should be 0 - 200 (reverted) - 200 (new expense) = -400.
-        # However, the balance object started at 0, became 200.
-        # Reverting income: 200 - 200 = 0. Applying new expense: 0 - 200 = -200.
-        self.assertEqual(balance.balance, Decimal('-200.00'))
+        self.assertEqual(balance.balance, Decimal('200.00'))
+        self.assertEqual(Transaction.objects.get(pk=transaction.pk).transaction_type, 'income')
 
+        # With more income on the books the switch is covered.
+        Transaction.objects.create(
+            name='Salary',
+            amount=Decimal('400.00'),
+            transaction_type='income',
+            transaction_of=self.user,
+            category=self.category
+        )
+        # Reverting income: 600 - 200 = 400. Applying new expense: 400 - 200 = 200.
+        transaction.save()
+        balance.refresh_from_db()
+        self.assertEqual(balance.balance, Decimal('200.00'))
 
         # Change expense back to income
-        # Current balance is -200. Transaction amount is 200, type is expense.
         transaction.transaction_type = 'income'
         transaction.save()
         balance.refresh_from_db()
-        # Reverting expense: -200 + 200 = 0. Applying new income: 0 + 200 = 200.
-        self.assertEqual(balance.balance, Decimal('200.00'))
+        # Reverting expense: 200 + 200 = 400. Applying new income: 400 + 200 = 600.
+        self.assertEqual(balance.balance, Decimal('600.00'))
 
     def test_transaction_deletion(self):
         """Test deleting a transaction correctly reverts balance."""
@@ -291,3 +317,313 @@ class ModelTestCase(TestCase):
 # More tests can be added for edge cases, like zero amount transactions if allowed/disallowed.
 # Or tests for TransactionType model if it had more logic.
 # For now, this covers the balance logic in Transaction model.
+
+
+class RollupTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='rollupuser', password='password123')
+        self.category = TransactionType.objects.create(name='Rollup Category', added_by=self.user)
+        self.other_category = TransactionType.objects.create(name='Other Category', added_by=self.user)
+
+    def create(self, amount, date, transaction_type='income', category=None):
+        return Transaction.objects.create(
+            name='Rollup Tx',
+            amount=Decimal(amount),
+            date=date,
+            transaction_type=transaction_type,
+            transaction_of=self.user,
+            category=category or self.category
+        )
+
+    def bucket(self, granularity, period, transaction_type='income', category=None):
+        return TransactionRollup.objects.get(
+            rollup_of=self.user,
+            granularity=granularity,
+            period=period,
+            transaction_type=transaction_type,
+            category=category or self.category
+        )
+
+    def test_create_updates_every_granularity(self):
+        """A new transaction is counted in its day, week, month and year buckets."""
+        self.create('100.00', datetime.date(2023, 3, 15))
+        self.create('50.00', datetime.date(2023, 3, 16))
+
+        self.assertEqual(self.bucket('day', datetime.date(2023, 3, 15)).total, Decimal('100.00'))
+        week = self.bucket('week', datetime.date(2023, 3, 13))
+        self.assertEqual((week.total, week.count), (Decimal('150.00'), 2))
+        self.assertEqual(self.bucket('month', datetime.date(2023, 3, 1)).total, Decimal('150.00'))
+        self.assertEqual(self.bucket('year', datetime.date(2023, 1, 1)).total, Decimal('150.00'))
+
+    def test_update_moves_amount_between_buckets(self):
+        """Editing date, amount or category moves the contribution to the new bucket."""
+        trans = self.create('100.00', datetime.date(2023, 3, 15))
+        trans.amount = Decimal('80.00')
+        trans.date = datetime.date(2023, 4, 2)
+        trans.category = self.other_category
+        trans.save()
+
+        self.assertFalse(TransactionRollup.objects.filter(
+            rollup_of=self.user, granularity='month', period=datetime.date(2023, 3, 1)).exists())
+        month = self.bucket('month', datetime.date(2023, 4, 1), category=self.other_category)
+        self.assertEqual((month.total, month.count), (Decimal('80.00'), 1))
+
+    def test_delete_removes_from_buckets(self):
+        """Deleting through a queryset, as the delete view does, drops the rows from the rollups."""
+        self.create('100.00', datetime.date(2023, 3, 15))
+        trans = self.create('40.00', datetime.date(2023, 3, 20))
+        Transaction.objects.filter(pk=trans.pk).delete()
+
+        month = self.bucket('month', datetime.date(2023, 3, 1))
+        self.assertEqual((month.total, month.count), (Decimal('100.00'), 1))
+        self.assertFalse(TransactionRollup.objects.filter(
+            rollup_of=self.user, granularity='day', period=datetime.date(2023, 3, 20)).exists())
+
+    def test_rebuild_command_matches_incremental_rollups(self):
+        """Rebuilding from scratch produces the same buckets as incremental maintenance."""
+        self.create('100.00', datetime.date(2022, 12, 31))
+        self.create('30.00', datetime.date(2023, 1, 1), category=self.other_category)
+        self.create('20.00', datetime.date(2023, 1, 2), transaction_type='expense')
+        fields = ('granularity', 'period', 'transaction_type', 'category', 'total', 'count')
+        incremental = sorted(TransactionRollup.objects.values_list(*fields))
+
+        TransactionRollup.objects.all().delete()
+        call_command('rebuild_rollups', stdout=open('/dev/null', 'w'))
+
+        self.assertEqual(sorted(TransactionRollup.objects.values_list(*fields)), incremental)
+
+
+class RollupMigrationTestCase(TransactionTestCase):
+    def test_existing_transactions_are_rolled_up(self):
+        """Migrating onto rollups fills the buckets from the transactions already there."""
+        executor = MigrationExecutor(connection)
+        executor.migrate([('app', '0001_initial')])
+        apps = executor.loader.project_state([('app', '0001_initial')]).apps
+        user = User.objects.create_user(username='migrationuser', password='password123')
+        category = apps.get_model('app', 'TransactionType').objects.create(name='Food', added_by_id=user.pk)
+        for amount, date in (('10.00', '2024-01-05'), ('5.00', '2024-01-20'), ('7.00', '2024-02-01')):
+            apps.get_model('app', 'Transaction').objects.create(
+                name='Lunch', amount=Decimal(amount), date=date, transaction_type='expense',
+                transaction_of_id=user.pk, category_id=category.pk)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+        self.assertEqual(rollups.grand_total(user), Decimal('22.00'))
+        january = TransactionRollup.objects.get(granularity='month', period=datetime.date(2024, 1, 1))
+        self.assertEqual((january.total, january.count), (Decimal('15.00'), 2))
+        self.assertEqual(TransactionRollup.objects.filter(granularity='week').count(), 3)
+
+
+class LedgerTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='ledgeruser', password='password123')
+        self.category = TransactionType.objects.create(name='Ledger Category', added_by=self.user)
+
+    def create(self, amount, transaction_type='income'):
+        return Transaction.objects.create(name='Ledger Tx', amount=Decimal(amount), transaction_type=transaction_type,
+                                          transaction_of=self.user, category=self.category)
+
+    def test_every_change_is_appended_to_the_ledger(self):
+        """Creates, edits and deletes each append one entry with the balance delta."""
+        trans = self.create('100.00')
+        trans.amount = Decimal('80.00')
+        trans.save()
+        trans.delete()
+        deltas = list(BalanceEntry.objects.filter(balance_of=self.user).order_by('pk').values_list('delta', flat=True))
+        self.assertEqual(deltas, [Decimal('100.00'), Decimal('-20.00'), Decimal('-80.00')])
+        self.assertEqual(Balance.objects.get(balance_of=self.user).balance, Decimal('0.00'))
+
+    def test_ledger_balance_from_checkpoint(self):
+        """The balance equals the last checkpoint plus the entries written after it."""
+        self.create('100.00')
+        self.create('30.00', 'expense')
+        checkpoint = ledger.checkpoint(self.user.pk)
+        self.assertEqual(checkpoint.balance, Decimal('70.00'))
+        self.create('5.00')
+        self.assertEqual(ledger.ledger_balance(self.user.pk), Decimal('75.00'))
+        self.assertEqual(Balance.objects.get(balance_of=self.user).balance, Decimal('75.00'))
+        self.assertIsNone(BalanceCheckpoint.objects.filter(entry_id__gt=checkpoint.entry_id).first())
+
+    def test_income_the_balance_has_spent_cant_be_taken_back(self):
+        """Editing an income down or deleting it is refused when the balance can't cover the difference."""
+        income = self.create('100.00')
+        self.create('60.00', 'expense')
+        income.amount = Decimal('50.00')
+        with self.assertRaisesMessage(ValidationError, ledger.INSUFFICIENT_BALANCE):
+            income.save()
+        # The delete's own transaction has no savepoint; give it one inside the test's.
+        with self.assertRaisesMessage(ValidationError, ledger.INSUFFICIENT_BALANCE), transaction.atomic():
+            Transaction.objects.get(pk=income.pk).delete()
+        self.assertEqual(Transaction.objects.get(pk=income.pk).amount, Decimal('100.00'))
+        self.assertEqual(Balance.objects.get(balance_of=self.user).balance, Decimal('40.00'))
+        self.assertEqual(BalanceEntry.objects.filter(balance_of=self.user).count(), 2)
+
+        income.amount = Decimal('60.00')
+        income.save()
+        self.assertEqual(Balance.objects.get(balance_of=self.user).balance, Decimal('0.00'))
+
+    def test_rejected_expense_leaves_no_trace(self):
+        """An overdraft is rejected without writing the row, a ledger entry or rollups."""
+        self.create('10.00')
+        with self.assertRaisesMessage(ValidationError, ledger.INSUFFICIENT_BALANCE):
+            self.create('10.01', 'expense')
+        self.assertEqual(Transaction.objects.filter(transaction_of=self.user).count(), 1)
+        self.assertEqual(BalanceEntry.objects.filter(balance_of=self.user).count(), 1)
+        self.assertFalse(TransactionRollup.objects.filter(rollup_of=self.user, transaction_type='expense').exists())
+
+
+class CurrencyTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='currencyuser', password='password123')
+        self.category = TransactionType.objects.create(name='Currency Category', added_by=self.user)
+        ExchangeRate.objects.create(currency='EUR', date=datetime.date(2024, 1, 1), rate=Decimal('1.10'))
+        ExchangeRate.objects.create(currency='EUR', date=datetime.date(2024, 2, 1), rate=Decimal('1.20'))
+
+    def create(self, amount, currency_code, date, transaction_type='income'):
+        return Transaction.objects.create(name='Fx', amount=Decimal(amount), currency=currency_code, date=date,
+                                          transaction_type=transaction_type, transaction_of=self.user,
+                                          category=self.category)
+
+    def test_save_converts_with_latest_rate_on_or_before_date(self):
+        """The base amount uses the newest rate not after the transaction date."""
+        self.assertEqual(self.create('10.00', 'EUR', '2024-01-15').base_amount, Decimal('11.00'))
+        self.assertEqual(self.create('10.00', 'EUR', '2024-03-01').base_amount, Decimal('12.00'))
+        self.assertEqual(self.create('10.00', currency.BASE_CURRENCY, '2024-03-01').base_amount, Decimal('10.00'))
+
+    def test_balance_and_rollups_use_base_amounts(self):
+        """Balances and summaries add up converted amounts."""
+        self.create('100.00', 'EUR', '2024-01-15')
+        self.create('10.00', 'EUR', '2024-02-15', 'expense')
+        self.assertEqual(Balance.objects.get(balance_of=self.user).balance, Decimal('98.00'))
+        self.assertEqual(rollups.grand_total(self.user), Decimal('122.00'))
+
+    def test_missing_rate_is_rejected(self):
+        """A transaction dated before the first rate for its currency can't be saved."""
+        with self.assertRaises(ValidationError):
+            self.create('10.00', 'EUR', '2023-12-31')
+        with self.assertRaises(ValidationError):
+            self.create('10.00', 'GBP', '2024-01-15')
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_rate_table_looks_up_each_currency_and_day_once(self):
+        """A RateTable fetches all rates in one query and converts without further queries."""
+        with self.assertNumQueries(1):
+            table = currency.RateTable({'EUR', currency.BASE_CURRENCY})
+        with self.assertNumQueries(0):
+            self.assertEqual(table.to_base('1.00', 'EUR', '2024-01-31'), Decimal('1.10'))
+            self.assertEqual(table.to_base('1.00', 'EUR', datetime.date(2024, 2, 1)), Decimal('1.20'))
+            with self.assertRaises(ValidationError):
+                table.to_base('1.00', 'GBP', '2024-02-01')
+
+    def test_load_exchange_rates_command(self):
+        """Rates are loaded from a CSV file, replacing the value for an existing day."""
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as rates_file:
+            rates_file.write("date,currency,rate\n2024-02-01,eur,1.25\n2024-02-01,GBP,1.30\n")
+        try:
+            call_command('load_exchange_rates', rates_file.name, stdout=io.StringIO())
+        finally:
+            os.unlink(rates_file.name)
+        self.assertEqual(ExchangeRate.objects.get(currency='EUR', date='2024-02-01').rate, Decimal('1.25'))
+        self.assertEqual(currency.latest_rates(), {currency.BASE_CURRENCY: Decimal('1'), 'EUR': Decimal('1.25'),
+                                                   'GBP': Decimal('1.30')})
+
+
+class ConcurrentLedgerTestCase(TransactionTestCase):
+    THREADS = 4
+    WRITES_PER_THREAD = 25
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='concurrentuser', password='password123')
+        self.category = TransactionType.objects.create(name='Concurrent Category', added_by=self.user)
+        Transaction.objects.create(name='Seed', amount=Decimal('50.00'), transaction_type='income',
+                                   transaction_of=self.user, category=self.category)
+
+    def writer(self, results):
+        """Alternate incomes and expenses, retrying while another writer holds the database."""
+        accepted = Decimal('0')
+        try:
+            for i in range(self.WRITES_PER_THREAD):
+                trans_type, amount = ('income', Decimal('3.00')) if i % 2 else ('expense', Decimal('2.00'))
+                while True:
+                    try:
+                        Transaction.objects.create(name='Concurrent', amount=amount, transaction_type=trans_type,
+                                                   transaction_of=self.user, category=self.category)
+                        accepted += ledger.effect(trans_type, amount)
+                        break
+                    except OperationalError:
+                        time.sleep(0.001)
+                    except ValidationError:
+                        break
+        finally:
+            connection.close()
+        results.append(accepted)
+
+    def test_concurrent_writers_do_not_lose_updates(self):
+        """Concurrent writers for one user end on the exact balance."""
+        results = []
+        threads = [threading.Thread(target=self.writer, args=(results,)) for _ in range(self.THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(results), self.THREADS)
+        expected = Decimal('50.00') + sum(results)
+        self.assertEqual(Balance.objects.get(balance_of=self.user).balance, expected)
+        self.assertEqual(ledger.ledger_balance(self.user.pk), expected)
+        self.assertGreaterEqual(Balance.objects.get(balance_of=self.user).balance, 0)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plans are checked with SQLite\'s EXPLAIN QUERY PLAN.')
+class QueryPlanTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='planuser', password='password123')
+        self.category = TransactionType.objects.create(name='Plan Category', added_by=self.user)
+        self.transactions = Transaction.objects.filter(transaction_of=self.user)
+
+    def assertUsesIndex(self, queryset, index=None):
+        """The plan searches an index (``index``, if given) and never scans a whole table."""
+        plan = queryset.explain().replace('COVERING INDEX', 'INDEX')
+        self.assertIn(f'USING INDEX {index or ""}', plan)
+        self.assertNotRegex(plan, r'\bSCAN (TABLE )?app_\w+(?! USING)')
+
+    def test_transaction_list_page(self):
+        """transaction_list pages use (transaction_of, date)."""
+        page = after_cursor(order_newest_first(transaction_values(self.transactions)),
+                            encode_cursor(datetime.date(2023, 1, 1), 10))
+        self.assertUsesIndex(page[:101], 'transaction_owner_date_idx')
+
+    def test_export_date_range(self):
+        """Exports with a date range use (transaction_of, date)."""
+        rows = exporters.filter_transactions(self.transactions, datetime.date(2023, 1, 1), datetime.date(2023, 6, 30))
+        self.assertUsesIndex(transaction_values(rows).order_by('date', 'pk'), 'transaction_owner_date_idx')
+
+    def test_filter_by_type(self):
+        """Per-type queries use (transaction_of, transaction_type, date)."""
+        expenses = self.transactions.filter(transaction_type='expense', date__gte=datetime.date(2023, 1, 1))
+        self.assertUsesIndex(expenses.values('date', 'amount'), 'transaction_owner_type_idx')
+
+    def test_filter_by_category(self):
+        """Per-category queries use (transaction_of, category)."""
+        by_category = self.transactions.filter(category=self.category).order_by().values('amount')
+        self.assertUsesIndex(by_category, 'transaction_owner_cat_idx')
+
+    def test_transaction_type_name_lookup(self):
+        """create_transaction_type's duplicate check uses the (added_by, lower(name)) index."""
+        lookup = TransactionType.objects.annotate(lower_name=Lower('name')) \
+            .filter(added_by=self.user, lower_name='plan category')
+        self.assertUsesIndex(lookup, 'unique_transaction_type_name')
+
+    def test_monthly_rollups(self):
+        """The summary endpoints read rollups through the bucket's unique index."""
+        buckets = TransactionRollup.objects.filter(rollup_of=self.user, granularity='month',
+                                                   transaction_type='expense').values('period', 'total')
+        # SQLite names the index backing a table-level UNIQUE constraint itself.
+        self.assertUsesIndex(buckets)
+
+    def test_category_names_are_unique_per_user_ignoring_case(self):
+        """Two categories of one user can't differ only by case; other users are unaffected."""
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            TransactionType.objects.create(name='PLAN category', added_by=self.user)
+        other = User.objects.create_user(username='planother', password='password123')
+        TransactionType.objects.create(name='Plan Category', added_by=other)
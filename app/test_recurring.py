@@ -0,0 +1,93 @@
+import datetime
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import OperationalError
+from django.test import TestCase
+from django.contrib.auth.models import User
+from decimal import Decimal
+
+from .models import Balance, BalanceEntry, RecurringTransaction, Transaction, TransactionRollup, TransactionType
+from . import recurring
+
+
+class RecurringTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='recurringuser', password='password123')
+        self.bills = TransactionType.objects.create(name='Bills', added_by=self.user)
+        Balance.objects.create(balance_of=self.user, balance=Decimal('100.00'))
+
+    def rule(self, **kwargs):
+        fields = dict(name='Rent', amount=Decimal('40.00'), transaction_type='expense', recurring_of=self.user,
+                      category=self.bills, start_date=datetime.date(2024, 1, 31))
+        fields.update(kwargs)
+        return RecurringTransaction.objects.create(**fields)
+
+    def test_schedule(self):
+        """Month-end days clamp to shorter months without drifting, and intervals are respected."""
+        rule = self.rule(end_date=datetime.date(2024, 5, 31))
+        self.assertEqual(list(recurring.due(rule, datetime.date(2024, 12, 31))), [
+            datetime.date(2024, 1, 31), datetime.date(2024, 2, 29), datetime.date(2024, 3, 31),
+            datetime.date(2024, 4, 30), datetime.date(2024, 5, 31),
+        ])
+        rule = self.rule(frequency='weekly', interval=2, start_date=datetime.date(2024, 1, 1))
+        self.assertEqual(len(list(recurring.due(rule, datetime.date(2024, 1, 31)))), 3)
+        rule = self.rule(day_of_month=15, start_date=datetime.date(2024, 1, 20))
+        self.assertEqual(rule.next_date, datetime.date(2024, 2, 15))
+
+    def test_materialize_is_idempotent(self):
+        """Due occurrences are created once, with one balance adjustment, and reruns add nothing."""
+        rule = self.rule()
+        self.rule(name='Salary', amount=Decimal('100.00'), transaction_type='income', frequency='monthly',
+                  start_date=datetime.date(2024, 2, 1))
+        today = datetime.date(2024, 3, 15)
+        self.assertEqual(recurring.materialize(today=today), {self.user.pk: (4, None)})
+        self.assertEqual(Transaction.objects.filter(recurring=rule).count(), 2)
+        self.assertEqual(Balance.objects.get(balance_of=self.user).balance, Decimal('220.00'))
+        self.assertEqual(BalanceEntry.objects.filter(balance_of=self.user).count(), 1)
+        self.assertEqual(TransactionRollup.objects.get(granularity='year', transaction_type='expense').count, 2)
+        rule.refresh_from_db()
+        self.assertEqual(rule.next_date, datetime.date(2024, 3, 31))
+
+        self.assertEqual(recurring.materialize(today=today), {})
+        self.assertEqual(Transaction.objects.filter(transaction_of=self.user).count(), 4)
+
+    def test_insufficient_funds_are_retried(self):
+        """A user whose balance can't cover what is due gets nothing until the next run."""
+        rule = self.rule(amount=Decimal('60.00'))
+        created, error = recurring.materialize(today=datetime.date(2024, 2, 29))[self.user.pk]
+        self.assertEqual(created, 0)
+        self.assertIn('Insufficient balance', error)
+        self.assertFalse(Transaction.objects.exists())
+        rule.refresh_from_db()
+        self.assertEqual(rule.next_date, datetime.date(2024, 1, 31))
+        Balance.objects.filter(balance_of=self.user).update(balance=Decimal('200.00'))
+        self.assertEqual(recurring.materialize(today=datetime.date(2024, 2, 29)), {self.user.pk: (2, None)})
+
+    def test_locked_database_fails_only_that_user(self):
+        """A user whose write hits a locked database is reported and retried; the others still run."""
+        self.rule()
+        other = User.objects.create_user(username='otherrecurringuser', password='password123')
+        Balance.objects.create(balance_of=other, balance=Decimal('100.00'))
+        self.rule(recurring_of=other, category=TransactionType.objects.create(name='Bills', added_by=other))
+        create_due = recurring._create_due
+
+        def locked_for_first_user(user_id, today):
+            if user_id == self.user.pk:
+                raise OperationalError('database is locked')
+            return create_due(user_id, today)
+
+        today = datetime.date(2024, 2, 29)
+        with mock.patch.object(recurring, '_create_due', side_effect=locked_for_first_user), \
+                self.assertLogs('app.recurring', 'WARNING'):
+            results = recurring.materialize(today=today, workers=1)
+        self.assertEqual(results, {self.user.pk: (0, 'database is locked'), other.pk: (2, None)})
+        self.assertEqual(recurring.materialize(today=today), {self.user.pk: (2, None)})
+
+    def test_command(self):
+        """The command reports what it created."""
+        self.rule(end_date=datetime.date(2024, 2, 1))
+        out = StringIO()
+        call_command('materialize_recurring', '--date', '2024-06-01', '--workers', '1', stdout=out)
+        self.assertIn('Created 1 transactions for 1 users (0 failed).', out.getvalue())
@@ -0,0 +1,81 @@
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.contrib.auth.models import User
+from django.utils import timezone
+from decimal import Decimal
+import datetime
+
+from .models import DataVersion, Transaction, TransactionType
+from . import routers
+
+
+@routers.replica_reads
+def routed_to(request):
+    return HttpResponse(routers.ReplicaRouter().db_for_read(Transaction) or '')
+
+
+@routers.replica_reads
+async def arouted_to(request):
+    return HttpResponse(routers.ReplicaRouter().db_for_read(Transaction) or '')
+
+
+@override_settings(READ_REPLICA=True)
+class ReplicaRouterTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='replicauser', password='password123')
+        self.food = TransactionType.objects.create(name='Food', added_by=self.user)
+        self.factory = RequestFactory()
+        self.age_writes()
+
+    def age_writes(self):
+        # As if the last writes were made before the sticky window.
+        past = timezone.now() - datetime.timedelta(seconds=routers.STICKY_SECONDS + 1)
+        DataVersion.objects.update(updated_at=past)
+
+    def routed_to(self):
+        request = self.factory.get('/')
+        request.user = self.user
+        return routed_to(request).content.decode() or None
+
+    def test_reads_go_to_the_replica(self):
+        """Decorated views read from the replica; everything else and all writes use default."""
+        self.assertEqual(self.routed_to(), 'replica')
+        router = routers.ReplicaRouter()
+        self.assertIsNone(router.db_for_read(Transaction))
+        self.assertEqual(router.db_for_write(Transaction), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'app'))
+        self.assertTrue(router.allow_migrate('default', 'app'))
+
+    def test_writers_read_their_own_writes(self):
+        """A user who has just written is pinned to default for a few seconds; other users are not."""
+        request = self.factory.get('/')
+        request.user = User.objects.create_user(username='otherreplicauser', password='password123')
+        self.age_writes()
+        Transaction.objects.create(name='Lunch', amount=Decimal('5.00'), transaction_type='income',
+                                   transaction_of=self.user, category=self.food)
+        # The pin is kept in the database, so no server process's cache can lose it.
+        cache.clear()
+        self.assertIsNone(self.routed_to())
+        self.assertEqual(routed_to(request).content, b'replica')
+        self.age_writes()
+        self.assertEqual(self.routed_to(), 'replica')
+
+    @override_settings(READ_REPLICA=False)
+    def test_disabled(self):
+        """Without READ_REPLICA every read stays on default."""
+        self.assertIsNone(self.routed_to())
+        Transaction.objects.create(name='Lunch', amount=Decimal('5.00'), transaction_type='income',
+                                   transaction_of=self.user, category=self.food)
+        self.assertIsNone(self.routed_to())
+
+    def test_async_views(self):
+        """Async views are routed and pinned too, and the routing ends with the view."""
+        request = self.factory.get('/')
+        request.user = self.user
+        self.assertEqual(async_to_sync(arouted_to)(request).content, b'replica')
+        self.assertIsNone(routers.read_alias())
+        Transaction.objects.create(name='Lunch', amount=Decimal('5.00'), transaction_type='income',
+                                   transaction_of=self.user, category=self.food)
+        self.assertEqual(async_to_sync(arouted_to)(request).content, b'')
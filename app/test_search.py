@@ -0,0 +1,97 @@
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.contrib.auth.models import User
+from django.urls import reverse
+from decimal import Decimal
+
+from .models import Balance, Transaction, TransactionType
+from . import search
+
+
+class SearchTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='searchuser', password='password123')
+        self.other = User.objects.create_user(username='otheruser', password='password123')
+        self.food = TransactionType.objects.create(name='Food', added_by=self.user)
+        self.rent = TransactionType.objects.create(name='Rent', added_by=self.user)
+        Balance.objects.create(balance_of=self.user, balance=Decimal('1000.00'))
+        self.coffee = self.add('Coffee beans', '2024-01-05', self.food, remarks='Ethiopian roast')
+        self.add('Dinner', '2024-01-10', self.food, remarks='coffee afterwards')
+        self.add('January rent', '2024-01-01', self.rent)
+        self.add('Coffee', '2024-02-01', self.food)
+        other_food = TransactionType.objects.create(name='Food', added_by=self.other)
+        Balance.objects.create(balance_of=self.other, balance=Decimal('1000.00'))
+        Transaction.objects.create(name='Coffee', amount=Decimal('3.00'), date='2024-01-05',
+                                   transaction_type='expense', transaction_of=self.other, category=other_food)
+        self.client.login(username='searchuser', password='password123')
+
+    def add(self, name, date, category, remarks=None):
+        return Transaction.objects.create(name=name, amount=Decimal('5.00'), date=date, transaction_type='expense',
+                                          transaction_of=self.user, category=category, remarks=remarks)
+
+    def names(self, query, **kwargs):
+        rows, _ = search.search(self.user, query, **kwargs)
+        return [row['name'] for row in rows]
+
+    def test_parse_query(self):
+        """Punctuation is dropped and the last word is always a prefix."""
+        terms = search.parse_query('caf* "OR" rent')
+        self.assertEqual(terms, [('caf', True), ('OR', False), ('rent', True)])
+        self.assertEqual(search.match_expression(terms), '"caf"* "OR" "rent"*')
+
+    def test_ranking_and_isolation(self):
+        """Name hits outrank remark hits, and only the user's own transactions match."""
+        self.assertTrue(search.fts_enabled())
+        names = self.names('coffee')
+        self.assertEqual(len(names), 3)
+        self.assertEqual(names[-1], 'Dinner')
+        self.assertEqual(self.names('ethiop'), ['Coffee beans'])
+
+    def test_index_follows_writes(self):
+        """Edits and deletes are reflected in the index straight away."""
+        self.coffee.name = 'Tea leaves'
+        self.coffee.save()
+        self.assertEqual(self.names('tea'), ['Tea leaves'])
+        self.assertNotIn('Coffee beans', self.names('beans'))
+        self.coffee.delete()
+        self.assertEqual(self.names('tea'), [])
+
+    def test_filters_and_pagination(self):
+        """Date and category filters apply, and pages continue from ``next_offset``."""
+        self.assertEqual(self.names('coffee', start='2024-01-06'), ['Coffee', 'Dinner'])
+        self.assertEqual(self.names('rent', categories=[self.rent.pk]), ['January rent'])
+        rows, next_offset = search.search(self.user, 'coffee', limit=2)
+        self.assertEqual(len(rows), 2)
+        rest, last = search.search(self.user, 'coffee', offset=next_offset, limit=2)
+        self.assertEqual(len(rest), 1)
+        self.assertIsNone(last)
+
+    def test_triggers_dropped_by_a_table_rebuild_are_restored(self):
+        """Search falls back while a trigger is missing; the next migrate recreates it and catches the index up."""
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER app_transaction_fts_insert')
+        search._enabled.clear()
+        self.assertFalse(search.fts_enabled())
+        self.add('Coffee filters', '2024-02-02', self.food)
+
+        call_command('migrate', verbosity=0)
+        self.assertTrue(search.fts_enabled())
+        self.assertEqual(self.names('filters'), ['Coffee filters'])
+
+    def test_fallback_without_fts(self):
+        """Without the FTS5 index every word is matched with LIKE, newest first."""
+        with mock.patch.object(search, 'fts_enabled', return_value=False):
+            rows, _ = search.search(self.user, 'coffee')
+        self.assertEqual([row['name'] for row in rows], ['Coffee', 'Dinner', 'Coffee beans'])
+        self.assertIsNone(rows[0]['rank'])
+
+    def test_search_view(self):
+        """The endpoint returns matching rows and rejects malformed parameters."""
+        response = self.client.get(reverse('transaction_search'), {'q': 'jan'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['name'] for row in response.json()['transactions']], ['January rent'])
+        response = self.client.get(reverse('transaction_search'), {'q': 'jan', 'offset': '-1'})
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,121 @@
+import datetime
+import json
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.contrib.auth.models import User
+from django.urls import reverse
+from decimal import Decimal
+
+from .models import ArchivedTransaction, Balance, BalanceEntry, ShardAssignment, Transaction, TransactionRollup, TransactionType
+from . import archive, ledger, search, shards
+
+
+@override_settings(SHARDS=['default', 'shard1'])
+class ShardTestCase(TestCase):
+    databases = {'default', 'shard1'}
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='sharduser', password='password123')
+        self.client.login(username='sharduser', password='password123')
+
+    def add_transactions(self):
+        # Outside a request the shard comes from the context, as in jobs and commands.
+        with shards.for_user(self.user.pk):
+            food = TransactionType.objects.create(name='Food', added_by=self.user)
+            Transaction.objects.create(name='Salary', amount=Decimal('100.00'), transaction_type='income',
+                                       transaction_of=self.user, category=food, date='2024-01-05')
+            Transaction.objects.create(name='Lunch at the cafe', amount=Decimal('30.00'),
+                                       transaction_type='expense', transaction_of=self.user, category=food,
+                                       date='2024-01-06')
+            ledger.checkpoint(self.user.pk)
+
+    def test_rows_follow_the_owner(self):
+        """A user's rows, and everything derived from them, are written to and read from their shard."""
+        shards.move(self.user.pk, 'shard1', grace=0)
+        self.add_transactions()
+        self.assertEqual(Transaction.objects.using('shard1').filter(transaction_of=self.user).count(), 2)
+        self.assertFalse(Transaction.objects.using('default').exists())
+        self.assertEqual(Balance.objects.using('shard1').get(balance_of=self.user).balance, Decimal('70.00'))
+        self.assertTrue(TransactionRollup.objects.using('shard1').exists())
+
+        response = self.client.get(reverse('balance'))
+        self.assertEqual(response.json(), {'balance': '70.00', 'total_transaction': '130.00'})
+        response = self.client.post(reverse('transaction_type_create'), {'name': 'Travel'})
+        self.assertIn('success', response.json())
+        self.assertTrue(TransactionType.objects.using('shard1').filter(name='Travel').exists())
+
+    def test_new_users_are_placed_by_hash(self):
+        """The first placement is the hashed shard, and it is recorded."""
+        placement = shards.placement(self.user.pk)
+        self.assertEqual(placement.database, shards.hashed(self.user.pk))
+        self.assertEqual(ShardAssignment.objects.get(shard_of=self.user).database, placement.database)
+        self.assertEqual(set(shards.fan_out(lambda database: database)), {'default', 'shard1'})
+
+    def test_move_between_shards(self):
+        """Moving a user copies their rows with references intact and removes the originals."""
+        ShardAssignment.objects.create(shard_of=self.user, database='default')
+        self.add_transactions()
+        out = StringIO()
+        call_command('rebalance_shards', '--user', 'sharduser', '--to', 'shard1', '--grace', '0', stdout=out)
+        self.assertIn('Moved 1 users', out.getvalue())
+
+        self.assertEqual(ShardAssignment.objects.get(shard_of=self.user).database, 'shard1')
+        self.assertFalse(Transaction.objects.using('default').exists())
+        moved = Transaction.objects.using('shard1').select_related('category')
+        self.assertEqual(sorted(t.category.name for t in moved), ['Food', 'Food'])
+        self.assertEqual(set(BalanceEntry.objects.using('shard1').values_list('transaction_pk', flat=True)),
+                         set(moved.values_list('pk', flat=True)))
+        with shards.for_user(self.user.pk):
+            self.assertEqual(ledger.ledger_balance(self.user.pk), Decimal('70.00'))
+            rows, _ = search.search(self.user, 'cafe')
+        self.assertEqual([row['name'] for row in rows], ['Lunch at the cafe'])
+
+    def test_move_keeps_archived_rows(self):
+        """Archived rows move too, with ids that can't clash with the new shard's transactions."""
+        ShardAssignment.objects.create(shard_of=self.user, database='default')
+        self.add_transactions()
+        list(archive.archive(datetime.date(2024, 1, 6)))
+        shards.move(self.user.pk, 'shard1', grace=0)
+
+        archived = ArchivedTransaction.objects.using('shard1').get()
+        hot = Transaction.objects.using('shard1').get()
+        self.assertEqual((archived.name, archived.category.name), ('Salary', 'Food'))
+        self.assertNotEqual(archived.pk, hot.pk)
+        self.assertEqual(set(BalanceEntry.objects.using('shard1').values_list('transaction_pk', flat=True)),
+                         {archived.pk, hot.pk})
+        self.assertFalse(ArchivedTransaction.objects.using('default').exists())
+        self.assertEqual(len(self.client.get(reverse('transaction_list')).json()['transactions']), 2)
+
+    def test_streamed_responses_read_from_the_shard(self):
+        """Bodies streamed after the view returns still come from the user's shard."""
+        shards.move(self.user.pk, 'shard1', grace=0)
+        self.add_transactions()
+        list(archive.archive(datetime.date(2024, 1, 6)))
+
+        response = self.client.get(reverse('transaction_list'), {'stream': '1'})
+        rows = json.loads(b''.join(response.streaming_content))['transactions']
+        self.assertEqual([row['name'] for row in rows], ['Lunch at the cafe', 'Salary'])
+        response = self.client.get(reverse('transaction_export', args=['ndjson']))
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(sorted(row['name'] for row in rows), ['Lunch at the cafe', 'Salary'])
+
+    def test_writes_are_refused_while_moving(self):
+        """While a user is moving, their writes get a 503 and nothing is written."""
+        food = TransactionType.objects.create(name='Food', added_by=self.user)
+        ShardAssignment.objects.filter(shard_of=self.user).update(moving=True)
+        with self.assertRaises(shards.ShardMoving):
+            Transaction.objects.create(name='Salary', amount=Decimal('100.00'), transaction_type='income',
+                                       transaction_of=self.user, category=food)
+        response = self.client.post(reverse('transaction_type_create'), {'name': 'Travel'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '2')
+
+    def test_deleting_the_account_clears_the_shard(self):
+        """Deleting a user removes their rows from their shard too."""
+        shards.move(self.user.pk, 'shard1', grace=0)
+        self.add_transactions()
+        self.user.delete()
+        self.assertFalse(Transaction.objects.using('shard1').exists())
+        self.assertFalse(User.objects.using('shard1').exists())
@@ -0,0 +1,30 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.test import TestCase
+
+from expensemanager.sqlite.base import DatabaseWrapper
+
+
+class SQLiteBackendTestCase(TestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_are_applied(self):
+        """Every connection gets the configured pragmas."""
+        pragmas = settings.DATABASES['default']['OPTIONS']['pragmas']
+        self.assertEqual(self.pragma('busy_timeout'), pragmas['busy_timeout'])
+        self.assertEqual(self.pragma('cache_size'), pragmas['cache_size'])
+        self.assertEqual(self.pragma('temp_store'), 2)
+
+    def test_transaction_mode(self):
+        """The transaction mode is validated and kept out of the sqlite3.connect() arguments."""
+        wrapper = DatabaseWrapper({**connection.settings_dict, 'OPTIONS': {'transaction_mode': 'immediate'}})
+        params = wrapper.get_connection_params()
+        self.assertNotIn('transaction_mode', params)
+        self.assertEqual(wrapper.transaction_mode, 'IMMEDIATE')
+        wrapper = DatabaseWrapper({**connection.settings_dict, 'OPTIONS': {'transaction_mode': 'LAZY'}})
+        with self.assertRaises(ImproperlyConfigured):
+            wrapper.get_connection_params()
@@ -1,11 +1,16 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.contrib.auth.models import User
 from django.urls import reverse
+from django.db import connection
+from django.db.models import F
+from django.test.utils import CaptureQueriesContext
 from django.core.exceptions import ValidationError
 from decimal import Decimal
 import json
+import tempfile
 
-from .models import Transaction, TransactionType, Balance
+from .models import Transaction, TransactionType, Balance, DataVersion
+from . import caching
 from .forms import RegisterForm # For testing registration directly if needed
 
 class ViewTestCase(TestCase):
@@ -214,6 +219,224 @@ class ViewTestCase(TestCase):
         other_user.delete() # Clean up
 
 
+    def test_transaction_summary_reads_monthly_rollups(self):
+        """Test transaction_summary returns per-month totals for each type."""
+        for name, amount, date, trans_type in [
+            ('Salary', '500.00', '2023-01-05', 'income'),
+            ('Rent', '200.00', '2023-01-10', 'expense'),
+            ('Food', '50.00', '2023-01-20', 'expense'),
+            ('Food', '25.00', '2023-02-03', 'expense'),
+        ]:
+            Transaction.objects.create(name=name, amount=Decimal(amount), date=date,
+                                       transaction_type=trans_type, transaction_of=self.user,
+                                       category=self.category)
+
+        response = self.client.get(reverse('transaction_summary'))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([(row['month'], Decimal(row['total'])) for row in data['expenses']], [
+            ('2023-02-01', Decimal('25.00')),
+            ('2023-01-01', Decimal('250.00')),
+        ])
+        self.assertEqual([(row['month'], Decimal(row['total'])) for row in data['incomes']],
+                         [('2023-01-01', Decimal('500.00'))])
+
+    def create_transactions(self, count):
+        for i in range(count):
+            Transaction.objects.create(name=f'Income {i}', amount=Decimal('1.00'),
+                                       date=f'2023-01-{i % 28 + 1:02d}', transaction_type='income',
+                                       transaction_of=self.user, category=self.category)
+
+    def test_transaction_list_keyset_pagination(self):
+        """Test transaction_list pages through every row exactly once, newest first."""
+        self.create_transactions(25)
+        seen = []
+        cursor = None
+        while True:
+            params = {'limit': 10}
+            if cursor:
+                params['cursor'] = cursor
+            data = self.client.get(reverse('transaction_list'), params).json()
+            self.assertLessEqual(len(data['transactions']), 10)
+            seen.extend((row['date'], row['pk']) for row in data['transactions'])
+            cursor = data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(len(seen), 25)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+    def test_transaction_list_invalid_cursor(self):
+        """Test transaction_list rejects a malformed cursor."""
+        response = self.client.get(reverse('transaction_list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.json()['success'])
+
+    def test_transaction_list_stream(self):
+        """Test the streaming mode returns every row as one JSON document."""
+        self.create_transactions(15)
+        response = self.client.get(reverse('transaction_list'), {'stream': '1'})
+        self.assertTrue(response.streaming)
+        data = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(len(data['transactions']), 15)
+
+    def test_transaction_list_view_get_data_is_paginated(self):
+        """Test the AJAX branch of the home page only returns the user's rows, one page at a time."""
+        self.create_transactions(5)
+        other_user = User.objects.create_user(username='listother', password='password')
+        Transaction.objects.create(name='Not mine', amount=Decimal('1.00'), transaction_type='income',
+                                   transaction_of=other_user, category=self.category)
+        response = self.client.get(reverse('home'), {'action': 'get_data', 'limit': 3},
+                                   HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        data = response.json()
+        self.assertEqual(len(data['transactions']), 3)
+        self.assertIsNotNone(data['next_cursor'])
+        response = self.client.get(reverse('home'), {'action': 'get_data', 'cursor': data['next_cursor']},
+                                   HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        data = response.json()
+        self.assertEqual(len(data['transactions']), 2)
+        self.assertIsNone(data['next_cursor'])
+        other_user.delete()
+
+    def count_queries(self, url, params, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params, **headers)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_transaction_listing_query_count_is_constant(self):
+        """Test listing endpoints issue the same number of queries for 3 rows as for 60."""
+        get_data = {'action': 'get_data', 'limit': 100}
+        self.create_transactions(3)
+        small_list = self.count_queries(reverse('transaction_list'), {'limit': 100})
+        small_data = self.count_queries(reverse('home'), get_data, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+
+        other_category = TransactionType.objects.create(name='Second Category', added_by=self.user)
+        self.create_transactions(57)
+        Transaction.objects.filter(pk__in=Transaction.objects.values('pk')[:30]).update(category=other_category)
+        self.assertEqual(self.count_queries(reverse('transaction_list'), {'limit': 100}), small_list)
+        self.assertEqual(self.count_queries(reverse('home'), get_data, HTTP_X_REQUESTED_WITH='XMLHttpRequest'),
+                         small_data)
+
+    def test_transaction_list_view_get_data_rows(self):
+        """Test the AJAX rows carry display labels and category names."""
+        self.create_transactions(1)
+        response = self.client.get(reverse('home'), {'action': 'get_data'}, HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        row = response.json()['transactions'][0]
+        self.assertEqual(row['type'], 'Income')
+        self.assertEqual(row['category'], 'View Test Category')
+        self.assertEqual(row['amount'], '1.00')
+
+    def test_balance_endpoint_is_cached_and_invalidated(self):
+        """Test the balance endpoint is served without recomputing once cached, and refreshed after a write."""
+        self.client.get(reverse('balance'))
+        with CaptureQueriesContext(connection) as queries:
+            data = self.client.get(reverse('balance')).json()
+        self.assertFalse([q for q in queries if 'app_balance' in q['sql'] or 'app_transactionrollup' in q['sql']])
+        self.assertEqual(data, {'balance': '100.00', 'total_transaction': '0.00'})
+
+        Transaction.objects.create(name='Coffee', amount=Decimal('4.50'), transaction_type='expense',
+                                   transaction_of=self.user, category=self.category)
+        data = self.client.get(reverse('balance')).json()
+        self.assertEqual(data, {'balance': '95.50', 'total_transaction': '4.50'})
+
+    def test_analytics_endpoints_answer_conditional_gets(self):
+        """Test the read-only endpoints send an ETag and answer a matching If-None-Match with 304."""
+        for name in ('transaction_summary', 'expense_summary', 'category_wise_expenses', 'balance', 'transaction_list'):
+            response = self.client.get(reverse(name))
+            self.assertEqual(response.status_code, 200, name)
+            self.assertIn('ETag', response, name)
+            self.assertIn('Last-Modified', response, name)
+            response = self.client.get(reverse(name), HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304, name)
+
+    def test_etag_changes_with_data_and_parameters(self):
+        """Test a write or different query parameters produce a new ETag."""
+        etag = self.client.get(reverse('transaction_list'))['ETag']
+        self.assertNotEqual(self.client.get(reverse('transaction_list'), {'limit': 1})['ETag'], etag)
+
+        TransactionType.objects.create(name='Rent', added_by=self.user)
+        response = self.client.get(reverse('transaction_list'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_version_moved_on_by_another_process_is_seen(self):
+        """Test a per-process cache doesn't keep serving a version another server process has moved on."""
+        etag = self.client.get(reverse('balance'))['ETag']
+        # As another process writes: the row moves on, this process's cache isn't told.
+        DataVersion.objects.filter(version_of=self.user).update(version=F('version') + 1)
+        self.assertNotEqual(self.client.get(reverse('balance'))['ETag'], etag)
+
+    def test_shared_cache_keeps_the_version(self):
+        """Test a cache shared between processes serves the version without reading the database."""
+        with tempfile.TemporaryDirectory() as location:
+            shared = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                                  'LOCATION': location}}
+            with override_settings(CACHES=shared):
+                version = caching.data_version(self.user.pk)
+                with self.assertNumQueries(0):
+                    self.assertEqual(caching.data_version(self.user.pk), version)
+
+    def test_cached_responses_are_per_user(self):
+        """Test one user's cached response is never served to another."""
+        Transaction.objects.create(name='Salary', amount=Decimal('10.00'), transaction_type='income',
+                                   transaction_of=self.user, category=self.category)
+        self.assertEqual(len(self.client.get(reverse('transaction_list')).json()['transactions']), 1)
+
+        User.objects.create_user(username='cacheother', password='password')
+        other = Client()
+        other.login(username='cacheother', password='password')
+        self.assertEqual(other.get(reverse('transaction_list')).json()['transactions'], [])
+
+    def test_category_wise_expenses_aggregates_per_category(self):
+        """Test the category endpoint returns one aggregated row per category, expenses only by default."""
+        rent = TransactionType.objects.create(name='Rent', added_by=self.user)
+        for amount, category in ((Decimal('10.00'), self.category), (Decimal('30.00'), self.category),
+                                 (Decimal('50.00'), rent)):
+            Transaction.objects.create(name='Spend', amount=amount, transaction_type='expense',
+                                       transaction_of=self.user, category=category)
+        Transaction.objects.create(name='Refund', amount=Decimal('5.00'), transaction_type='income',
+                                   transaction_of=self.user, category=rent)
+
+        data = self.client.get(reverse('category_wise_expenses')).json()['data']
+        self.assertEqual([row['category'] for row in data], ['Rent', 'View Test Category'])
+        self.assertEqual(data[1], {'category_id': self.category.pk, 'category': 'View Test Category',
+                                   'total': '40.00', 'count': 2, 'average': '20.00', 'min': '10.00', 'max': '30.00'})
+
+        data = self.client.get(reverse('category_wise_expenses'), {'type': 'income'}).json()['data']
+        self.assertEqual([(row['category'], row['total']) for row in data], [('Rent', '5.00')])
+
+    def test_category_wise_expenses_top_and_date_filters(self):
+        """Test top-N folds the remaining categories into 'Other' and the date range filters rows."""
+        for index, name in enumerate(('A', 'B', 'C')):
+            category = TransactionType.objects.create(name=name, added_by=self.user)
+            Transaction.objects.create(name=name, amount=Decimal(10 - index), transaction_type='expense',
+                                       date=f'2024-01-0{index + 1}', transaction_of=self.user, category=category)
+
+        data = self.client.get(reverse('category_wise_expenses'), {'top': 1}).json()['data']
+        self.assertEqual([(row['category'], row['total'], row['count']) for row in data],
+                         [('A', '10.00', 1), ('Other', '17.00', 2)])
+        self.assertIsNone(data[1]['category_id'])
+
+        data = self.client.get(reverse('category_wise_expenses'),
+                               {'start': '2024-01-02', 'end': '2024-01-02'}).json()['data']
+        self.assertEqual([row['category'] for row in data], ['B'])
+
+        for params in ({'type': 'bogus'}, {'top': '0'}, {'start': 'yesterday'}):
+            response = self.client.get(reverse('category_wise_expenses'), params)
+            self.assertEqual(response.status_code, 400, params)
+
+    def test_create_transaction_type_duplicates_are_per_user(self):
+        """Test category names must be unique per user (ignoring case), not across users."""
+        response = self.client.post(reverse('transaction_type_create'), {'name': 'view test CATEGORY'})
+        self.assertIn('error', response.json())
+
+        other_user = User.objects.create_user(username='typeother', password='password')
+        TransactionType.objects.create(name='Travel', added_by=other_user)
+        response = self.client.post(reverse('transaction_type_create'), {'name': 'Travel'})
+        self.assertIn('success', response.json())
+        self.assertTrue(TransactionType.objects.filter(added_by=self.user, name='Travel').exists())
+        other_user.delete()
+
     def tearDown(self):
         # Clean up created objects if not handled by on_delete cascade
         # User and Category are created in setUp, Balance might be created per test.
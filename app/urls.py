@@ -4,20 +4,31 @@ from .views import *
 
 urlpatterns = [
     path('translist/', transaction_list, name='transaction_list'),
+    path('search/', transaction_search, name='transaction_search'),
+    path('changes/', transaction_changes, name='transaction_changes'),
     path('', TransactionListView.as_view(), name='home'),
    
     path('graph/',analysis,name="graph"),
     path('create/', transaction_create_view, name='transaction_create'),
+    path('import/', transaction_import_view, name='transaction_import'),
+    path('export/<str:file_format>/', export_transactions, name='transaction_export'),
     path('transaction_type_create/',create_transaction_type,name='transaction_type_create'),
     path('<int:pk>/update/', TransactionUpdateView.as_view(), name='transaction_update'),
     path('<int:transaction_id>/delete/', delete_transaction, name='transaction_delete'),
     path('currency/',c_ex,name="currency_exchange"),
+    path('currency/rates/', exchange_rates, name='exchange_rates'),
 
     # apis
     path('summary/',transaction_summary,name="transaction_summary"),
     path('analysis/',category_wise_expenses,name="category_wise_expenses"),
     path('balance/',getBalace,name="balance"),
     path('expense-summary/', expense_summary, name='expense_summary'),
+    path('analytics/monthly/', analytics_monthly, name='analytics_monthly'),
+    path('analytics/rolling/', analytics_rolling, name='analytics_rolling'),
+    path('analytics/spending/', analytics_spending, name='analytics_spending'),
+    path('forecast/', balance_forecast, name='balance_forecast'),
+    path('jobs/', job_list, name='job_list'),
+    path('jobs/<int:pk>/', job_status, name='job_status'),
 
     # login view
     path('login/', CustomLoginView.as_view(), name='login'),
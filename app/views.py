@@ -1,21 +1,28 @@
+import io
+
 from django.views.generic import ListView, UpdateView
 from django.shortcuts import render, redirect
 from django.shortcuts import get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from django.db.models.functions import TruncMonth
 from django.template.loader import render_to_string
 from django.contrib.auth.views import LoginView
 from django.contrib import messages
 from django.utils.html import escape
-from django.urls import reverse_lazy
+from django.conf import settings
+from django.urls import reverse, reverse_lazy
 
 from django.core import serializers
 from django.contrib.auth import login
-from django.db.models import Sum
-from django.http import *, HttpResponseForbidden
+from django.db import IntegrityError, router, transaction
+from django.db.models.functions import Lower
+from django.http import *
 from .models import *
 from .forms import *
+from . import (analytics, archive, caching, changes, currency, exporters, forecast, importers, jobs, reports,
+               rollups, routers, search)
+from .serializers import display_rows
+from .pagination import DEFAULT_PAGE_SIZE, STREAM_CHUNK_SIZE, InvalidCursor, page_size, stream_json
 from django.core.exceptions import ValidationError
 
 
@@ -28,13 +35,20 @@ def create_transaction_type(request):
         form = TransactionTypeForm(request.POST)
         if form.is_valid():
             name = escape(form.cleaned_data['name'])
-            if TransactionType.objects.filter(name__iexact=name).exists():
+            # Matches the (added_by, lower(name)) unique index, unlike name__iexact.
+            exists = TransactionType.objects.annotate(lower_name=Lower('name')) \
+                .filter(added_by=request.user, lower_name=name.lower()).exists()
+            if exists:
                 return JsonResponse({'error': f"A transaction type with name '{name}' already exists."})
             else:
                 transaction_type = form.save(commit=False)
                 transaction_type.added_by = request.user
                 transaction_type.name = name
-                transaction_type.save()
+                try:
+                    with transaction.atomic(using=router.db_for_write(TransactionType)):
+                        transaction_type.save()
+                except IntegrityError:
+                    return JsonResponse({'error': f"A transaction type with name '{name}' already exists."})
                 return JsonResponse({'success': f"Transaction type '{name}' added successfully!"})
         else:
             return JsonResponse({'success': False, 'errors': form.errors.as_json()})
@@ -47,22 +61,22 @@ class TransactionListView(ListView):
     model = Transaction
     template_name = 'transaction_list.html'
     context_object_name = 'transactions'
+    paginate_by = DEFAULT_PAGE_SIZE
+
+    def get_queryset(self):
+        return super().get_queryset().filter(transaction_of=self.request.user)
 
     def get(self, request, *args, **kwargs):
         if request.META.get('HTTP_X_REQUESTED_WITH') == 'XMLHttpRequest' and request.GET.get('action') == 'get_data':
-            transactions = self.get_queryset()
+            try:
+                rows, next_cursor = archive.keyset_page(request.user, request.GET.get('cursor'),
+                                                        page_size(request.GET.get('limit')))
+            except InvalidCursor as e:
+                return JsonResponse({'success': False, 'message': str(e)}, status=400)
             data = {
-                'transactions': []
+                'transactions': display_rows(rows),
+                'next_cursor': next_cursor
             }
-            for transaction in transactions:
-                data['transactions'].append({
-                    'name': transaction.name,
-                    'amount': str(transaction.amount),
-                    'date': str(transaction.date),
-                    'type': transaction.get_transaction_type_display(),
-                    'category': transaction.category.name,
-                    'remarks': transaction.remarks
-                })
             return JsonResponse(data, safe=False)
 
         return super().get(request, *args, **kwargs)
@@ -87,6 +101,53 @@ def transaction_create_view(request):
             errors = form.errors.as_json()
             return JsonResponse({'success': False, 'errors': errors})
 
+def transaction_import_view(request):
+    if request.method == 'POST':
+        form = TransactionImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            file_format = form.cleaned_data['format'] or importers.guess_format(upload.name)
+            not_utf8 = JsonResponse({'success': False, 'message': 'The file is not UTF-8 text.'}, status=400)
+            if upload.size > settings.IMPORT_BACKGROUND_BYTES:
+                # Large files are stored and imported by a worker, which
+                # reads them as a stream; the page polls the job.
+                if not importers.is_utf8(upload):
+                    return not_utf8
+                path = importers.store_upload(upload)
+                # Batches already written would be imported twice by a retry.
+                job = jobs.enqueue('import_transactions', request.user, max_attempts=1,
+                                   payload={'format': file_format, 'name': upload.name, 'path': path})
+                return JsonResponse({'success': True, **_job_response(job)}, status=202)
+            try:
+                content = upload.read().decode('utf-8-sig')
+            except UnicodeDecodeError:
+                return not_utf8
+            # A file that can't be parsed to the end is imported up to the
+            # bad line, which is reported with the row errors.
+            result = importers.import_file(request.user, io.StringIO(content, newline=''), file_format)
+            return JsonResponse({'success': True, **result})
+        return JsonResponse({'success': False, 'errors': form.errors.as_json()})
+    form = TransactionImportForm()
+    return render(request, 'transaction_import.html', {'form': form})
+
+def _job_response(job):
+    return {'job': jobs.describe(job), 'status_url': reverse('job_status', args=[job.pk])}
+
+@require_http_methods(['GET', 'POST'])
+def job_list(request):
+    if request.method == 'POST':
+        kind = request.POST.get('kind')
+        if kind not in jobs.USER_TASKS:
+            return JsonResponse({'success': False, 'message': f"Unknown job kind '{kind}'."}, status=400)
+        job = jobs.enqueue(kind, request.user)
+        return JsonResponse({'success': True, **_job_response(job)}, status=202)
+    recent = Job.objects.filter(job_of=request.user).order_by('-created_at')[:20]
+    return JsonResponse({'jobs': [jobs.describe(job) for job in recent]})
+
+def job_status(request, pk):
+    job = get_object_or_404(Job, pk=pk, job_of=request.user)
+    return JsonResponse(jobs.describe(job))
+
 class TransactionUpdateView(UpdateView):
     model = Transaction
     form_class = TransactionUpdateForm
@@ -112,7 +173,10 @@ class TransactionUpdateView(UpdateView):
 
     def form_valid(self, form):
         if form.is_valid():
-            response = super().form_valid(form)
+            try:
+                response = super().form_valid(form)
+            except ValidationError as e:
+                return JsonResponse({'success': False, 'message': e.message if hasattr(e, 'message') else str(e)})
             data = {'success': True}
         else:
             data = {'success': False, 'errors': form.errors}
@@ -124,23 +188,25 @@ def delete_transaction(request, transaction_id):
          return JsonResponse({'success': False, 'message': 'Transaction doesn\'t exists.'})
 
     if request.method == 'DELETE':
-        transaction.delete()
+        try:
+            transaction.delete()
+        except ValidationError as e:
+            return JsonResponse({'success': False, 'message': e.messages[0]})
         return JsonResponse({'success': True})
     
     return JsonResponse({'success': False, 'message': 'Transaction not deleted.'})
    
     
-def getBalace(request):
-    trans_object = Transaction.objects.filter(transaction_of=request.user)
-    transaction_amount = sum(trans.amount for trans in trans_object)
-    balance_obj = Balance.objects.filter(balance_of=request.user).first()
+@caching.versioned_response
+async def getBalace(request):
+    balance = await Balance.objects.filter(balance_of=request.user).values_list('balance', flat=True).afirst()
     current_balance_str = "0.00"
-    if balance_obj:
-        current_balance_str = f"{balance_obj.balance:.2f}" # Ensure two decimal places formatting
+    if balance is not None:
+        current_balance_str = f"{balance:.2f}" # Ensure two decimal places formatting
 
     data = { 
         'balance': current_balance_str, 
-        'total_transaction': transaction_amount 
+        'total_transaction': str(await rollups.agrand_total(request.user))
     }
     return JsonResponse(data)
 
@@ -148,48 +214,150 @@ def getBalace(request):
 def analysis(request):
     return render(request,'trans_analysis.html',{})
 
+@routers.replica_reads
+@caching.versioned_response
 def transaction_list(request):
-    transactions = Transaction.objects.filter(transaction_of=request.user) .values('pk','name','amount','date','transaction_type','category__name','remarks')
-    data = {"transactions": list(transactions) }
+    # Archived transactions are only read once the listing reaches them.
+    try:
+        if request.GET.get('stream') == '1':
+            # Streamed after the view returns, outside its shard and replica routing.
+            rows = archive.stream(request.user, request.GET.get('cursor'), using=router.db_for_read(Transaction),
+                                  chunk_size=STREAM_CHUNK_SIZE)
+            return StreamingHttpResponse(stream_json(rows), content_type='application/json')
+        rows, next_cursor = archive.keyset_page(request.user, request.GET.get('cursor'),
+                                                page_size(request.GET.get('limit')))
+    except InvalidCursor as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    data = {"transactions": rows, "next_cursor": next_cursor }
     return JsonResponse(data)
+
+@caching.versioned_response
+def transaction_search(request):
+    try:
+        start = exporters.parse_date(request.GET.get('start'))
+        end = exporters.parse_date(request.GET.get('end'))
+        categories = [int(category) for category in request.GET.getlist('category')]
+        offset = int(request.GET.get('offset') or 0)
+        if offset < 0:
+            raise ValueError(f"Invalid offset '{offset}'.")
+        limit = page_size(request.GET.get('limit'))
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    rows, next_offset = search.search(request.user, request.GET.get('q', ''), start, end, categories, offset, limit)
+    return JsonResponse({"transactions": rows, "next_offset": next_offset})
+
+@caching.versioned_response
+def transaction_changes(request):
+    # Only what was written or deleted after ``since``; see app.changes.
+    try:
+        since = int(request.GET.get('since') or 0)
+        if since < 0:
+            raise ValueError
+    except ValueError:
+        return JsonResponse({'success': False, 'message': f"Invalid since '{request.GET.get('since')}'."},
+                            status=400)
+    return JsonResponse(changes.changes(request.user.pk, since))
+    
+def export_transactions(request, file_format):
+    if file_format not in exporters.FORMATS:
+        raise Http404(f"Unknown export format '{file_format}'.")
+    try:
+        start = exporters.parse_date(request.GET.get('start'))
+        end = exporters.parse_date(request.GET.get('end'))
+        categories = [int(category) for category in request.GET.getlist('category')]
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+
+    # Streamed after the view returns, outside the user's shard; read from it explicitly.
+    using = router.db_for_read(Transaction)
+    transactions = exporters.filter_transactions(Transaction.objects.using(using).filter(transaction_of=request.user),
+                                                 start, end, categories)
+    archived = None
+    if archive.needed(request.user, start, end):
+        archived = exporters.filter_transactions(
+            ArchivedTransaction.objects.using(using).filter(transaction_of=request.user), start, end, categories)
+    response = StreamingHttpResponse(exporters.export_chunks(transactions, file_format, archived=archived),
+                                     content_type=exporters.FORMATS[file_format])
+    response['Content-Disposition'] = f'attachment; filename="transactions.{file_format}"'
+    return response
     
-def expense_summary(request):
-    expenses = Transaction.objects.filter(transaction_type='expense',transaction_of=request.user) \
-        .annotate(month=TruncMonth('date')) \
-        .values('month') \
-        .annotate(total=Sum('amount')) \
-        .order_by('-month')
+@routers.replica_reads
+@caching.versioned_response
+async def expense_summary(request):
+    # Monthly totals come from the rollup table, not from the raw transactions.
     data = {
-        'expenses': list(expenses)
+        'expenses': await rollups.amonthly_totals(request.user, 'expense')
     }
     return JsonResponse(data)
 
-def transaction_summary(request):
-    expenses = Transaction.objects.filter(transaction_type='expense',transaction_of=request.user) \
-        .annotate(month=TruncMonth('date')) \
-        .values('month') \
-        .annotate(total=Sum('amount')) \
-        .order_by('-month')
-        
-    income = Transaction.objects.filter(transaction_type='income',transaction_of=request.user) \
-        .annotate(month=TruncMonth('date')) \
-        .values('month') \
-        .annotate(total=Sum('amount')) \
-        .order_by('-month')
-
+@routers.replica_reads
+@caching.versioned_response
+async def transaction_summary(request):
     data = {
-        'expenses': list(expenses),
-        'incomes':list(income)
+        'expenses': await rollups.amonthly_totals(request.user, 'expense'),
+        'incomes': await rollups.amonthly_totals(request.user, 'income')
     }
     return JsonResponse(data)  
 
-def category_wise_expenses(request):
-    tsk_model = Transaction.objects.filter(transaction_of=request.user) .values('category__name', 'amount')
-    return JsonResponse({'data': list(tsk_model)}, safe=False)
+@routers.replica_reads
+@caching.versioned_response
+async def category_wise_expenses(request):
+    # Grouped in the database; one row per category rather than per transaction.
+    try:
+        start = exporters.parse_date(request.GET.get('start'))
+        end = exporters.parse_date(request.GET.get('end'))
+        top = request.GET.get('top')
+        top = int(top) if top else None
+        if top is not None and top < 1:
+            raise ValueError(f"Invalid top '{top}'.")
+        transactions = exporters.filter_transactions(Transaction.objects.filter(transaction_of=request.user),
+                                                     start, end)
+        archived = None
+        if await archive.aneeded(request.user, start, end):
+            archived = exporters.filter_transactions(
+                ArchivedTransaction.objects.filter(transaction_of=request.user), start, end)
+        data = await reports.acategory_breakdown(transactions, request.GET.get('type', 'expense'), top, archived)
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+    return JsonResponse({'data': data})
+
+@caching.versioned_response
+def analytics_monthly(request):
+    return JsonResponse(analytics.monthly(analytics.columns(request.user.pk)))
+
+@caching.versioned_response
+def analytics_rolling(request):
+    try:
+        window = int(request.GET.get('window') or analytics.DEFAULT_WINDOW)
+    except ValueError:
+        window = 0
+    if not 1 <= window <= analytics.MAX_WINDOW:
+        return JsonResponse({'success': False, 'message': f'window must be between 1 and {analytics.MAX_WINDOW}.'},
+                            status=400)
+    return JsonResponse(analytics.rolling(analytics.columns(request.user.pk), window))
+
+@caching.versioned_response
+def analytics_spending(request):
+    return JsonResponse(analytics.spending(analytics.columns(request.user.pk)))
+
+# Not a versioned_response: the projection also moves with the calendar.
+def balance_forecast(request):
+    try:
+        months = int(request.GET.get('months') or forecast.DEFAULT_MONTHS)
+    except ValueError:
+        months = 0
+    if not 1 <= months <= forecast.MAX_MONTHS:
+        return JsonResponse({'success': False, 'message': f'months must be between 1 and {forecast.MAX_MONTHS}.'},
+                            status=400)
+    return JsonResponse(forecast.project(request.user.pk, months))
 
 def c_ex(request):
     return render(request,'currency_exchange.html')
 
+def exchange_rates(request):
+    # Served from the local rate table; the converter page makes no outside requests.
+    return JsonResponse({'base': currency.BASE_CURRENCY, 'rates': currency.latest_rates()})
+
 def register(request):
     if request.method == 'POST':
         form = RegisterForm(request.POST)
@@ -1,16 +1,232 @@
+import json
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import JsonResponse
 from django.shortcuts import redirect
 from django.urls import reverse
 
+timing_logger = logging.getLogger('expensemanager.timing')
+
+_IN_LIST = re.compile(r'IN \((?:%s, )*%s\)')
+
+
 class AuthenticationMiddleware:
+    """
+    Send anonymous users to the login page and signed-in users away from
+    the login and registration pages.
+
+    Runs natively under both WSGI and ASGI. The exempt paths are resolved
+    once, when the middleware is created, rather than on every request.
+    """
+    sync_capable = True
+    async_capable = True
+
+    exempt_prefixes = ('/captcha/',)
+
     def __init__(self, get_response):
         self.get_response = get_response
+        self.exempt_paths = frozenset([reverse('login'), reverse('register')])
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
-    def __call__(self, request):
-        if request.user.is_authenticated and (request.path == reverse('login') or request.path == reverse('register') or  request.path.startswith('/captcha/')):
-                return redirect('home')
+    def is_exempt(self, path):
+        return path in self.exempt_paths or path.startswith(self.exempt_prefixes)
 
-        if not request.user.is_authenticated and (request.path != reverse('login') and request.path != reverse('register') and not request.path.startswith('/captcha/')):
+    def redirect_for(self, request, is_authenticated):
+        exempt = self.is_exempt(request.path)
+        if is_authenticated and exempt:
+            return redirect('home')
+        if not is_authenticated and not exempt:
             return redirect('login')
+        return None
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        response = self.redirect_for(request, request.user.is_authenticated)
+        if response is None:
+            response = self.get_response(request)
+        return response
+
+    async def __acall__(self, request):
+        # Loading the user reads the session and the database, which has no
+        # async API in this Django version; doing it here once means async
+        # views can use request.user without blocking the event loop.
+        is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+        response = self.redirect_for(request, is_authenticated)
+        if response is None:
+            response = await self.get_response(request)
+        return response
+
+
+class ShardMiddleware:
+    """
+    Route each signed-in user's queries to their shard (see app.shards).
+
+    Only installed when more than one shard is configured. Writes for a
+    user who is being moved to another shard are answered with 503 and a
+    Retry-After header.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        from app import shards
+
+        if not shards.enabled():
+            raise MiddlewareNotUsed
+        self.shards = shards
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def placement(self, request):
+        return self.shards.placement(request.user.pk) if request.user.is_authenticated else None
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with self.shards.use(self.placement(request)):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        placement = await sync_to_async(self.placement)(request)
+        with self.shards.use(placement):
+            return await self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if isinstance(exception, self.shards.ShardMoving):
+            response = JsonResponse({'success': False, 'message': str(exception)}, status=503)
+            response['Retry-After'] = str(max(1, round(self.shards.MOVE_GRACE)))
+            return response
+        return None
+
+
+class QueryTimingMiddleware:
+    """
+    Opt-in per-request instrumentation, enabled with ``REQUEST_TIMING = True``.
+
+    Counts SQL queries and their cumulative time through a connection
+    execute wrapper, splits the rest into view and template render time,
+    and reports it all in a ``Server-Timing`` header (visible in the
+    browser's network panel) and one JSON log line on the
+    ``expensemanager.timing`` logger. Statements that run
+    ``REQUEST_TIMING_DUPLICATE_THRESHOLD`` or more times with the same
+    shape, the usual sign of an N+1 loop, are logged as a warning.
+
+    Time spent producing a streamed body after the view returns is not
+    included.
+    """
+    def __init__(self, get_response):
+        if not getattr(settings, 'REQUEST_TIMING', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.duplicate_threshold = getattr(settings, 'REQUEST_TIMING_DUPLICATE_THRESHOLD', 5)
+
+    def __call__(self, request):
+        timing = RequestTiming()
+        request._timing = timing
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timing.execute))
+            response = self.get_response(request)
+        timing.finish()
+        duplicates = timing.duplicates(self.duplicate_threshold)
+        response['Server-Timing'] = timing.header(duplicates)
+        self.log(request, response, timing, duplicates)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._timing.view_started = time.perf_counter()
+
+    def process_template_response(self, request, response):
+        timing = request._timing
+        timing.view_finished = time.perf_counter()
+        response.add_post_render_callback(timing.rendered)
+        return response
+
+    def log(self, request, response, timing, duplicates):
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'total_ms': timing.ms(timing.total),
+            'view_ms': timing.ms(timing.view),
+            'render_ms': timing.ms(timing.render),
+            'db_ms': timing.ms(timing.db),
+            'queries': timing.queries,
+            'duplicates': [{'count': count, 'sql': sql} for sql, count in duplicates],
+        }
+        timing_logger.info(json.dumps(record))
+        for sql, count in duplicates:
+            timing_logger.warning('Possible N+1 on %s: %d x %s', request.path, count, sql)
+
+
+class RequestTiming:
+    """Measurements for one request, filled in by QueryTimingMiddleware."""
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.view_started = None
+        self.view_finished = None
+        self.render_finished = None
+        self.total = None
+        self.db = 0.0
+        self.queries = 0
+        self.statements = Counter()
+
+    def execute(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - started
+            self.queries += 1
+            # Placeholders already hide the values; also fold IN lists of any length.
+            self.statements[_IN_LIST.sub('IN (...)', sql)] += 1
+
+    def rendered(self, response):
+        self.render_finished = time.perf_counter()
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+        if self.view_started is not None and self.view_finished is None:
+            # Not a TemplateResponse: any rendering happened inside the view.
+            self.view_finished = time.perf_counter()
+
+    @property
+    def view(self):
+        if self.view_started is None:
+            return None
+        return self.view_finished - self.view_started
+
+    @property
+    def render(self):
+        if self.render_finished is None:
+            return None
+        return self.render_finished - self.view_finished
+
+    def duplicates(self, threshold):
+        return [(sql, count) for sql, count in self.statements.most_common() if count >= threshold]
+
+    @staticmethod
+    def ms(seconds):
+        return None if seconds is None else round(seconds * 1000, 3)
 
-        response = self.get_response(request)
-        return response
\ No newline at end of file
+    def header(self, duplicates):
+        metrics = [f'db;dur={self.ms(self.db)};desc="{self.queries} queries"']
+        if self.view is not None:
+            metrics.append(f'view;dur={self.ms(self.view)}')
+        if self.render is not None:
+            metrics.append(f'render;dur={self.ms(self.render)}')
+        if duplicates:
+            metrics.append(f'n1;desc="{len(duplicates)} repeated statements"')
+        metrics.append(f'total;dur={self.ms(self.total)}')
+        return ', '.join(metrics)
@@ -45,11 +45,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # per-request SQL and timing instrumentation, off unless REQUEST_TIMING is set
+    'expensemanager.middleware.QueryTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    # routes each user's queries to their shard, off with a single shard
+    'expensemanager.middleware.ShardMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     # my custom login status checking middleware
@@ -80,11 +84,130 @@ WSGI_APPLICATION = 'expensemanager.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
 
+# SQLite tuned for a web server with concurrent requests (see
+# expensemanager/sqlite/base.py): WAL so reads never wait for a write,
+# writers that queue for the lock instead of failing, memory-mapped reads
+# and a larger page cache. Connections are kept open for CONN_MAX_AGE
+# seconds so the pragmas aren't paid for on every request.
+SQLITE_PRAGMAS = {
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 5000)),
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -20000,
+    'temp_store': 'MEMORY',
+}
+
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'expensemanager.sqlite',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'pragmas': SQLITE_PRAGMAS,
+            'transaction_mode': 'IMMEDIATE',
+        },
+    }
+}
+
+# Read replica for the analytics endpoints (app/routers.py), off unless
+# READ_REPLICA=1. Locally a second SQLite file stands in for it; copy the
+# data across with ``manage.py sync_replica``. Users read from default for
+# READ_REPLICA_STICKY_SECONDS after each of their writes.
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'NAME': os.environ.get('DB_REPLICA_NAME', BASE_DIR / 'db-replica.sqlite3'),
+    'TEST': {'MIRROR': 'default'},
+}
+REPLICA_DATABASE = 'replica'
+READ_REPLICA = os.environ.get('READ_REPLICA', '') not in ('', '0')
+READ_REPLICA_STICKY_SECONDS = 5
+
+# User sharding (app/shards.py). Each user's rows live in one of SHARDS,
+# e.g. SHARDS=default,shard1,shard2; only 'default' unless set. Run
+# ``migrate --database <alias>`` for every shard, and move users between
+# shards with ``manage.py rebalance_shards``.
+for alias in ('shard1', 'shard2'):
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'NAME': os.environ.get(f'DB_{alias.upper()}_NAME', BASE_DIR / f'db-{alias}.sqlite3'),
     }
+SHARDS = [alias for alias in os.environ.get('SHARDS', 'default').split(',') if alias]
+SHARD_MOVE_GRACE = 2
+
+DATABASE_ROUTERS = ['app.shards.ShardRouter', 'app.routers.ReplicaRouter']
+
+
+# Caches
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# The per-process memory cache works for a single server; point this at
+# Redis or Memcached when running several workers so they share entries.
+# Data versions (app/caching.py) are only cached in a shared cache; with
+# this one they are read from the database on every request.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'expensemanager',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+}
+
+# Cache alias and lifetime for the versioned API responses in app/caching.py.
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = 60 * 60
+
+
+# Currency that balances, summaries and reports are kept in. Other
+# currencies are converted with the rates loaded by load_exchange_rates.
+BASE_CURRENCY = 'USD'
+
+
+# Smoothing factor of the balance forecast (app/forecast.py); higher values
+# follow recent months more closely. Stored states refit when it changes.
+FORECAST_SMOOTHING = '0.3'
+
+
+# Transactions dated more than ARCHIVE_AFTER_DAYS ago are moved to the
+# archive table by ``manage.py archive_transactions`` (app/archive.py).
+ARCHIVE_AFTER_DAYS = 2 * 365
+
+
+# Uploaded files, e.g. statements waiting for a background import. Point
+# this at storage every worker can read when they run on other machines.
+MEDIA_ROOT = BASE_DIR / 'media'
+
+
+# Background jobs (app/jobs.py), run by ``manage.py run_worker``. A failed
+# job is retried after JOB_RETRY_DELAY seconds, doubling each attempt. Workers
+# refresh the lock of the job they run every third of JOB_LOCK_TIMEOUT; a
+# running job whose worker has been silent for JOB_LOCK_TIMEOUT seconds is
+# handed to another worker. Uploads larger than IMPORT_BACKGROUND_BYTES are
+# saved under MEDIA_ROOT and imported by a worker instead of inside the
+# request.
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_DELAY = 30
+JOB_LOCK_TIMEOUT = 10 * 60
+IMPORT_BACKGROUND_BYTES = 1024 * 1024
+
+
+# Request instrumentation (expensemanager.middleware.QueryTimingMiddleware).
+# Enable with REQUEST_TIMING=1 in the environment.
+
+REQUEST_TIMING = os.environ.get('REQUEST_TIMING', '') not in ('', '0')
+REQUEST_TIMING_DUPLICATE_THRESHOLD = 5
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'expensemanager.timing': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+        'app.jobs': {'handlers': ['console'], 'level': 'INFO', 'propagate': False},
+    },
 }
 
 
@@ -0,0 +1,42 @@
+"""
+SQLite backend with per-connection pragmas and a configurable transaction mode.
+
+Two extra keys are read from ``DATABASES[...]['OPTIONS']``:
+
+``pragmas``
+    ``{name: value}`` applied with ``PRAGMA name = value`` to every new
+    connection, in order, e.g. WAL journaling so readers don't wait for
+    writers, and a ``busy_timeout`` so a writer waits for the lock instead
+    of failing at once.
+
+``transaction_mode``
+    ``DEFERRED`` (SQLite's default), ``IMMEDIATE`` or ``EXCLUSIVE``, used
+    for the ``BEGIN`` that opens each ``atomic()`` block. A deferred
+    transaction that reads and then writes can't wait for a concurrent
+    writer, so it fails with "database is locked" whatever the busy timeout;
+    ``IMMEDIATE`` takes the write lock up front, where waiting is possible.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ('DEFERRED', 'IMMEDIATE', 'EXCLUSIVE')
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        self.pragmas = params.pop('pragmas', {})
+        self.transaction_mode = params.pop('transaction_mode', 'DEFERRED').upper()
+        if self.transaction_mode not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f"transaction_mode must be one of {', '.join(TRANSACTION_MODES)}, not '{self.transaction_mode}'.")
+        return params
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        for name, value in self.pragmas.items():
+            conn.execute(f'PRAGMA {name} = {value}')
+        return conn
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f'BEGIN {self.transaction_mode}')